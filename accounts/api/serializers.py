@@ -1,6 +1,8 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers, exceptions
 from accounts.models import UserProfile
+from accounts.services import UserService
+from utils.list_serializers import PrefetchListSerializer
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -16,6 +18,10 @@ class UserSerializerWithProfile(UserSerializer):
     class Meta:
         model = User
         fields = ('id', 'username', 'nickname', 'avatar_url')
+        list_serializer_class = PrefetchListSerializer
+
+    def prefetch_page(self, users):
+        UserService.prime_profiles(users)
 
     def get_avatar_url(self, obj):
         if obj.profile.avatar:
@@ -23,6 +29,18 @@ class UserSerializerWithProfile(UserSerializer):
         return None
 
 
+def render_user_with_profile(user):
+    # the same output as UserSerializerWithProfile(user).data,
+    # without going through the DRF fields
+    profile = user.profile
+    return {
+        'id': user.id,
+        'username': user.username,
+        'nickname': profile.nickname,
+        'avatar_url': profile.avatar.url if profile.avatar else None,
+    }
+
+
 class UserSerializerForTweet(UserSerializerWithProfile):
     pass
 
@@ -1,4 +1,11 @@
 def profile_changed(sender, instance, **kwargs):
     from accounts.services import UserService
+    from tweets.services import TweetService
     UserService.invalidate_profile(instance.user_id)
+    # nickname and avatar are rendered into the user block of tweets
+    TweetService.invalidate_user_fragment(instance.user_id)
 
+
+def user_changed(sender, instance, **kwargs):
+    from tweets.services import TweetService
+    TweetService.invalidate_user_fragment(instance.id)
@@ -1,6 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
-from accounts.listeners import profile_changed
+from accounts.listeners import profile_changed, user_changed
 from utils.listeners import invalidate_object_cache
 from django.db.models.signals import post_save, pre_delete
 
@@ -37,6 +37,8 @@ User.profile = property(get_profile)
 # hook up with listeners to invalidate cache
 pre_delete.connect(invalidate_object_cache, sender=User)
 post_save.connect(invalidate_object_cache, sender=User)
+pre_delete.connect(user_changed, sender=User)
+post_save.connect(user_changed, sender=User)
 
 pre_delete.connect(profile_changed, sender=UserProfile)
 post_save.connect(profile_changed, sender=UserProfile)
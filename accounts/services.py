@@ -1,38 +1,139 @@
 from accounts.models import UserProfile
+from datetime import timedelta
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.cache import caches
-from twitter.cache import USER_PROFILE_PATTERN
+from twitter.cache import USER_LAST_ACTIVE_KEY, USER_PROFILE_PATTERN
+from utils.identity_map import IdentityMap
+from utils.local_cache import LocalCache
 from utils.memcached_helper import MemcachedHelper
+from utils.redis_client import RedisClient
+from utils.time_helpers import EPOCH, datetime_to_microseconds, utc_now
 
 cache = caches['testing'] if settings.TESTING else caches['default']
 
+# sets the last active time of a user, returns the previous one
+MARK_ACTIVE_SCRIPT = """
+local last_active = redis.call('zscore', KEYS[1], ARGV[1])
+redis.call('zadd', KEYS[1], ARGV[2], ARGV[1])
+return last_active
+"""
+
 
 class UserService:
 
     @classmethod
     def get_profile_through_cache(cls, user_id):
-        key = USER_PROFILE_PATTERN.format(user_id=user_id)
+        return cls.get_profiles_through_cache([user_id])[user_id]
 
-        profile = cache.get(key)
-        if profile is not None:
-            return profile
+    @classmethod
+    def get_profiles_through_cache(cls, user_ids):
+        # same as MemcachedHelper.get_objects_through_cache(), the profiles
+        # are looked up by user_id, and returned as {user_id: profile}
+        key_to_user_id = {
+            USER_PROFILE_PATTERN.format(user_id=user_id): user_id
+            for user_id in user_ids
+        }
+        mapped_profiles = IdentityMap.get_many(key_to_user_id.keys())
+        locally_cached_profiles = LocalCache.get_many([
+            key
+            for key in key_to_user_id
+            if key not in mapped_profiles
+        ])
+        cached_profiles = cache.get_many([
+            key
+            for key in key_to_user_id
+            if key not in mapped_profiles and key not in locally_cached_profiles
+        ])
+        LocalCache.set_many(cached_profiles)
+        cached_profiles.update(locally_cached_profiles)
+        IdentityMap.set_many(cached_profiles)
+        cached_profiles.update(mapped_profiles)
 
-        profile, _ = UserProfile.objects.get_or_create(user_id=user_id)
-        cache.set(key, profile)
+        user_id_to_profile = {
+            key_to_user_id[key]: profile
+            for key, profile in cached_profiles.items()
+        }
+        missed_user_ids = [
+            user_id
+            for user_id in key_to_user_id.values()
+            if user_id not in user_id_to_profile
+        ]
+        if not missed_user_ids:
+            return user_id_to_profile
 
-        return profile
+        missed_profiles = {
+            profile.user_id: profile
+            for profile in UserProfile.objects.filter(user_id__in=missed_user_ids)
+        }
+        # users created before UserProfile existed have no profile yet
+        for user_id in missed_user_ids:
+            if user_id not in missed_profiles:
+                missed_profiles[user_id], _ = UserProfile.objects.get_or_create(user_id=user_id)
+        key_to_missed_profile = {
+            USER_PROFILE_PATTERN.format(user_id=user_id): profile
+            for user_id, profile in missed_profiles.items()
+        }
+        cache.set_many(key_to_missed_profile)
+        LocalCache.set_many(key_to_missed_profile)
+        IdentityMap.set_many(key_to_missed_profile)
+        user_id_to_profile.update(missed_profiles)
+        return user_id_to_profile
+
+    @classmethod
+    def prime_profiles(cls, users):
+        # hang the profiles on the users of a page in one batch, so that
+        # user.profile would not go to the cache user by user
+        users = [user for user in users if not hasattr(user, '_cached_user_profile')]
+        user_id_to_profile = cls.get_profiles_through_cache({user.id for user in users})
+        for user in users:
+            user._cached_user_profile = user_id_to_profile[user.id]
 
     @classmethod
     def invalidate_profile(cls, user_id):
         key = USER_PROFILE_PATTERN.format(user_id=user_id)
         cache.delete(key)
+        LocalCache.invalidate(key)
+        IdentityMap.delete(key)
 
     @classmethod
     def get_user_by_id(cls, user_id):
         return MemcachedHelper.get_object_through_cache(User, user_id)
 
     @classmethod
-    def get_profile_through_cache(cls, user_id):
-        key = USER_PROFILE_PATTERN.format(user_id=user_id)
+    def mark_active(cls, user_id):
+        # returns when the user was active before this time,
+        # None if the user has never been seen
+        conn = RedisClient.get_connection()
+        mark_active = conn.register_script(MARK_ACTIVE_SCRIPT)
+        last_active = mark_active(
+            keys=[USER_LAST_ACTIVE_KEY],
+            args=[user_id, datetime_to_microseconds(utc_now())],
+        )
+        if last_active is None:
+            return None
+        return EPOCH + timedelta(microseconds=int(float(last_active)))
 
+    @classmethod
+    def is_dormant(cls, last_active):
+        # the users who have not been seen since the tracking started
+        # are not known to be dormant
+        if last_active is None:
+            return False
+        return last_active < utc_now() - timedelta(seconds=settings.DORMANT_USER_THRESHOLD)
+
+    @classmethod
+    def get_active_user_ids(cls, user_ids):
+        # keeps the order of user_ids, the users who are not tracked yet
+        # are taken as active
+        conn = RedisClient.get_connection()
+        pipe = conn.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.zscore(USER_LAST_ACTIVE_KEY, user_id)
+        active_since = utc_now() - timedelta(seconds=settings.DORMANT_USER_THRESHOLD)
+        active_since = datetime_to_microseconds(active_since)
+        return [
+            user_id
+            for user_id, last_active in zip(user_ids, pipe.execute())
+            if last_active is None or last_active >= active_since
+        ]
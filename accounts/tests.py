@@ -1,4 +1,6 @@
 from accounts.models import UserProfile
+from accounts.services import UserService
+from django.contrib.auth.models import User
 from testing.testcases import TestCase
 
 
@@ -12,4 +14,38 @@ class UserProfileTests(TestCase):
         self.assertEqual(UserProfile.objects.count(), 0)
         pf = pluto.profile
         self.assertEqual(isinstance(pf, UserProfile), True)
-        self.assertEqual(UserProfile.objects.count(), 1)
\ No newline at end of file
+        self.assertEqual(UserProfile.objects.count(), 1)
+
+    def test_get_profiles_through_cache(self):
+        pluto = self.create_user('pluto')
+        brunch = self.create_user('brunch')
+        kitty = self.create_user('kitty')
+        UserProfile.objects.create(user=pluto, nickname='plutokitty')
+        UserProfile.objects.create(user=brunch)
+
+        # cache miss, the missing profile of kitty is created
+        profiles = UserService.get_profiles_through_cache([pluto.id, brunch.id, kitty.id])
+        self.assertEqual(profiles[pluto.id].nickname, 'plutokitty')
+        self.assertEqual(profiles[kitty.id].user_id, kitty.id)
+        self.assertEqual(UserProfile.objects.count(), 3)
+
+        # cache hit, no query would be executed
+        with self.assertNumQueries(0):
+            profiles = UserService.get_profiles_through_cache([kitty.id, pluto.id])
+        self.assertEqual(len(profiles), 2)
+
+        # invalidated profile is reloaded, the others are still cached
+        profile = pluto.profile
+        profile.nickname = 'pluto'
+        profile.save()
+        with self.assertNumQueries(1):
+            profiles = UserService.get_profiles_through_cache([pluto.id, brunch.id])
+        self.assertEqual(profiles[pluto.id].nickname, 'pluto')
+
+        # users of a page are primed at once, user.profile needs no more lookup
+        users = list(User.objects.filter(id__in=[pluto.id, brunch.id, kitty.id]))
+        self.clear_cache()
+        with self.assertNumQueries(1):
+            UserService.prime_profiles(users)
+            for user in users:
+                self.assertEqual(user.profile.user_id, user.id)
@@ -1,9 +1,17 @@
-from accounts.api.serializers import UserSerializerForComment
+from accounts.api.serializers import UserSerializerForComment, render_user_with_profile
+from accounts.services import UserService
 from comments.models import Comment
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from tweets.models import Tweet
 from likes.services import LikeService
+from utils.list_serializers import (
+    PrefetchListSerializer,
+    prime_cached_objects,
+    render_datetime,
+)
+from utils.redis_helper import RedisHelper
+from django.contrib.auth.models import User
 
 
 class CommentSerializer(serializers.ModelSerializer):
@@ -23,11 +31,22 @@ class CommentSerializer(serializers.ModelSerializer):
             'likes_count',
             'has_liked',
         )
+        list_serializer_class = PrefetchListSerializer
+
+    def prefetch_page(self, comments):
+        self._cached_counts, self._liked_ids = prefetch_comments(
+            comments,
+            self.context['request'].user,
+        )
 
     def get_likes_count(self, obj):
-        return obj.like_set.count()
+        if hasattr(self, '_cached_counts') and (obj.id, 'likes_count') in self._cached_counts:
+            return self._cached_counts[(obj.id, 'likes_count')]
+        return RedisHelper.get_count(obj, 'likes_count')
 
     def get_has_liked(self, obj):
+        if hasattr(self, '_liked_ids'):
+            return obj.id in self._liked_ids
         return LikeService.has_liked(self.context['request'].user, obj)
 
 
@@ -62,3 +81,31 @@ class CommentSerializerForUpdate(serializers.ModelSerializer):
         instance.content = validated_data['content']
         instance.save()
         return instance
+
+
+def prefetch_comments(comments, viewer):
+    # what a page of comments needs, loaded in bulk for both CommentSerializer
+    # and render_comments(), returns (counts, liked comment ids)
+    users = prime_cached_objects(comments, User, 'user_id', '_cached_user')
+    UserService.prime_profiles(users)
+    counts = RedisHelper.get_counts(comments, ['likes_count'])
+    return counts, LikeService.has_liked_many(viewer, comments)
+
+
+def render_comments(comments, request):
+    # the same output as CommentSerializer(comments, many=True).data
+    comments = list(comments)
+    counts, liked_ids = prefetch_comments(comments, request.user)
+    return [
+        {
+            'id': comment.id,
+            'tweet_id': comment.tweet_id,
+            'user': render_user_with_profile(comment.cached_user),
+            'content': comment.content,
+            'created_at': render_datetime(comment.created_at),
+            'updated_at': render_datetime(comment.updated_at),
+            'likes_count': counts[(comment.id, 'likes_count')],
+            'has_liked': comment.id in liked_ids,
+        }
+        for comment in comments
+    ]
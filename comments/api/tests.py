@@ -1,6 +1,9 @@
 from testing.testcases import TestCase
 from comments.models import Comment
 from django.utils import timezone
+from twitter.cache import TWEET_COMMENTS_PATTERN
+from utils.paginations import EndlessPagination
+from utils.redis_client import RedisClient
 
 COMMENT_URL = '/api/comments/'
 COMMENT_DETAIL_URL = '/api/comments/{}/'
@@ -26,23 +29,71 @@ class CommentApiTests(TestCase):
             'tweet_id': self.tweet.id,
         })
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data['comments']), 0)
-        # created comments in time order
+        self.assertEqual(len(response.data['results']), 0)
+        # newest comments first
         self.create_comment(self.pluto, self.tweet, '1')
         self.create_comment(self.brunch, self.tweet, '2')
         self.create_comment(self.brunch, self.create_tweet(self.brunch), '3')
         response = self.anonymous_client.get(COMMENT_URL, {
             'tweet_id': self.tweet.id,
         })
-        self.assertEqual(len(response.data['comments']), 2)
-        self.assertEqual(response.data['comments'][0]['content'], '1')
-        self.assertEqual(response.data['comments'][1]['content'], '2')
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(response.data['results'][0]['content'], '2')
+        self.assertEqual(response.data['results'][1]['content'], '1')
+        self.assertEqual(response.data['has_next_page'], False)
         # if both tweet_id and user_id are provided, only tweet_id works in filter
         response = self.anonymous_client.get(COMMENT_URL, {
             'tweet_id': self.tweet.id,
             'user_id': self.pluto.id,
         })
-        self.assertEqual(len(response.data['comments']), 2)
+        self.assertEqual(len(response.data['results']), 2)
+        # tweet_id is validated
+        response = self.anonymous_client.get(COMMENT_URL, {'tweet_id': 'meow'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_pagination(self):
+        page_size = EndlessPagination.page_size
+        comments = [
+            self.create_comment(self.brunch, self.tweet, str(i))
+            for i in range(page_size * 2)
+        ][::-1]
+
+        # the first page is served from the cached list
+        response = self.anonymous_client.get(COMMENT_URL, {'tweet_id': self.tweet.id})
+        self.assertEqual(response.data['has_next_page'], True)
+        self.assertEqual(
+            [comment['id'] for comment in response.data['results']],
+            [comment.id for comment in comments[:page_size]],
+        )
+        conn = RedisClient.get_connection()
+        self.assertEqual(conn.exists(TWEET_COMMENTS_PATTERN.format(tweet_id=self.tweet.id)), 1)
+
+        # the list has been truncated, the last page comes from database
+        response = self.anonymous_client.get(COMMENT_URL, {
+            'tweet_id': self.tweet.id,
+            'created_at__lt': comments[page_size - 1].created_at,
+        })
+        self.assertEqual(response.data['has_next_page'], False)
+        self.assertEqual(
+            [comment['id'] for comment in response.data['results']],
+            [comment.id for comment in comments[page_size:]],
+        )
+
+        # new comments are pushed to the cached list, edits and deletes
+        # invalidate it
+        new_comment = self.create_comment(self.pluto, self.tweet, 'new')
+        response = self.anonymous_client.get(COMMENT_URL, {
+            'tweet_id': self.tweet.id,
+            'created_at__gt': comments[0].created_at,
+        })
+        self.assertEqual([comment['id'] for comment in response.data['results']], [new_comment.id])
+        new_comment.content = 'edited'
+        new_comment.save()
+        response = self.anonymous_client.get(COMMENT_URL, {'tweet_id': self.tweet.id})
+        self.assertEqual(response.data['results'][0]['content'], 'edited')
+        new_comment.delete()
+        response = self.anonymous_client.get(COMMENT_URL, {'tweet_id': self.tweet.id})
+        self.assertEqual(response.data['results'][0]['id'], comments[0].id)
 
     def test_create(self):
         # logged in is mandated
@@ -103,6 +154,7 @@ class CommentApiTests(TestCase):
         self.assertNotEqual(comment.content, 'new')
 
         # can only update comment's content
+        self.anonymous_client.get(COMMENT_URL, {'tweet_id': self.tweet.id})
         before_updated_at = comment.updated_at
         before_created_at = comment.created_at
         now = timezone.now()
@@ -121,6 +173,12 @@ class CommentApiTests(TestCase):
         self.assertNotEqual(comment.created_at, now)
         self.assertNotEqual(comment.updated_at, before_updated_at)
 
+        # the cached comment is updated in place, the list is not dropped
+        key = TWEET_COMMENTS_PATTERN.format(tweet_id=self.tweet.id)
+        self.assertEqual(RedisClient.get_connection().llen(key), 1)
+        response = self.anonymous_client.get(COMMENT_URL, {'tweet_id': self.tweet.id})
+        self.assertEqual(response.data['results'][0]['content'], 'new')
+
     def test_comments_count(self):
         # test tweet detail api
         tweet = self.create_tweet(self.pluto)
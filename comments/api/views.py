@@ -7,17 +7,22 @@ from comments.api.serializers import (
     CommentSerializer,
     CommentSerializerForCreate,
     CommentSerializerForUpdate,
+    render_comments,
 )
+from comments.services import CommentService
 from utils.decorators import required_params
+from utils.paginations import EndlessPagination
 from inbox.services import NotificationService
 from django.utils.decorators import method_decorator
 from ratelimit.decorators import ratelimit
+from gatekeeper.models import GateKeeper
 
 
 class CommentViewSet(viewsets.GenericViewSet):
     serializer_class = CommentSerializerForCreate
     queryset = Comment.objects.all()
     filterset_fields = ('tweet_id',)
+    pagination_class = EndlessPagination
 
     def get_permissions(self):
         if self.action == 'create':
@@ -36,19 +41,24 @@ class CommentViewSet(viewsets.GenericViewSet):
         another way:
         to adopt an external package django-filter
         """
-        queryset = self.get_queryset()
-        comments = self.filter_queryset(queryset)\
-            .prefetch_related('user')\
-            .order_by('created_at')
+        # the filter validates tweet_id, the queryset is only evaluated
+        # when the cached list cannot serve the page
+        queryset = self.filter_queryset(self.get_queryset())
+        tweet_id = request.query_params['tweet_id']
+        cached_comments = CommentService.get_cached_comments(tweet_id)
+        comments_page = self.paginator.paginate_cached_list(cached_comments, request)
+        if comments_page is None:
+            # paginated on the (tweet, created_at) index
+            comments_page = self.paginate_queryset(queryset)
+
+        if GateKeeper.is_switch_on('switch_comments_to_plain_renderer'):
+            return self.get_paginated_response(render_comments(comments_page, request))
         serializer = CommentSerializer(
-            comments,
+            comments_page,
             context={'request': request},
             many=True,
         )
-        return Response(
-            {'comments': serializer.data},
-            status=status.HTTP_200_OK,
-        )
+        return self.get_paginated_response(serializer.data)
 
     @method_decorator(ratelimit(key='user', rate='3/s', method='POST', block=True))
     def create(self, request, *args, **kwargs):
@@ -1,3 +1,4 @@
+from gatekeeper.models import GateKeeper
 from utils.redis_helper import RedisHelper
 
 
@@ -8,6 +9,10 @@ def incr_comments_count(sender, instance, created, **kwargs):
     if not created:
         return
 
+    if GateKeeper.is_switch_on('switch_counts_to_write_behind'):
+        RedisHelper.buffer_count_delta(Tweet(id=instance.tweet_id), 'comments_count', 1)
+        return
+
     Tweet.objects.filter(id=instance.tweet_id)\
         .update(comments_count=F('comments_count') + 1)
     RedisHelper.incr_count(instance.tweet, 'comments_count')
@@ -17,6 +22,25 @@ def decr_comments_count(sender, instance, **kwargs):
     from tweets.models import Tweet
     from django.db.models import F
 
+    if GateKeeper.is_switch_on('switch_counts_to_write_behind'):
+        RedisHelper.buffer_count_delta(Tweet(id=instance.tweet_id), 'comments_count', -1)
+        return
+
     Tweet.objects.filter(id=instance.tweet_id) \
         .update(comments_count=F('comments_count') - 1)
-    RedisHelper.decr_count(instance.tweet, 'comments_count')
\ No newline at end of file
+    RedisHelper.decr_count(instance.tweet, 'comments_count')
+
+
+def push_comment_to_cache(sender, instance, created, **kwargs):
+    from comments.services import CommentService
+
+    if created:
+        CommentService.push_comment_to_cache(instance)
+        return
+    # the content of a cached comment has been changed
+    CommentService.update_comment_in_cache(instance)
+
+
+def remove_comment_from_cache(sender, instance, **kwargs):
+    from comments.services import CommentService
+    CommentService.remove_comment_from_cache(instance)
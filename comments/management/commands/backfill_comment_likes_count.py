@@ -0,0 +1,49 @@
+from comments.models import Comment
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from likes.models import Like
+from utils.redis_client import RedisClient
+from utils.redis_helper import RedisHelper
+
+
+class Command(BaseCommand):
+    help = 'Fill Comment.likes_count of the existing comments from the likes table, ' \
+           'chunk by chunk in id order. Run it while switch_counts_to_write_behind ' \
+           'is off, otherwise the buffered deltas would be counted twice.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        likes_count = Like.objects.filter(
+            content_type=ContentType.objects.get_for_model(Comment),
+            object_id=OuterRef('id'),
+        ).order_by().values('object_id').annotate(count=Count('id')).values('count')
+
+        last_id, total = 0, 0
+        while True:
+            comment_ids = list(
+                Comment.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:chunk_size]
+            )
+            if not comment_ids:
+                break
+
+            # counted and written by one UPDATE, so that the likes created
+            # while backfilling are not lost
+            Comment.objects.filter(id__in=comment_ids).update(
+                likes_count=Coalesce(Subquery(likes_count, output_field=IntegerField()), 0),
+            )
+            # the cached counts would be rebuilt from database
+            RedisClient.get_connection().delete(*[
+                RedisHelper.get_count_key(Comment(id=comment_id), 'likes_count')
+                for comment_id in comment_ids
+            ])
+
+            last_id = comment_ids[-1]
+            total += len(comment_ids)
+            self.stdout.write('{} comments have been backfilled.'.format(total))
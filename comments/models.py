@@ -5,7 +5,12 @@ from likes.models import Like
 from django.contrib.contenttypes.models import ContentType
 from utils.memcached_helper import MemcachedHelper
 from django.db.models.signals import pre_delete, post_save
-from comments.listeners import incr_comments_count, decr_comments_count
+from comments.listeners import (
+    incr_comments_count,
+    decr_comments_count,
+    push_comment_to_cache,
+    remove_comment_from_cache,
+)
 
 
 class Comment(models.Model):
@@ -20,6 +25,10 @@ class Comment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # maintained by likes.listeners in the same way as Tweet.likes_count,
+    # filled for the existing comments by backfill_comment_likes_count
+    likes_count = models.IntegerField(default=0, null=True)
+
     class Meta:
         # under a certain tweet, all the comments are ordered by created time
         index_together = (('tweet', 'created_at'),)
@@ -41,8 +50,12 @@ class Comment(models.Model):
 
     @property
     def cached_user(self):
+        if hasattr(self, '_cached_user'):
+            return self._cached_user
         return MemcachedHelper.get_object_through_cache(User, self.user_id)
 
 
 pre_delete.connect(decr_comments_count, sender=Comment)
-post_save.connect(incr_comments_count, sender=Comment)
\ No newline at end of file
+post_save.connect(incr_comments_count, sender=Comment)
+pre_delete.connect(remove_comment_from_cache, sender=Comment)
+post_save.connect(push_comment_to_cache, sender=Comment)
@@ -0,0 +1,43 @@
+from comments.models import Comment
+from twitter.cache import TWEET_COMMENTS_PATTERN
+from django.conf import settings
+from utils.redis_helper import RedisHelper
+
+
+class CommentService(object):
+
+    @classmethod
+    def get_cached_comments(cls, tweet_id):
+        # newest first, the same as the other cached lists
+        queryset = Comment.objects.filter(tweet_id=tweet_id).order_by('-created_at')
+        key = TWEET_COMMENTS_PATTERN.format(tweet_id=tweet_id)
+        return RedisHelper.load_lazy_cached_list(key, queryset)
+
+    @classmethod
+    def push_comment_to_cache(cls, comment):
+        queryset = Comment.objects.filter(tweet_id=comment.tweet_id).order_by('-created_at')
+        key = TWEET_COMMENTS_PATTERN.format(tweet_id=comment.tweet_id)
+        RedisHelper.push_object(key, comment, queryset)
+
+    @classmethod
+    def remove_comment_from_cache(cls, comment):
+        key = TWEET_COMMENTS_PATTERN.format(tweet_id=comment.tweet_id)
+        RedisHelper.remove_object(key, comment)
+
+    @classmethod
+    def update_comment_in_cache(cls, comment):
+        key = TWEET_COMMENTS_PATTERN.format(tweet_id=comment.tweet_id)
+        RedisHelper.replace_object(key, comment)
+
+    @classmethod
+    def get_latest_comments(cls, tweet_id, limit):
+        # returns the latest limit comments, and whether there are more comments,
+        # i.e. the first page of the comments api
+        cached_comments = cls.get_cached_comments(tweet_id)
+        comments = cached_comments[:limit + 1]
+        if len(comments) <= limit and len(cached_comments) >= settings.REDIS_LIST_LENGTH_LIMIT:
+            # the cached list has been truncated, there might be more in database
+            comments = list(
+                Comment.objects.filter(tweet_id=tweet_id).order_by('-created_at')[:limit + 1]
+            )
+        return comments[:limit], len(comments) > limit
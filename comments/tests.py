@@ -1,4 +1,9 @@
 from testing.testcases import TestCase
+from comments.models import Comment
+from django.core.management import call_command
+from utils.redis_helper import RedisHelper
+
+import io
 
 
 class CommentModelTests(TestCase):
@@ -23,4 +28,33 @@ class CommentModelTests(TestCase):
 
         brunch = self.create_user('brunch')
         self.create_like(brunch, self.comment)
-        self.assertEqual(self.comment.like_set.count(), 2)
\ No newline at end of file
+        self.assertEqual(self.comment.like_set.count(), 2)
+
+    def test_likes_count(self):
+        brunch = self.create_user('brunch')
+        self.create_like(self.pluto, self.comment)
+        self.create_like(brunch, self.comment)
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.likes_count, 2)
+        self.assertEqual(RedisHelper.get_count(self.comment, 'likes_count'), 2)
+
+        self.comment.like_set.filter(user=brunch).first().delete()
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.likes_count, 1)
+        self.assertEqual(RedisHelper.get_count(self.comment, 'likes_count'), 1)
+
+    def test_backfill_likes_count(self):
+        comments = [self.comment] + [self.create_comment(self.pluto, self.tweet) for _ in range(2)]
+        for comment in comments[:2]:
+            self.create_like(self.pluto, comment)
+        # counts left behind by the comments created before likes_count exists
+        Comment.objects.update(likes_count=0)
+        RedisHelper.get_count(comments[0], 'likes_count')
+
+        call_command('backfill_comment_likes_count', chunk_size=2, stdout=io.StringIO())
+        counts = RedisHelper.get_counts(comments, ['likes_count'])
+        self.assertEqual([counts[(c.id, 'likes_count')] for c in comments], [1, 1, 0])
+        self.assertEqual(
+            list(Comment.objects.order_by('id').values_list('likes_count', flat=True)),
+            [1, 1, 0],
+        )
@@ -5,6 +5,8 @@ from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from friendships.services import FriendshipService
 from accounts.services import UserService
+from utils.list_serializers import PrefetchListSerializer
+from utils.memcached_helper import MemcachedHelper
 
 
 class BaseFriendshipSerializer(serializers.Serializer):
@@ -12,6 +14,9 @@ class BaseFriendshipSerializer(serializers.Serializer):
     created_at = serializers.SerializerMethodField()
     has_followed = serializers.SerializerMethodField()
 
+    class Meta:
+        list_serializer_class = PrefetchListSerializer
+
     def update(self, instance, validated_data):
         pass
 
@@ -35,8 +40,18 @@ class BaseFriendshipSerializer(serializers.Serializer):
     def get_has_followed(self, obj):
         return self.get_user_id(obj) in self._get_following_user_id_set()
 
+    def prefetch_page(self, friendships):
+        user_ids = [self.get_user_id(friendship) for friendship in friendships]
+        users = MemcachedHelper.get_objects_through_cache(User, user_ids)
+        UserService.prime_profiles(users)
+        self._cached_users = {user.id: user for user in users}
+
     def get_user(self, obj):
-        user = UserService.get_user_by_id(self.get_user_id(obj))
+        user_id = self.get_user_id(obj)
+        if hasattr(self, '_cached_users') and user_id in self._cached_users:
+            user = self._cached_users[user_id]
+        else:
+            user = UserService.get_user_by_id(user_id)
         return UserSerializerForFriendship(user).data
 
     def get_created_at(self, obj):
@@ -80,8 +95,8 @@ class FriendshipSerializerForCreate(serializers.ModelSerializer):
         return attrs
 
     def create(self, validated_data):
-        following_user_id = validated_data['following_user_id'],
-        followed_user_id = validated_data['followed_user_id'],
+        following_user_id = validated_data['following_user_id']
+        followed_user_id = validated_data['followed_user_id']
         return FriendshipService.follow(
             following_user_id=following_user_id,
             followed_user_id=followed_user_id,
@@ -2,4 +2,27 @@ def invalidate_following_cache(sender, instance, **kwargs):
     # to prevent circular reference,
     # this import sentence should be in def function
     from friendships.services import FriendshipService
-    FriendshipService.invalidate_following_cache(instance.following_user_id)
\ No newline at end of file
+    FriendshipService.invalidate_following_cache(instance.following_user_id)
+
+
+def backfill_newsfeeds(sender, instance, created, **kwargs):
+    if not created:
+        return
+
+    from newsfeeds.services import NewsFeedService
+    NewsFeedService.invalidate_pulled_followings([instance.following_user_id])
+    NewsFeedService.record_friendship_change(
+        instance.following_user_id,
+        instance.followed_user_id,
+        is_following=True,
+    )
+
+
+def retract_newsfeeds(sender, instance, **kwargs):
+    from newsfeeds.services import NewsFeedService
+    NewsFeedService.invalidate_pulled_followings([instance.following_user_id])
+    NewsFeedService.record_friendship_change(
+        instance.following_user_id,
+        instance.followed_user_id,
+        is_following=False,
+    )
@@ -1,7 +1,11 @@
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import pre_delete, post_save
-from friendships.listeners import invalidate_following_cache
+from django.db.models.signals import post_delete, pre_delete, post_save
+from friendships.listeners import (
+    backfill_newsfeeds,
+    invalidate_following_cache,
+    retract_newsfeeds,
+)
 from utils.memcached_helper import MemcachedHelper
 
 
@@ -49,3 +53,7 @@ class Friendship(models.Model):
 # hook up with listeners to invalidate cache
 pre_delete.connect(invalidate_following_cache, sender=Friendship)
 post_save.connect(invalidate_following_cache, sender=Friendship)
+
+# merge or remove the tweets of the followed user in the newsfeeds
+post_save.connect(backfill_newsfeeds, sender=Friendship)
+post_delete.connect(retract_newsfeeds, sender=Friendship)
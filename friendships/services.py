@@ -48,6 +48,10 @@ class FriendshipService(object):
         friendships = Friendship.objects.filter(followed_user_id=followed_user_id)
         return [friendship.following_user_id for friendship in friendships]
 
+    @classmethod
+    def get_follower_count(cls, followed_user_id):
+        return Friendship.objects.filter(followed_user_id=followed_user_id).count()
+
     @classmethod
     def get_following_user_id_set(cls, following_user_id):
         key = FOLLOWINGS_PATTERN.format(user_id=following_user_id)
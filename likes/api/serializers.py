@@ -1,10 +1,17 @@
-from accounts.api.serializers import UserSerializerForLike
+from accounts.api.serializers import UserSerializerForLike, render_user_with_profile
+from accounts.services import UserService
 from comments.models import Comment
 from django.contrib.contenttypes.models import ContentType
 from likes.models import Like
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from tweets.models import Tweet
+from utils.list_serializers import (
+    PrefetchListSerializer,
+    prime_cached_objects,
+    render_datetime,
+)
+from django.contrib.auth.models import User
 
 
 class LikeSerializer(serializers.ModelSerializer):
@@ -13,6 +20,10 @@ class LikeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Like
         fields = ('user', 'created_at')
+        list_serializer_class = PrefetchListSerializer
+
+    def prefetch_page(self, likes):
+        prefetch_likes(likes)
 
 
 class BaseLikeSerializerForCreateAndCancel(serializers.ModelSerializer):
@@ -66,4 +77,21 @@ class LikeSerializerForCancel(BaseLikeSerializerForCreateAndCancel):
         return deleted
 
 
-
+def prefetch_likes(likes):
+    # the users of a page of likes, loaded in bulk for both LikeSerializer
+    # and render_likes()
+    users = prime_cached_objects(likes, User, 'user_id', '_cached_user')
+    UserService.prime_profiles(users)
+
+
+def render_likes(likes):
+    # the same output as LikeSerializer(likes, many=True).data
+    likes = list(likes)
+    prefetch_likes(likes)
+    return [
+        {
+            'user': render_user_with_profile(like.cached_user),
+            'created_at': render_datetime(like.created_at),
+        }
+        for like in likes
+    ]
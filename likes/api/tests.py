@@ -1,5 +1,12 @@
 from testing.testcases import TestCase
+from django.db import DatabaseError
 from rest_framework.test import APIClient
+from gatekeeper.models import GateKeeper
+from tweets.tasks import flush_count_deltas_task
+from twitter.cache import FLUSHING_COUNT_DELTAS_KEY
+from utils.redis_client import RedisClient
+from utils.redis_helper import RedisHelper
+from unittest import mock
 
 
 LIKE_BASE_URL = '/api/likes/'
@@ -167,18 +174,18 @@ class LikeApiTests(TestCase):
         anonymous_client = APIClient()
         response = anonymous_client.get(COMMENT_LIST_API, {'tweet_id': tweet.id})
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.data['comments'][0]['has_liked'], False)
-        self.assertEqual(response.data['comments'][0]['likes_count'], 0)
+        self.assertEqual(response.data['results'][0]['has_liked'], False)
+        self.assertEqual(response.data['results'][0]['likes_count'], 0)
 
         # test comments list api
         response = self.brunch_client.get(COMMENT_LIST_API, {'tweet_id': tweet.id})
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.data['comments'][0]['has_liked'], False)
-        self.assertEqual(response.data['comments'][0]['likes_count'], 0)
+        self.assertEqual(response.data['results'][0]['has_liked'], False)
+        self.assertEqual(response.data['results'][0]['likes_count'], 0)
         self.create_like(self.brunch, comment)
         response = self.brunch_client.get(COMMENT_LIST_API, {'tweet_id': tweet.id})
-        self.assertEqual(response.data['comments'][0]['has_liked'], True)
-        self.assertEqual(response.data['comments'][0]['likes_count'], 1)
+        self.assertEqual(response.data['results'][0]['has_liked'], True)
+        self.assertEqual(response.data['results'][0]['likes_count'], 1)
 
         # test tweet detail api
         self.create_like(self.pluto, comment)
@@ -279,4 +286,63 @@ class LikeApiTests(TestCase):
         response = self.pluto_client.get(newsfeeds_url)
         self.assertEqual(response.data['results'][0]['tweet']['likes_count'], 3)
         response = self.brunch_client.get(newsfeeds_url)
-        self.assertEqual(response.data['results'][0]['tweet']['likes_count'], 3)
\ No newline at end of file
+        self.assertEqual(response.data['results'][0]['tweet']['likes_count'], 3)
+
+    def test_likes_count_write_behind(self):
+        GateKeeper.set_kv('switch_counts_to_write_behind', 'percent', 100)
+        tweet = self.create_tweet(self.pluto)
+        data = {'content_type': 'tweet', 'object_id': tweet.id}
+        tweet_url = TWEET_DETAIL_API.format(tweet.id)
+
+        # the cached count is updated at once, database is not
+        self.pluto_client.post(LIKE_BASE_URL, data)
+        self.brunch_client.post(LIKE_BASE_URL, data)
+        response = self.brunch_client.get(tweet_url)
+        self.assertEqual(response.data['likes_count'], 2)
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 0)
+
+        # pending deltas are counted in when the cached count is rebuilt
+        self.brunch_client.post(LIKE_CANCEL_URL, data)
+        RedisClient.get_connection().delete(RedisHelper.get_count_key(tweet, 'likes_count'))
+        response = self.brunch_client.get(tweet_url)
+        self.assertEqual(response.data['likes_count'], 1)
+
+        # deltas are flushed into database in one batch
+        another_tweet = self.create_tweet(self.brunch)
+        self.pluto_client.post(LIKE_BASE_URL, {'content_type': 'tweet', 'object_id': another_tweet.id})
+        flush_count_deltas_task()
+        tweet.refresh_from_db()
+        another_tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 1)
+        self.assertEqual(another_tweet.likes_count, 1)
+        response = self.brunch_client.get(tweet_url)
+        self.assertEqual(response.data['likes_count'], 1)
+
+        # nothing to flush, database is not touched
+        with self.assertNumQueries(0):
+            flush_count_deltas_task()
+
+        # a flush which failed after it committed is neither counted twice
+        # by a cold count nor applied twice by the retry
+        self.pluto_client.post(LIKE_CANCEL_URL, data)
+        apply_count_deltas = RedisHelper._apply_count_deltas
+
+        def apply_and_fail(deltas, flush_id):
+            apply_count_deltas(deltas, flush_id)
+            raise DatabaseError('lost connection after commit')
+
+        with mock.patch.object(RedisHelper, '_apply_count_deltas', side_effect=apply_and_fail):
+            with self.assertRaises(DatabaseError):
+                flush_count_deltas_task()
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 0)
+        conn = RedisClient.get_connection()
+        self.assertTrue(conn.exists(FLUSHING_COUNT_DELTAS_KEY))
+        conn.delete(RedisHelper.get_count_key(tweet, 'likes_count'))
+        response = self.brunch_client.get(tweet_url)
+        self.assertEqual(response.data['likes_count'], 0)
+        flush_count_deltas_task()
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 0)
+        self.assertFalse(conn.exists(FLUSHING_COUNT_DELTAS_KEY))
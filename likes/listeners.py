@@ -1,33 +1,69 @@
+from gatekeeper.models import GateKeeper
 from utils.redis_helper import RedisHelper
 
 
-def incr_likes_count(sender, instance, created, **kwargs):
+def _get_counted_model_class(instance):
     from tweets.models import Tweet
+    from comments.models import Comment
+
+    # both tweets and comments keep a denormalized likes_count
+    model_class = instance.content_type.model_class()
+    if model_class in (Tweet, Comment):
+        return model_class
+    return None
+
+
+def incr_likes_count(sender, instance, created, **kwargs):
     from django.db.models import F
 
     if not created:
         return
 
-    model_class = instance.content_type.model_class()
-    if model_class != Tweet:
+    model_class = _get_counted_model_class(instance)
+    if model_class is None:
+        return
+
+    if GateKeeper.is_switch_on('switch_counts_to_write_behind'):
+        # no need to load the liked object, its id is enough to locate the count
+        RedisHelper.buffer_count_delta(model_class(id=instance.object_id), 'likes_count', 1)
         return
 
     # Way 1: not trigger listeners
     # using F function generate an SQL expression at database level
     # https://docs.djangoproject.com/en/4.0/ref/models/expressions/#f-expressions
-    Tweet.objects.filter(id=instance.object_id).update(likes_count=F('likes_count') + 1)
-    tweet = instance.content_object
-    RedisHelper.incr_count(tweet, 'likes_count')
+    model_class.objects.filter(id=instance.object_id).update(likes_count=F('likes_count') + 1)
+    RedisHelper.incr_count(instance.content_object, 'likes_count')
 
 
 def decr_likes_count(sender, instance, **kwargs):
-    from tweets.models import Tweet
     from django.db.models import F
 
-    model_class = instance.content_type.model_class()
-    if model_class != Tweet:
+    model_class = _get_counted_model_class(instance)
+    if model_class is None:
         return
 
-    Tweet.objects.filter(id=instance.object_id).update(likes_count=F('likes_count') - 1)
-    tweet = instance.content_object
-    RedisHelper.decr_count(tweet, 'likes_count')
\ No newline at end of file
+    if GateKeeper.is_switch_on('switch_counts_to_write_behind'):
+        RedisHelper.buffer_count_delta(model_class(id=instance.object_id), 'likes_count', -1)
+        return
+
+    model_class.objects.filter(id=instance.object_id).update(likes_count=F('likes_count') - 1)
+    RedisHelper.decr_count(instance.content_object, 'likes_count')
+
+
+def push_like_to_cache(sender, instance, created, **kwargs):
+    from tweets.models import Tweet
+    from likes.services import LikeService
+
+    # only the likes of tweets are cached for the tweet detail api
+    if not created or instance.content_type.model_class() != Tweet:
+        return
+    LikeService.push_tweet_like_to_cache(instance)
+
+
+def remove_like_from_cache(sender, instance, **kwargs):
+    from tweets.models import Tweet
+    from likes.services import LikeService
+
+    if instance.content_type.model_class() != Tweet:
+        return
+    LikeService.remove_tweet_like_from_cache(instance)
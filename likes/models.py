@@ -4,7 +4,12 @@ from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from utils.memcached_helper import MemcachedHelper
 from django.db.models.signals import pre_delete, post_save
-from likes.listeners import incr_likes_count, decr_likes_count
+from likes.listeners import (
+    incr_likes_count,
+    decr_likes_count,
+    push_like_to_cache,
+    remove_like_from_cache,
+)
 
 
 class Like(models.Model):
@@ -41,8 +46,12 @@ class Like(models.Model):
 
     @property
     def cached_user(self):
+        if hasattr(self, '_cached_user'):
+            return self._cached_user
         return MemcachedHelper.get_object_through_cache(User, self.user_id)
 
 
 pre_delete.connect(decr_likes_count, sender=Like)
 post_save.connect(incr_likes_count, sender=Like)
+pre_delete.connect(remove_like_from_cache, sender=Like)
+post_save.connect(push_like_to_cache, sender=Like)
@@ -1,5 +1,9 @@
 from likes.models import Like
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from tweets.models import Tweet
+from twitter.cache import TWEET_LIKES_PATTERN
+from utils.redis_helper import RedisHelper
 
 
 class LikeService(object):
@@ -13,3 +17,47 @@ class LikeService(object):
             object_id=target.id,
             user=user,
         ).exists()
+
+    @classmethod
+    def has_liked_many(cls, user, targets):
+        # resolve a whole page with one query, returns the ids of the liked targets,
+        # targets are supposed to be of the same model
+        if user.is_anonymous or not targets:
+            return set()
+        return set(Like.objects.filter(
+            content_type=ContentType.objects.get_for_model(targets[0].__class__),
+            object_id__in=[target.id for target in targets],
+            user=user,
+        ).values_list('object_id', flat=True))
+
+    @classmethod
+    def _get_tweet_likes_queryset(cls, tweet_id):
+        return Like.objects.filter(
+            content_type=ContentType.objects.get_for_model(Tweet),
+            object_id=tweet_id,
+        ).order_by('-created_at')
+
+    @classmethod
+    def get_cached_tweet_likes(cls, tweet_id):
+        key = TWEET_LIKES_PATTERN.format(tweet_id=tweet_id)
+        return RedisHelper.load_lazy_cached_list(key, cls._get_tweet_likes_queryset(tweet_id))
+
+    @classmethod
+    def push_tweet_like_to_cache(cls, like):
+        key = TWEET_LIKES_PATTERN.format(tweet_id=like.object_id)
+        RedisHelper.push_object(key, like, cls._get_tweet_likes_queryset(like.object_id))
+
+    @classmethod
+    def remove_tweet_like_from_cache(cls, like):
+        key = TWEET_LIKES_PATTERN.format(tweet_id=like.object_id)
+        RedisHelper.remove_object(key, like)
+
+    @classmethod
+    def get_latest_tweet_likes(cls, tweet_id, limit):
+        # returns the latest limit likes, and whether there are more likes
+        cached_likes = cls.get_cached_tweet_likes(tweet_id)
+        likes = cached_likes[:limit + 1]
+        if len(likes) <= limit and len(cached_likes) >= settings.REDIS_LIST_LENGTH_LIMIT:
+            # the cached list has been truncated, there might be more in database
+            likes = list(cls._get_tweet_likes_queryset(tweet_id)[:limit + 1])
+        return likes[:limit], len(likes) > limit
@@ -1,6 +1,12 @@
 from rest_framework import serializers
 from newsfeeds.models import NewsFeed
-from tweets.api.serializers import TweetSerializer
+from tweets.api.serializers import TweetSerializer, render_tweets
+from tweets.models import Tweet
+from utils.list_serializers import (
+    PrefetchListSerializer,
+    prime_cached_objects,
+    render_datetime,
+)
 
 
 class NewsFeedSerializer(serializers.ModelSerializer):
@@ -9,4 +15,24 @@ class NewsFeedSerializer(serializers.ModelSerializer):
     class Meta:
         model = NewsFeed
         fields = ('id', 'created_at', 'tweet')
+        list_serializer_class = PrefetchListSerializer
 
+    def prefetch_page(self, newsfeeds):
+        # tweets of the page first, then the authors of these tweets
+        tweets = prime_cached_objects(newsfeeds, Tweet, 'tweet_id', '_cached_tweet')
+        self.fields['tweet'].prefetch_page(tweets)
+
+
+def render_newsfeeds(newsfeeds, request):
+    # the same output as NewsFeedSerializer(newsfeeds, many=True).data
+    newsfeeds = list(newsfeeds)
+    prime_cached_objects(newsfeeds, Tweet, 'tweet_id', '_cached_tweet')
+    tweets = [newsfeed.cached_tweet for newsfeed in newsfeeds]
+    return [
+        {
+            'id': newsfeed.id,
+            'created_at': render_datetime(newsfeed.created_at),
+            'tweet': tweet_data,
+        }
+        for newsfeed, tweet_data in zip(newsfeeds, render_tweets(tweets, request))
+    ]
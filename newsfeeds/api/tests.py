@@ -1,14 +1,27 @@
+from accounts.services import UserService
 from rest_framework.test import APIClient
 from testing.testcases import TestCase
 from utils.paginations import EndlessPagination
 from django.conf import settings
+from django.test.utils import override_settings
 from friendships.models import Friendship
 from newsfeeds.models import NewsFeed
 from newsfeeds.services import NewsFeedService
+from gatekeeper.models import GateKeeper
+from twitter.cache import USER_NEWSFEEDS_TIMELINE_PATTERN, USER_PROFILE_PATTERN
+from utils.redis_client import RedisClient
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from tweets.services import TweetService
+from unittest import mock
+from django.contrib.auth.models import User
+from utils.local_cache import LocalCache
+from utils.memcached_helper import MemcachedHelper
 
 NEWSFEEDS_URL = '/api/newsfeeds/'
 POST_TWEETS_URL = '/api/tweets/'
 FOLLOW_URL = '/api/friendships/{}/follow/'
+UNFOLLOW_URL = '/api/friendships/{}/unfollow/'
 
 
 class NewsFeedApiTests(TestCase):
@@ -107,6 +120,120 @@ class NewsFeedApiTests(TestCase):
         self.assertEqual(len(response.data['results']), 1)
         self.assertEqual(response.data['results'][0]['id'], new_newsfeed.id)
 
+    def test_pagination_with_hybrid_fanout(self):
+        GateKeeper.set_kv('switch_newsfeeds_to_hybrid_fanout', 'percent', 100)
+        celebrity = self.create_user('celebrity')
+        friend = self.create_user('friend')
+        self.create_friendship(self.pluto, celebrity)
+        self.create_friendship(self.pluto, friend)
+        for i in range(settings.HYBRID_FANOUT_FOLLOWER_THRESHOLD - 1):
+            self.create_friendship(self.create_user('fan{}'.format(i)), celebrity)
+
+        tweets = []
+        for i in range(EndlessPagination.page_size + 5):
+            for user in [celebrity, friend]:
+                tweet = self.create_tweet(user)
+                NewsFeedService.fanout_to_followers(tweet)
+                tweets.append(tweet)
+        tweets = tweets[::-1]
+        self.assertEqual(NewsFeed.objects.filter(tweet__user=celebrity).count(), 15)
+
+        # the pulled tweets are merged into the pages of the fanned out newsfeeds
+        tweet_ids = []
+        newsfeed_ids = []
+        response = self.pluto_client.get(NEWSFEEDS_URL)
+        latest_created_at = response.data['results'][0]['created_at']
+        while True:
+            self.assertEqual(len(response.data['results']) <= EndlessPagination.page_size, True)
+            tweet_ids.extend(result['tweet']['id'] for result in response.data['results'])
+            newsfeed_ids.extend(result['id'] for result in response.data['results'])
+            if not response.data['has_next_page']:
+                break
+            response = self.pluto_client.get(
+                NEWSFEEDS_URL,
+                {'created_at__lt': response.data['results'][-1]['created_at']},
+            )
+        self.assertEqual(tweet_ids, [tweet.id for tweet in tweets])
+        # the pulled tweets get the negative tweet ids as their ids
+        stored_ids = set(NewsFeed.objects.filter(user=self.pluto).values_list('id', flat=True))
+        pulled = [
+            (newsfeed_id, tweet_id)
+            for newsfeed_id, tweet_id in zip(newsfeed_ids, tweet_ids)
+            if newsfeed_id not in stored_ids
+        ]
+        self.assertNotEqual(len(pulled), 0)
+        for newsfeed_id, tweet_id in pulled:
+            self.assertEqual(newsfeed_id, -tweet_id)
+        self.assertEqual(len(set(newsfeed_ids)), len(tweets))
+        response = self.pluto_client.get(NEWSFEEDS_URL)
+        self.assertEqual(
+            [result['id'] for result in response.data['results']],
+            newsfeed_ids[:EndlessPagination.page_size],
+        )
+
+        # pull-to-refresh
+        tweet = self.create_tweet(celebrity)
+        NewsFeedService.fanout_to_followers(tweet)
+        response = self.pluto_client.get(
+            NEWSFEEDS_URL,
+            {'created_at__gt': latest_created_at},
+        )
+        self.assertEqual(
+            [result['tweet']['id'] for result in response.data['results']],
+            [tweet.id],
+        )
+
+    def test_pagination_with_pull_model(self):
+        GateKeeper.set_kv('switch_newsfeeds_to_pull_model', 'percent', 100)
+        friend = self.create_user('friend')
+        self.create_friendship(self.pluto, self.brunch)
+        self.create_friendship(self.pluto, friend)
+        stranger = self.create_user('stranger')
+
+        # the cached tweets of friend are truncated
+        tweets = []
+        for i in range(settings.REDIS_LIST_LENGTH_LIMIT + 5):
+            for user in [friend, self.brunch, self.pluto, stranger]:
+                if user != friend and i % 5:
+                    continue
+                tweet = self.create_tweet(user)
+                if user != stranger:
+                    tweets.append(tweet)
+        tweets = tweets[::-1]
+        self.assertEqual(NewsFeed.objects.count(), 0)
+
+        # the pages are merged from the tweets of the followings and pluto
+        tweet_ids = []
+        response = self.pluto_client.get(NEWSFEEDS_URL)
+        latest_created_at = response.data['results'][0]['created_at']
+        while True:
+            self.assertEqual(len(response.data['results']) <= EndlessPagination.page_size, True)
+            tweet_ids.extend(result['tweet']['id'] for result in response.data['results'])
+            if not response.data['has_next_page']:
+                break
+            response = self.pluto_client.get(
+                NEWSFEEDS_URL,
+                {'created_at__lt': response.data['results'][-1]['created_at']},
+            )
+        self.assertEqual(tweet_ids, [tweet.id for tweet in tweets])
+
+        # pull-to-refresh
+        tweet = self.create_tweet(self.brunch)
+        self.create_tweet(stranger)
+        response = self.pluto_client.get(
+            NEWSFEEDS_URL,
+            {'created_at__gt': latest_created_at},
+        )
+        self.assertEqual(
+            [result['tweet']['id'] for result in response.data['results']],
+            [tweet.id],
+        )
+
+        # back to the fanned out newsfeeds, which are empty
+        GateKeeper.set_kv('switch_newsfeeds_to_pull_model', 'percent', 0)
+        response = self.pluto_client.get(NEWSFEEDS_URL)
+        self.assertEqual(len(response.data['results']), 0)
+
     def test_user_cache(self):
         profile = self.brunch.profile
         profile.nickname = 'Chubby'
@@ -121,11 +248,18 @@ class NewsFeedApiTests(TestCase):
         self.assertEqual(results[0]['tweet']['user']['username'], 'brunch')
         self.assertEqual(results[0]['tweet']['user']['nickname'], 'Chubby')
         self.assertEqual(results[1]['tweet']['user']['username'], 'pluto')
+        # served by the local cache from now on, until the listeners invalidate it
+        user_key = MemcachedHelper.get_key(User, self.pluto.id)
+        profile_key = USER_PROFILE_PATTERN.format(user_id=self.brunch.id)
+        self.assertEqual(LocalCache.get(user_key).username, 'pluto')
+        self.assertEqual(LocalCache.get(profile_key).nickname, 'Chubby')
 
         self.pluto.username = 'plutokitty'
         self.pluto.save()
         profile.nickname = 'PangPang'
         profile.save()
+        self.assertEqual(LocalCache.get(user_key), None)
+        self.assertEqual(LocalCache.get(profile_key), None)
 
         response = self.brunch_client.get(NEWSFEEDS_URL)
         results = response.data['results']
@@ -210,25 +344,129 @@ class NewsFeedApiTests(TestCase):
         self.clear_cache()
         _test_newsfeeds_after_new_feed_pushed()
 
+    def test_pagination_with_sorted_set_timeline(self):
+        GateKeeper.set_kv('switch_timeline_to_sorted_set', 'percent', 100)
+        self.test_pagination()
 
+    def test_sorted_set_timeline_limit(self):
+        GateKeeper.set_kv('switch_timeline_to_sorted_set', 'percent', 100)
+        list_limit = settings.REDIS_LIST_LENGTH_LIMIT
+        page_size = EndlessPagination.page_size
+        followed_user = self.create_user('followed')
+        newsfeeds = []
+        for i in range(list_limit + page_size):
+            tweet = self.create_tweet(followed_user, 'feed{}'.format(i))
+            newsfeeds.append(self.create_newsfeed(self.pluto, tweet))
+        newsfeeds = newsfeeds[::-1]
 
+        # the timeline only keeps the latest list_limit ids,
+        # the remaining pages are read from database
+        results = self._paginate_to_get_newsfeeds(self.pluto_client)
+        self.assertEqual([r['id'] for r in results], [n.id for n in newsfeeds])
+        conn = RedisClient.get_connection()
+        key = USER_NEWSFEEDS_TIMELINE_PATTERN.format(user_id=self.pluto.id)
+        self.assertEqual(conn.zcard(key), list_limit)
+
+        # newly pushed newsfeed goes to the head of the timeline
+        new_newsfeed = self.create_newsfeed(self.pluto, self.create_tweet(followed_user))
+        self.assertEqual(conn.zcard(key), list_limit)
+        results = self._paginate_to_get_newsfeeds(self.pluto_client)
+        self.assertEqual(results[0]['id'], new_newsfeed.id)
+        self.assertEqual(len(results), list_limit + page_size + 1)
+
+    def _get_both_renderings(self, client, url, params, switch):
+        # with cold and warm fragment cache, serializers and plain renderers
+        # are supposed to give byte identical responses
+        contents = []
+        for percent in (0, 100):
+            GateKeeper.set_kv(switch, 'percent', percent)
+            caches['testing'].clear()
+            contents.append(client.get(url, params).content)
+            contents.append(client.get(url, params).content)
+        return contents
+
+    def test_plain_renderers(self):
+        profile = self.pluto.profile
+        profile.nickname = 'kitten'
+        profile.avatar = SimpleUploadedFile('avatar.jpg', b'fake image', content_type='image/jpeg')
+        profile.save()
+        tweets = [self.create_tweet(self.pluto, str(i)) for i in range(3)]
+        TweetService.create_photos_from_files(tweets[0], [
+            SimpleUploadedFile('selfie.jpg', b'fake image', content_type='image/jpeg'),
+        ])
+        for tweet in tweets:
+            self.create_newsfeed(self.brunch, tweet)
+        comment = self.create_comment(self.pluto, tweets[0])
+        self.create_like(self.brunch, tweets[0])
+        self.create_like(self.brunch, comment)
+        self.create_like(self.pluto, tweets[0])
+
+        cases = [
+            (NEWSFEEDS_URL, {}, 'switch_newsfeeds_to_plain_renderer'),
+            (POST_TWEETS_URL, {'user_id': self.pluto.id}, 'switch_tweets_to_plain_renderer'),
+            ('/api/comments/', {'tweet_id': tweets[0].id}, 'switch_comments_to_plain_renderer'),
+            ('/api/tweets/{}/likes/'.format(tweets[0].id), {}, 'switch_likes_to_plain_renderer'),
+        ]
+        for url, params, switch in cases:
+            contents = self._get_both_renderings(self.brunch_client, url, params, switch)
+            self.assertEqual(len(set(contents)), 1, url)
+            self.assertIn(b'kitten', contents[0])
+
+    def test_pagination_with_plain_renderer(self):
+        GateKeeper.set_kv('switch_newsfeeds_to_plain_renderer', 'percent', 100)
+        self.test_pagination()
+
+    def test_newsfeeds_rebuilt_for_dormant_user(self):
+        self.create_friendship(self.brunch, self.pluto)
+        GateKeeper.set_kv('switch_newsfeeds_to_activity_aware_fanout', 'percent', 100)
+        self.brunch_client.get(NEWSFEEDS_URL)
+
+        # brunch turns dormant, and misses the tweet
+        with override_settings(DORMANT_USER_THRESHOLD=0):
+            self.pluto_client.post(POST_TWEETS_URL, {'content': 'Hello World'})
+            self.assertEqual(NewsFeed.objects.filter(user=self.brunch).count(), 0)
+
+            # the rebuild is scheduled after the first request of brunch,
+            # which is served the newsfeeds before the rebuild
+            response = self.brunch_client.get(NEWSFEEDS_URL)
+            self.assertEqual(len(response.data['results']), 0)
+        self.assertEqual(NewsFeed.objects.filter(user=self.brunch).count(), 1)
+        response = self.brunch_client.get(NEWSFEEDS_URL)
+        self.assertEqual(len(response.data['results']), 1)
 
+        # active users are fanned out to
+        self.pluto_client.post(POST_TWEETS_URL, {'content': 'Hello Again'})
+        response = self.brunch_client.get(NEWSFEEDS_URL)
+        self.assertEqual(len(response.data['results']), 2)
 
+    def test_last_active_update_interval(self):
+        # the last active time is written once within the interval
+        with mock.patch.object(UserService, 'mark_active', return_value=None) as mark_active:
+            self.brunch_client.get(NEWSFEEDS_URL)
+            self.brunch_client.get(NEWSFEEDS_URL)
+            self.assertEqual(mark_active.call_count, 1)
+            self.pluto_client.get(NEWSFEEDS_URL)
+            self.assertEqual(mark_active.call_count, 2)
+            with override_settings(LAST_ACTIVE_UPDATE_INTERVAL=0):
+                self.brunch_client.get(NEWSFEEDS_URL)
+            self.assertEqual(mark_active.call_count, 3)
+
+    def test_follow_and_unfollow(self):
+        for i in range(2):
+            self.create_tweet(self.brunch, 'tweet {}'.format(i))
+        response = self.pluto_client.get(NEWSFEEDS_URL)
+        self.assertEqual(len(response.data['results']), 0)
 
+        # the existing tweets show up after following
+        self.pluto_client.post(FOLLOW_URL.format(self.brunch.id))
+        response = self.pluto_client.get(NEWSFEEDS_URL)
+        self.assertEqual(
+            [newsfeed['tweet']['content'] for newsfeed in response.data['results']],
+            ['tweet 1', 'tweet 0'],
+        )
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+        # and are gone after unfollowing
+        self.pluto_client.post(UNFOLLOW_URL.format(self.brunch.id))
+        response = self.pluto_client.get(NEWSFEEDS_URL)
+        self.assertEqual(len(response.data['results']), 0)
+        self.assertEqual(NewsFeed.objects.filter(user=self.pluto).count(), 0)
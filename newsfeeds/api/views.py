@@ -2,10 +2,11 @@ from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated
 from newsfeeds.models import NewsFeed
 from newsfeeds.services import NewsFeedService
-from newsfeeds.api.serializers import NewsFeedSerializer
+from newsfeeds.api.serializers import NewsFeedSerializer, render_newsfeeds
 from utils.paginations import EndlessPagination
 from django.utils.decorators import method_decorator
 from ratelimit.decorators import ratelimit
+from gatekeeper.models import GateKeeper
 
 
 class NewsFeedViewSet(viewsets.GenericViewSet):
@@ -17,12 +18,23 @@ class NewsFeedViewSet(viewsets.GenericViewSet):
 
     @method_decorator(ratelimit(key='user', rate='5/s', method='GET', block=True))
     def list(self, request):
-        cached_newsfeeds = NewsFeedService.get_cached_newsfeeds(request.user.id)
-        newsfeed_page = self.paginator.paginate_cached_list(cached_newsfeeds, request)
-        if newsfeed_page is None:
-            queryset = NewsFeed.objects.filter(user=request.user)
-            newsfeed_page = self.paginate_queryset(queryset)
+        # the users in the gk read the newsfeeds by the pull model,
+        # to compare it with the push model
+        if GateKeeper.in_gk('switch_newsfeeds_to_pull_model', request.user.id):
+            newsfeed_page = NewsFeedService.paginate_pulled_newsfeeds(
+                request.user.id,
+                self.paginator,
+                request,
+            )
+        else:
+            newsfeed_page = NewsFeedService.paginate_pushed_newsfeeds(
+                request.user.id,
+                self.paginator,
+                request,
+            )
 
+        if GateKeeper.is_switch_on('switch_newsfeeds_to_plain_renderer'):
+            return self.get_paginated_response(render_newsfeeds(newsfeed_page, request))
         serializer = NewsFeedSerializer(
             newsfeed_page,
             context={'request': request},
@@ -1,3 +1,14 @@
 from django.conf import settings
+from utils.time_constants import ONE_DAY
 
-FANOUT_BATCH_SIZE = 1000 if not settings.TESTING else 3
\ No newline at end of file
+FANOUT_BATCH_SIZE = 1000 if not settings.TESTING else 3
+# each batch is inserted by chunks of this size
+FANOUT_INSERT_CHUNK_SIZE = 200 if not settings.TESTING else 2
+FANOUT_MAX_RETRIES = 5
+# how long a finished batch is remembered, against duplicate deliveries
+FANOUT_BATCH_MARKER_EXPIRE_TIME = ONE_DAY
+# the followings and unfollowings within this many seconds are applied
+# to the newsfeeds in one batch
+FRIENDSHIP_CHANGES_DELAY = 10
+# how many latest tweets of a followed user are merged into the newsfeeds
+FOLLOW_BACKFILL_TWEETS_COUNT = 20 if not settings.TESTING else 3
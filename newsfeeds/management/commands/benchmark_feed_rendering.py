@@ -0,0 +1,47 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from newsfeeds.api.serializers import NewsFeedSerializer, render_newsfeeds
+from newsfeeds.models import NewsFeed
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from utils.paginations import EndlessPagination
+
+import timeit
+
+
+class Command(BaseCommand):
+    help = 'Compare NewsFeedSerializer with the plain function renderer on ' \
+           'the first newsfeed page of a user, both with warm caches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, required=True)
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        user = User.objects.get(id=options['user_id'])
+        request = Request(APIRequestFactory().get('/api/newsfeeds/'))
+        request.user = user
+        newsfeeds = list(
+            NewsFeed.objects.filter(user=user).order_by('-created_at')[:EndlessPagination.page_size]
+        )
+
+        def serialize():
+            return NewsFeedSerializer(newsfeeds, context={'request': request}, many=True).data
+
+        def render():
+            return render_newsfeeds(newsfeeds, request)
+
+        # warm up the caches, and make sure both are comparable
+        if serialize() != render():
+            self.stderr.write('The outputs of the two paths are different.')
+            return
+
+        repeat = options['repeat']
+        serializer_time = timeit.timeit(serialize, number=repeat) / repeat
+        renderer_time = timeit.timeit(render, number=repeat) / repeat
+        self.stdout.write('{} newsfeeds per page, {} rounds'.format(len(newsfeeds), repeat))
+        self.stdout.write('serializer: {:.2f} ms'.format(serializer_time * 1000))
+        self.stdout.write('renderer:   {:.2f} ms ({:.1f}x)'.format(
+            renderer_time * 1000,
+            serializer_time / renderer_time,
+        ))
@@ -0,0 +1,53 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from newsfeeds.models import NewsFeed
+from newsfeeds.services import NewsFeedService
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from utils.paginations import EndlessPagination
+
+import timeit
+
+
+class Command(BaseCommand):
+    help = 'Compare the push model (fanned out newsfeeds) with the pull model ' \
+           '(k-way merge of the followings\' tweets) on the first newsfeed page ' \
+           'of a user, both with warm caches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, required=True)
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        user = User.objects.get(id=options['user_id'])
+        request = Request(APIRequestFactory().get('/api/newsfeeds/'))
+        request.user = user
+
+        def push():
+            paginator = EndlessPagination()
+            return NewsFeedService.paginate_pushed_newsfeeds(user.id, paginator, request)
+
+        def pull():
+            paginator = EndlessPagination()
+            return NewsFeedService.paginate_pulled_newsfeeds(user.id, paginator, request)
+
+        # warm up the caches, the pages might differ if some followings
+        # were followed after they tweeted
+        pushed_tweet_ids = [newsfeed.tweet_id for newsfeed in push()]
+        pulled_tweet_ids = [newsfeed.tweet_id for newsfeed in pull()]
+        if pushed_tweet_ids != pulled_tweet_ids:
+            self.stderr.write('The first pages of the two models are different.')
+
+        repeat = options['repeat']
+        push_time = timeit.timeit(push, number=repeat) / repeat
+        pull_time = timeit.timeit(pull, number=repeat) / repeat
+        self.stdout.write('{} newsfeeds per page, {} rounds'.format(EndlessPagination.page_size, repeat))
+        self.stdout.write('push: {:.2f} ms, {} newsfeed rows of the user, {} in total'.format(
+            push_time * 1000,
+            NewsFeed.objects.filter(user=user).count(),
+            NewsFeed.objects.count(),
+        ))
+        self.stdout.write('pull: {:.2f} ms ({:.1f}x), no newsfeed row'.format(
+            pull_time * 1000,
+            push_time / pull_time,
+        ))
@@ -0,0 +1,22 @@
+from newsfeeds.services import NewsFeedService
+
+
+class LastActiveMiddleware:
+    """
+    Keeps the last active time of the authenticated users, the newsfeeds
+    are fanned out to the active followers only.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        # marked after the view, the users authenticated by rest framework
+        # are only known by then. Only the activity is recorded here, the
+        # newsfeeds of a user coming back are rebuilt by a task, the first
+        # newsfeeds page read on return is the one before the rebuild
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            NewsFeedService.mark_user_active(user.id)
+        return response
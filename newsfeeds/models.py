@@ -23,6 +23,8 @@ class NewsFeed(models.Model):
 
     @property
     def cached_tweet(self):
+        if hasattr(self, '_cached_tweet'):
+            return self._cached_tweet
         return MemcachedHelper.get_object_through_cache(Tweet, self.tweet_id)
 
 
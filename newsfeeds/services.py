@@ -1,7 +1,52 @@
+from accounts.services import UserService
+from datetime import timedelta
+from dateutil import parser
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import OuterRef, Q, Subquery
+from django.utils import timezone
+from friendships.services import FriendshipService
+from gatekeeper.models import GateKeeper
 from newsfeeds.models import NewsFeed
-from twitter.cache import USER_NEWSFEEDS_PATTERN
-from utils.redis_helper import RedisHelper
-from newsfeeds.tasks import fanout_newsfeeds_main_task
+from tweets.models import Tweet
+from tweets.services import TweetService
+from newsfeeds.constants import (
+    FANOUT_INSERT_CHUNK_SIZE,
+    FOLLOW_BACKFILL_TWEETS_COUNT,
+    FRIENDSHIP_CHANGES_DELAY,
+)
+from twitter.cache import (
+    FLUSHING_FRIENDSHIP_CHANGES_KEY,
+    FRIENDSHIP_CHANGES_KEY,
+    FRIENDSHIP_CHANGES_SCHEDULED_KEY,
+    NEWSFEEDS_REBUILD_SCHEDULED_PATTERN,
+    PULLED_FOLLOWINGS_PATTERN,
+    PULL_FANOUT_USERS_KEY,
+    USER_ACTIVE_MARKED_PATTERN,
+    USER_NEWSFEEDS_PATTERN,
+    USER_NEWSFEEDS_TIMELINE_PATTERN,
+    USER_TWEETS_PATTERN,
+)
+from utils.paginations import EndlessPagination
+from utils.redis_client import RedisClient
+from utils.redis_helper import FlushInProgressError, RedisHelper
+from utils.time_constants import ONE_HOUR
+from utils.time_helpers import EPOCH, datetime_to_microseconds
+from newsfeeds.tasks import (
+    apply_friendship_changes_task,
+    fanout_newsfeeds_main_task,
+    rebuild_newsfeeds_task,
+)
+
+cache = caches['testing'] if settings.TESTING else caches['default']
+
+# adds the user to the pulled users, or moves the pulled since time earlier
+SWITCH_TO_PULL_SCRIPT = """
+local pulled_since = redis.call('zscore', KEYS[1], ARGV[1])
+if not pulled_since or tonumber(pulled_since) > tonumber(ARGV[2]) then
+    redis.call('zadd', KEYS[1], ARGV[2], ARGV[1])
+end
+"""
 
 
 class NewsFeedService(object):
@@ -17,16 +62,413 @@ class NewsFeedService(object):
         # which can be serialized by celery,
         # i.e., tweet.id is a valid argument, but tweet is not,
         # cause celery doesn't know how to serialize Tweet.
-        fanout_newsfeeds_main_task.delay(tweet.id, tweet.user_id)
+        # created_at goes along, so that the task does not read the tweet back
+        fanout_newsfeeds_main_task.delay(
+            tweet.id,
+            tweet.user_id,
+            datetime_to_microseconds(tweet.created_at),
+        )
+
+    @classmethod
+    def get_fanout_follower_ids(cls, user_id, created_at):
+        # hybrid fanout, once a user reaches the follower threshold, the tweets
+        # since then are pulled by the followers at read time instead of being
+        # fanned out. The user stays pulled even if the switch is turned off,
+        # so that no tweet is both fanned out and pulled, or neither.
+        # created_at is in microseconds, returns the sorted ids of the followers
+        # to fan out to, None if the tweet is pulled by the followers
+        conn = RedisClient.get_connection()
+        pulled_since = conn.zscore(PULL_FANOUT_USERS_KEY, user_id)
+        if pulled_since is not None and pulled_since <= created_at:
+            return None
+
+        # the followers are counted by the ids which are fanned out to,
+        # instead of another COUNT query
+        follower_ids = sorted(FriendshipService.get_follower_ids(user_id))
+        if pulled_since is None:
+            if not GateKeeper.is_switch_on('switch_newsfeeds_to_hybrid_fanout'):
+                return follower_ids
+            if len(follower_ids) < settings.HYBRID_FANOUT_FOLLOWER_THRESHOLD:
+                return follower_ids
+
+        # the earliest tweet which is not fanned out wins, in case
+        # the tasks of two tweets are racing
+        switch_to_pull = conn.register_script(SWITCH_TO_PULL_SCRIPT)
+        switch_to_pull(keys=[PULL_FANOUT_USERS_KEY], args=[user_id, created_at])
+        cls.invalidate_pulled_followings(follower_ids)
+        return None
+
+    @classmethod
+    def get_pulled_users(cls, user_id):
+        # returns {pulled_user_id: pulled_since} of the followed users whose
+        # tweets are pulled at read time, read on every newsfeed page.
+        # Nothing more is looked up while no user is pulled at all
+        conn = RedisClient.get_connection()
+        if not conn.exists(PULL_FANOUT_USERS_KEY):
+            return {}
+
+        # cached per reader, invalidated when one of the followings is
+        # switched to pull, or when the reader follows or unfollows
+        key = PULLED_FOLLOWINGS_PATTERN.format(user_id=user_id)
+        pulled_users = cache.get(key)
+        if pulled_users is not None:
+            return pulled_users
+        pulled_users = cls._load_pulled_users(user_id)
+        cache.set(key, pulled_users)
+        return pulled_users
+
+    @classmethod
+    def _load_pulled_users(cls, user_id):
+        # the followings are looked up in the pulled users by ZSCORE, in one
+        # round trip per batch, so that the cost does not grow with the
+        # number of all the pulled users
+        following_user_ids = list(FriendshipService.get_following_user_id_set(user_id))
+        if not following_user_ids:
+            return {}
+        conn = RedisClient.get_connection()
+        pulled_users = {}
+        for start in range(0, len(following_user_ids), settings.REDIS_PIPELINE_BATCH_SIZE):
+            batch_user_ids = following_user_ids[start: start + settings.REDIS_PIPELINE_BATCH_SIZE]
+            pipe = conn.pipeline(transaction=False)
+            for following_user_id in batch_user_ids:
+                pipe.zscore(PULL_FANOUT_USERS_KEY, following_user_id)
+            for following_user_id, score in zip(batch_user_ids, pipe.execute()):
+                if score is not None:
+                    pulled_users[following_user_id] = EPOCH + timedelta(microseconds=int(score))
+        return pulled_users
+
+    @classmethod
+    def invalidate_pulled_followings(cls, user_ids):
+        keys = [PULLED_FOLLOWINGS_PATTERN.format(user_id=user_id) for user_id in user_ids]
+        if keys:
+            cache.delete_many(keys)
+
+    @classmethod
+    def _merge_pulled_tweets(cls, user_id, newsfeeds, tweets):
+        # each pulled tweet becomes an unsaved newsfeed of the reader,
+        # whose id is the negative tweet id, stable across the reads
+        # and never taken by a stored newsfeed
+        merged_newsfeeds = list(newsfeeds)
+        for tweet in tweets:
+            newsfeed = NewsFeed(
+                id=-tweet.id,
+                user_id=user_id,
+                tweet_id=tweet.id,
+                created_at=tweet.created_at,
+            )
+            newsfeed._cached_tweet = tweet
+            merged_newsfeeds.append(newsfeed)
+        merged_newsfeeds.sort(key=lambda newsfeed: newsfeed.created_at, reverse=True)
+        return merged_newsfeeds
 
     @classmethod
     def get_cached_newsfeeds(cls, user_id):
         queryset = NewsFeed.objects.filter(user_id=user_id).order_by('-created_at')
         key = USER_NEWSFEEDS_PATTERN.format(user_id=user_id)
+        # only the fanned out newsfeeds, the pulled tweets are merged
+        # page by page, see merge_pulled_tweets_into_page()
         return RedisHelper.download_objects_from_cache(key, queryset)
 
+    @classmethod
+    def merge_pulled_tweets_into_page(cls, user_id, newsfeed_page, paginator, request):
+        # newsfeed_page is the page of the fanned out newsfeeds located by paginator,
+        # the same page of the pulled tweets of each pulled user is merged into it,
+        # the newest page_size ones of them all are exactly the merged page
+        pulled_users = cls.get_pulled_users(user_id)
+        if not pulled_users:
+            return newsfeed_page
+
+        created_at__lt = None
+        if 'created_at__lt' in request.query_params:
+            created_at__lt = parser.isoparse(request.query_params['created_at__lt'])
+        tweets = []
+        has_next_page = paginator.has_next_page
+        for pulled_user_id, pulled_since in pulled_users.items():
+            # the page is older than the pulled tweets of this user
+            if created_at__lt is not None and created_at__lt <= pulled_since:
+                continue
+            tweet_paginator = EndlessPagination()
+            cached_tweets = TweetService.get_lazy_cached_tweets(pulled_user_id)
+            tweets_page = tweet_paginator.paginate_cached_list(cached_tweets, request)
+            if tweets_page is None:
+                queryset = Tweet.objects.filter(user_id=pulled_user_id)
+                tweets_page = tweet_paginator.paginate_queryset(queryset, request)
+            tweets_page = list(tweets_page)
+            pulled_tweets = [tweet for tweet in tweets_page if tweet.created_at >= pulled_since]
+            tweets.extend(pulled_tweets)
+            if tweet_paginator.has_next_page and len(pulled_tweets) == len(tweets_page):
+                has_next_page = True
+
+        newsfeeds = cls._merge_pulled_tweets(user_id, newsfeed_page, tweets)
+        # pull-to-refresh returns all the newer ones
+        if 'created_at__gt' in request.query_params:
+            return newsfeeds
+        paginator.has_next_page = has_next_page or len(newsfeeds) > paginator.page_size
+        return newsfeeds[:paginator.page_size]
+
+    @classmethod
+    def paginate_pushed_newsfeeds(cls, user_id, paginator, request):
+        # the push model, the page of the fanned out newsfeeds,
+        # together with the tweets of the pulled users
+        if GateKeeper.is_switch_on('switch_timeline_to_sorted_set'):
+            newsfeed_page = cls.paginate_cached_newsfeeds_timeline(user_id, paginator, request)
+        else:
+            cached_newsfeeds = cls.get_lazy_cached_newsfeeds(user_id)
+            newsfeed_page = paginator.paginate_cached_list(cached_newsfeeds, request)
+        if newsfeed_page is None:
+            queryset = NewsFeed.objects.filter(user_id=user_id)
+            newsfeed_page = paginator.paginate_queryset(queryset, request)
+        return cls.merge_pulled_tweets_into_page(user_id, newsfeed_page, paginator, request)
+
+    @classmethod
+    def paginate_pulled_newsfeeds(cls, user_id, paginator, request):
+        # the pull model, no newsfeed is stored, the page is merged from the
+        # cached tweets of the followings and the user at read time
+        user_ids = FriendshipService.get_following_user_id_set(user_id) | {user_id}
+        key_to_user_id = {
+            USER_TWEETS_PATTERN.format(user_id=tweet_user_id): tweet_user_id
+            for tweet_user_id in user_ids
+        }
+        cached_lists = RedisHelper.load_lazy_cached_lists(key_to_user_id.keys(), Tweet)
+        sources = [
+            (cached_list, Tweet.objects.filter(user_id=key_to_user_id[key]))
+            for key, cached_list in cached_lists.items()
+        ]
+        # the users whose tweets are not cached (or who have never tweeted,
+        # redis keeps no empty list) are read together as one source,
+        # in one query per page, their lists are left to be filled by
+        # the reads of their own tweets
+        missed_user_ids = [
+            tweet_user_id
+            for key, tweet_user_id in key_to_user_id.items()
+            if key not in cached_lists
+        ]
+        if missed_user_ids:
+            sources.append((None, Tweet.objects.filter(user_id__in=missed_user_ids)))
+        tweets = paginator.paginate_merged_lists(sources, request)
+        return cls._merge_pulled_tweets(user_id, [], tweets)
+
+    @classmethod
+    def get_lazy_cached_newsfeeds(cls, user_id):
+        # only the entries which are actually paginated over get deserialized
+        queryset = NewsFeed.objects.filter(user_id=user_id).order_by('-created_at')
+        key = USER_NEWSFEEDS_PATTERN.format(user_id=user_id)
+        return RedisHelper.load_lazy_cached_list(key, queryset)
+
     @classmethod
     def push_newsfeed_to_cache(cls, newsfeed):
-        queryset = NewsFeed.objects.filter(user_id=newsfeed.user_id).order_by('-created_at')
-        key = USER_NEWSFEEDS_PATTERN.format(user_id=newsfeed.user_id)
-        RedisHelper.push_object(key, newsfeed, queryset)
+        # only the structure selected by switch_timeline_to_sorted_set is
+        # written, the other one is dropped, so that it would not be read
+        # stale once the switch is flipped
+        list_key = USER_NEWSFEEDS_PATTERN.format(user_id=newsfeed.user_id)
+        timeline_key = USER_NEWSFEEDS_TIMELINE_PATTERN.format(user_id=newsfeed.user_id)
+        conn = RedisClient.get_connection()
+        if GateKeeper.is_switch_on('switch_timeline_to_sorted_set'):
+            RedisHelper.push_object_to_timeline(timeline_key, newsfeed)
+            conn.delete(list_key)
+        else:
+            queryset = NewsFeed.objects.filter(user_id=newsfeed.user_id).order_by('-created_at')
+            RedisHelper.push_object(list_key, newsfeed, queryset)
+            conn.delete(timeline_key)
+
+    @classmethod
+    def push_newsfeeds_to_cache(cls, newsfeeds):
+        # newsfeeds of one fanout batch belong to different users,
+        # they are pushed in bulk, the cold lists are left to their next read.
+        # The same as push_newsfeed_to_cache(), only one structure is written
+        if not newsfeeds:
+            return
+        key_to_newsfeed = {
+            USER_NEWSFEEDS_PATTERN.format(user_id=newsfeed.user_id): newsfeed
+            for newsfeed in newsfeeds
+        }
+        timeline_key_to_newsfeed = {
+            USER_NEWSFEEDS_TIMELINE_PATTERN.format(user_id=newsfeed.user_id): newsfeed
+            for newsfeed in newsfeeds
+        }
+        conn = RedisClient.get_connection()
+        if GateKeeper.is_switch_on('switch_timeline_to_sorted_set'):
+            RedisHelper.push_objects_to_timelines(timeline_key_to_newsfeed)
+            conn.delete(*key_to_newsfeed.keys())
+        else:
+            RedisHelper.push_objects(key_to_newsfeed)
+            conn.delete(*timeline_key_to_newsfeed.keys())
+
+    @classmethod
+    def invalidate_cached_newsfeeds(cls, user_ids):
+        # the lists would be rebuilt from database by their next read
+        if not user_ids:
+            return
+        keys = []
+        for user_id in user_ids:
+            keys.append(USER_NEWSFEEDS_PATTERN.format(user_id=user_id))
+            keys.append(USER_NEWSFEEDS_TIMELINE_PATTERN.format(user_id=user_id))
+        conn = RedisClient.get_connection()
+        conn.delete(*keys)
+
+    @classmethod
+    def mark_user_active(cls, user_id):
+        # a user coming back from dormant has missed the tweets which were
+        # not fanned out meanwhile, they are pulled into the newsfeeds by
+        # a task, at most one task is scheduled for a user at a time.
+        # Called on every authenticated request, a user seen within
+        # LAST_ACTIVE_UPDATE_INTERVAL is skipped by one memcached add
+        interval = min(settings.LAST_ACTIVE_UPDATE_INTERVAL, settings.DORMANT_USER_THRESHOLD)
+        if interval > 0:
+            key = USER_ACTIVE_MARKED_PATTERN.format(user_id=user_id)
+            if not cache.add(key, 1, interval):
+                return
+        last_active = UserService.mark_active(user_id)
+        if not GateKeeper.is_switch_on('switch_newsfeeds_to_activity_aware_fanout'):
+            return
+        if not UserService.is_dormant(last_active):
+            return
+        conn = RedisClient.get_connection()
+        scheduled_key = NEWSFEEDS_REBUILD_SCHEDULED_PATTERN.format(user_id=user_id)
+        if conn.set(scheduled_key, 1, nx=True, ex=ONE_HOUR):
+            rebuild_newsfeeds_task.delay(user_id, datetime_to_microseconds(last_active))
+
+    @classmethod
+    def rebuild_newsfeeds(cls, user_id, since=None):
+        # the tweets of the pulled users are merged at read time, they are not
+        # inserted, and only the newest ones which fit in the cache are pulled
+        following_user_ids = FriendshipService.get_following_user_id_set(user_id)
+        following_user_ids = following_user_ids - set(cls.get_pulled_users(user_id))
+        tweet_ids = []
+        if following_user_ids:
+            tweets = Tweet.objects.filter(user_id__in=following_user_ids)
+            if since is not None:
+                tweets = tweets.filter(created_at__gt=since)
+            tweet_ids = list(
+                tweets.order_by('-created_at').values_list('id', flat=True)[:settings.REDIS_LIST_LENGTH_LIMIT],
+            )
+        if tweet_ids:
+            cls._create_backdated_newsfeeds([user_id], tweet_ids)
+            cls.invalidate_cached_newsfeeds([user_id])
+        conn = RedisClient.get_connection()
+        conn.delete(NEWSFEEDS_REBUILD_SCHEDULED_PATTERN.format(user_id=user_id))
+
+    @classmethod
+    def _create_backdated_newsfeeds(cls, user_ids, tweet_ids):
+        # every user gets a newsfeed of every tweet, the existing ones are skipped
+        inserted_at = timezone.now()
+        NewsFeed.objects.bulk_create(
+            [
+                NewsFeed(user_id=user_id, tweet_id=tweet_id)
+                for user_id in user_ids
+                for tweet_id in tweet_ids
+            ],
+            batch_size=FANOUT_INSERT_CHUNK_SIZE,
+            ignore_conflicts=True,
+        )
+        # created_at is set to now by bulk_create(), only the newsfeeds just
+        # inserted are dated back to their tweets to keep the order of the
+        # timeline, by chunks of users to bound the IN lists
+        for start in range(0, len(user_ids), FANOUT_INSERT_CHUNK_SIZE):
+            NewsFeed.objects.filter(
+                user_id__in=user_ids[start: start + FANOUT_INSERT_CHUNK_SIZE],
+                tweet_id__in=tweet_ids,
+                created_at__gte=inserted_at,
+            ).update(
+                created_at=Subquery(
+                    Tweet.objects.filter(id=OuterRef('tweet_id')).values('created_at')[:1],
+                ),
+            )
+
+    @classmethod
+    def record_friendship_change(cls, following_user_id, followed_user_id, is_following):
+        # the changes within FRIENDSHIP_CHANGES_DELAY are applied by one task,
+        # the last change of each friendship wins
+        conn = RedisClient.get_connection()
+        conn.hset(
+            FRIENDSHIP_CHANGES_KEY,
+            '{}:{}'.format(following_user_id, followed_user_id),
+            int(is_following),
+        )
+        cls._schedule_friendship_changes()
+
+    @classmethod
+    def _schedule_friendship_changes(cls):
+        # the mark expires in case the task is lost
+        conn = RedisClient.get_connection()
+        if conn.set(FRIENDSHIP_CHANGES_SCHEDULED_KEY, 1, nx=True, ex=FRIENDSHIP_CHANGES_DELAY * 2):
+            apply_friendship_changes_task.apply_async(countdown=FRIENDSHIP_CHANGES_DELAY)
+
+    @classmethod
+    def apply_friendship_changes(cls):
+        conn = RedisClient.get_connection()
+        try:
+            # the lock lasts as long as the task could run
+            changes = RedisHelper.flush_hash(
+                FRIENDSHIP_CHANGES_KEY,
+                FLUSHING_FRIENDSHIP_CHANGES_KEY,
+                cls._apply_friendship_changes,
+                lock_expire_time=ONE_HOUR,
+            )
+        except FlushInProgressError:
+            # another task is still applying, the changes recorded meanwhile
+            # are left to this task, which tries again later
+            apply_friendship_changes_task.apply_async(countdown=FRIENDSHIP_CHANGES_DELAY)
+            return 0
+
+        # the changes recorded during the flush found the mark set,
+        # another task is scheduled for them
+        conn.delete(FRIENDSHIP_CHANGES_SCHEDULED_KEY)
+        if conn.exists(FRIENDSHIP_CHANGES_KEY):
+            cls._schedule_friendship_changes()
+        return changes or 0
+
+    @classmethod
+    def _apply_friendship_changes(cls, changes, flush_id):
+        # applying the same changes again does no harm, flush_id is not needed.
+        # {followed_user_id: [following_user_id]}
+        followings, unfollowings = {}, {}
+        for field, is_following in changes.items():
+            following_user_id, followed_user_id = field.decode('utf-8').split(':')
+            user_ids = followings if int(is_following) else unfollowings
+            user_ids.setdefault(int(followed_user_id), []).append(int(following_user_id))
+
+        cls._merge_followed_tweets(followings)
+        cls._retract_unfollowed_tweets(unfollowings)
+        # the cached lists are rebuilt from database in created_at order
+        cls.invalidate_cached_newsfeeds([
+            user_id
+            for user_ids in list(followings.values()) + list(unfollowings.values())
+            for user_id in user_ids
+        ])
+        return len(changes)
+
+    @classmethod
+    def _merge_followed_tweets(cls, followings):
+        conn = RedisClient.get_connection()
+        for followed_user_id, following_user_ids in followings.items():
+            tweets = TweetService.get_cached_tweets(followed_user_id)[:FOLLOW_BACKFILL_TWEETS_COUNT]
+            # the tweets since the user is pulled are merged at read time
+            pulled_since = conn.zscore(PULL_FANOUT_USERS_KEY, followed_user_id)
+            if pulled_since is not None:
+                tweets = [
+                    tweet
+                    for tweet in tweets
+                    if datetime_to_microseconds(tweet.created_at) < pulled_since
+                ]
+            # one insert per followed user, not per friendship
+            if tweets:
+                cls._create_backdated_newsfeeds(
+                    following_user_ids,
+                    [tweet.id for tweet in tweets],
+                )
+
+    @classmethod
+    def _retract_unfollowed_tweets(cls, unfollowings):
+        if not unfollowings:
+            return
+        query = Q()
+        for followed_user_id, following_user_ids in unfollowings.items():
+            query |= Q(user_id__in=following_user_ids, tweet__user_id=followed_user_id)
+        NewsFeed.objects.filter(query).delete()
+
+    @classmethod
+    def paginate_cached_newsfeeds_timeline(cls, user_id, paginator, request):
+        queryset = NewsFeed.objects.filter(user_id=user_id).order_by('-created_at')
+        key = USER_NEWSFEEDS_TIMELINE_PATTERN.format(user_id=user_id)
+        return paginator.paginate_cached_timeline(key, queryset, request)
@@ -1,37 +1,96 @@
-from friendships.services import FriendshipService
+from accounts.services import UserService
+from gatekeeper.models import GateKeeper
 from newsfeeds.models import NewsFeed
-from tweets.models import Tweet
 from celery import shared_task
+from datetime import timedelta
+from django.db import DatabaseError
+from redis.exceptions import RedisError
+from twitter.cache import FANOUT_BATCH_PATTERN
+from utils.redis_client import RedisClient
 from utils.time_constants import ONE_HOUR
-from newsfeeds.constants import FANOUT_BATCH_SIZE
+from utils.time_helpers import EPOCH
+from newsfeeds.constants import (
+    FANOUT_BATCH_MARKER_EXPIRE_TIME,
+    FANOUT_BATCH_SIZE,
+    FANOUT_INSERT_CHUNK_SIZE,
+    FANOUT_MAX_RETRIES,
+)
 
+# both tasks are idempotent, they are retried with exponential backoff
+FANOUT_RETRY_OPTIONS = {
+    'autoretry_for': (DatabaseError, RedisError),
+    'retry_backoff': True,
+    'retry_jitter': True,
+    'max_retries': FANOUT_MAX_RETRIES,
+}
 
-@shared_task(routing_key='newsfeeds', time_limit=ONE_HOUR)
+
+@shared_task(routing_key='newsfeeds', time_limit=ONE_HOUR, **FANOUT_RETRY_OPTIONS)
 def fanout_newsfeeds_batch_task(tweet_id, follower_ids):
     # to prevent circular dependency, write the import mark below
     from newsfeeds.services import NewsFeedService
+
+    # a batch might be delivered more than once, or retried after it failed
+    # halfway, the marker tells how far the earlier attempts have gone
+    conn = RedisClient.get_connection()
+    marker_key = FANOUT_BATCH_PATTERN.format(
+        tweet_id=tweet_id,
+        batch_key='{}-{}'.format(follower_ids[0], follower_ids[-1]),
+    )
+    if conn.get(marker_key) == b'done':
+        return 'The newsfeeds have already been created.'
+
+    # the dormant followers are left out, their newsfeeds are rebuilt
+    # when they come back
+    active_follower_ids = follower_ids
+    if GateKeeper.is_switch_on('switch_newsfeeds_to_activity_aware_fanout'):
+        active_follower_ids = UserService.get_active_user_ids(follower_ids)
+
+    # the rows inserted by the earlier attempts are skipped
     newsfeeds = [
         NewsFeed(user_id=follower_id, tweet_id=tweet_id)
-        for follower_id in follower_ids
+        for follower_id in active_follower_ids
     ]
-    NewsFeed.objects.bulk_create(newsfeeds)
+    NewsFeed.objects.bulk_create(
+        newsfeeds,
+        batch_size=FANOUT_INSERT_CHUNK_SIZE,
+        ignore_conflicts=True,
+    )
+    # bulk_create() does not set the primary keys when conflicts are ignored,
+    # the cached newsfeeds need them
+    newsfeeds = list(NewsFeed.objects.filter(tweet_id=tweet_id, user_id__in=active_follower_ids))
 
     # bulk_create() cannot trigger post_save signal,
-    # that's why we need push newsfeeds one by one into cache manually
-    for newsfeed in newsfeeds:
-        NewsFeedService.push_newsfeed_to_cache(newsfeed)
+    # that's why we need push newsfeeds into cache manually.
+    # Only the first attempt pushes, the others cannot tell which lists
+    # have been pushed to, they drop the lists to be rebuilt instead
+    if conn.set(marker_key, 'inserted', nx=True, ex=FANOUT_BATCH_MARKER_EXPIRE_TIME):
+        NewsFeedService.push_newsfeeds_to_cache(newsfeeds)
+    else:
+        NewsFeedService.invalidate_cached_newsfeeds(follower_ids)
+    conn.set(marker_key, 'done', ex=FANOUT_BATCH_MARKER_EXPIRE_TIME)
 
     return '{} newsfeeds have been created.'.format(len(newsfeeds))
 
 
-@shared_task(routing_key='default', time_limit=ONE_HOUR)
-def fanout_newsfeeds_main_task(tweet_id, tweet_user_id):
+@shared_task(routing_key='default', time_limit=ONE_HOUR, **FANOUT_RETRY_OPTIONS)
+def fanout_newsfeeds_main_task(tweet_id, tweet_user_id, created_at):
+    from newsfeeds.services import NewsFeedService
+
     # Create a newsfeed to user who posted this tweet in the first place,
     # make sure user believes the newsfeed has been created successfully in no time
-    NewsFeed.objects.create(user_id=tweet_user_id, tweet_id=tweet_id)
+    NewsFeed.objects.get_or_create(user_id=tweet_user_id, tweet_id=tweet_id)
+
+    # the followers of a user with too many followers pull the tweets
+    # at read time, nothing is fanned out. created_at is in microseconds
+    follower_ids = NewsFeedService.get_fanout_follower_ids(tweet_user_id, created_at)
+    if follower_ids is None:
+        return 'Tweets of user {} are pulled by followers, no newsfeed is fanned out.'.format(
+            tweet_user_id,
+        )
 
-    # obtain all the followers' ids, then break down into a butch of batch_size sets
-    follower_ids = FriendshipService.get_follower_ids(tweet_user_id)
+    # break down the followers' ids into a butch of batch_size sets,
+    # they are sorted so that a retry makes up the same batches
     index = 0
     while index < len(follower_ids):
         batch_ids = follower_ids[index: index + FANOUT_BATCH_SIZE]
@@ -41,4 +100,22 @@ def fanout_newsfeeds_main_task(tweet_id, tweet_user_id):
     return '{} newsfeeds are going to fanout, {} batches are created.'.format(
         len(follower_ids),
         (len(follower_ids) - 1) // FANOUT_BATCH_SIZE + 1,
-    )
\ No newline at end of file
+    )
+
+
+@shared_task(routing_key='newsfeeds', time_limit=ONE_HOUR, **FANOUT_RETRY_OPTIONS)
+def apply_friendship_changes_task():
+    # scheduled by the friendship listeners, see
+    # NewsFeedService.record_friendship_change()
+    from newsfeeds.services import NewsFeedService
+    changes = NewsFeedService.apply_friendship_changes()
+    return '{} friendship changes have been applied.'.format(changes)
+
+
+@shared_task(routing_key='newsfeeds', time_limit=ONE_HOUR, **FANOUT_RETRY_OPTIONS)
+def rebuild_newsfeeds_task(user_id, since):
+    # scheduled when a dormant user comes back, see
+    # NewsFeedService.mark_user_active(), since is in microseconds
+    from newsfeeds.services import NewsFeedService
+    NewsFeedService.rebuild_newsfeeds(user_id, since=EPOCH + timedelta(microseconds=since))
+    return 'The newsfeeds of user {} have been rebuilt.'.format(user_id)
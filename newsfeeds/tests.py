@@ -1,9 +1,35 @@
+from accounts.services import UserService
+from django.test.utils import override_settings
+from friendships.models import Friendship
+from friendships.services import FriendshipService
 from newsfeeds.models import NewsFeed
 from newsfeeds.services import NewsFeedService
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
 from testing.testcases import TestCase
-from twitter.cache import USER_NEWSFEEDS_PATTERN
+from twitter.cache import (
+    CACHE_FILL_LOCK_PATTERN,
+    FANOUT_BATCH_PATTERN,
+    FLUSHING_FRIENDSHIP_CHANGES_KEY,
+    FRIENDSHIP_CHANGES_SCHEDULED_KEY,
+    NEWSFEEDS_REBUILD_SCHEDULED_PATTERN,
+    PULL_FANOUT_USERS_KEY,
+    USER_NEWSFEEDS_PATTERN,
+    USER_NEWSFEEDS_TIMELINE_PATTERN,
+    USER_TWEETS_PATTERN,
+)
+from utils.paginations import EndlessPagination
+from utils.redis_helper import RedisHelper
 from utils.redis_client import RedisClient
-from newsfeeds.tasks import fanout_newsfeeds_main_task
+from utils.time_helpers import datetime_to_microseconds
+from newsfeeds.tasks import (
+    apply_friendship_changes_task,
+    fanout_newsfeeds_batch_task,
+    fanout_newsfeeds_main_task,
+)
+from gatekeeper.models import GateKeeper
+from newsfeeds.constants import FRIENDSHIP_CHANGES_DELAY
+from unittest import mock
 
 
 class NewsFeedServiceTests(TestCase):
@@ -51,6 +77,38 @@ class NewsFeedServiceTests(TestCase):
         feeds = NewsFeedService.get_cached_newsfeeds(self.pluto.id)
         self.assertEqual([feed.id for feed in feeds], [feed2.id, feed1.id])
 
+    def test_paginate_pulled_newsfeeds(self):
+        silent = self.create_user('silent')
+        self.create_friendship(self.pluto, self.brunch)
+        self.create_friendship(self.pluto, silent)
+        tweets = [self.create_tweet(self.brunch) for i in range(3)][::-1]
+        request = Request(APIRequestFactory().get('/api/newsfeeds/'))
+
+        # brunch is cached, pluto and silent who have never tweeted
+        # are read together in one query
+        FriendshipService.get_following_user_id_set(self.pluto.id)
+        with self.assertNumQueries(1):
+            newsfeeds = NewsFeedService.paginate_pulled_newsfeeds(
+                self.pluto.id,
+                EndlessPagination(),
+                request,
+            )
+        self.assertEqual([newsfeed.tweet_id for newsfeed in newsfeeds], [tweet.id for tweet in tweets])
+
+        # the tweets of the users who are not cached are merged as well
+        RedisClient.get_connection().delete(USER_TWEETS_PATTERN.format(user_id=self.brunch.id))
+        tweet = self.create_tweet(silent)
+        with self.assertNumQueries(1):
+            newsfeeds = NewsFeedService.paginate_pulled_newsfeeds(
+                self.pluto.id,
+                EndlessPagination(),
+                request,
+            )
+        self.assertEqual(
+            [newsfeed.tweet_id for newsfeed in newsfeeds],
+            [tweet.id] + [tweet.id for tweet in tweets],
+        )
+
 
 class NewsFeedTaskTests(TestCase):
 
@@ -59,10 +117,17 @@ class NewsFeedTaskTests(TestCase):
         self.pluto = self.create_user('pluto')
         self.brunch = self.create_user('brunch')
 
+    def _fanout(self, tweet):
+        return fanout_newsfeeds_main_task(
+            tweet.id,
+            tweet.user_id,
+            datetime_to_microseconds(tweet.created_at),
+        )
+
     def test_fanout_main_task(self):
         tweet = self.create_tweet(self.pluto, 'pluto meows')
         self.create_friendship(self.brunch, self.pluto)
-        msg = fanout_newsfeeds_main_task(tweet.id, self.pluto.id)
+        msg = self._fanout(tweet)
         self.assertEqual(msg, '1 newsfeeds are going to fanout, 1 batches are created.')
         self.assertEqual(1 + 1, NewsFeed.objects.count())
         cached_list = NewsFeedService.get_cached_newsfeeds(self.pluto.id)
@@ -72,22 +137,305 @@ class NewsFeedTaskTests(TestCase):
             user = self.create_user('user{}'.format(i))
             self.create_friendship(user, self.pluto)
         tweet = self.create_tweet(self.pluto, 'pluto eats')
-        msg = fanout_newsfeeds_main_task(tweet.id, self.pluto.id)
+        msg = self._fanout(tweet)
         self.assertEqual(msg, '3 newsfeeds are going to fanout, 1 batches are created.')
-        self.assertEqual((1 + 1) + (1 + 3), NewsFeed.objects.count())
+        # user0 and user1 got meows when they followed pluto
+        self.assertEqual((1 + 1 + 2) + (1 + 3), NewsFeed.objects.count())
         cached_list = NewsFeedService.get_cached_newsfeeds(self.pluto.id)
         self.assertEqual(len(cached_list), 2)
 
         user = self.create_user('new user')
         self.create_friendship(user, self.pluto)
         tweet = self.create_tweet(self.pluto, 'pluto sleeps')
-        msg = fanout_newsfeeds_main_task(tweet.id, self.pluto.id)
+        msg = self._fanout(tweet)
         self.assertEqual(msg, '4 newsfeeds are going to fanout, 2 batches are created.')
-        # meows + 1 * meows (brunch)
-        # eats + 3 * eats (brunch, user0, user1)
+        # meows + 3 * meows (brunch, user0, user1) + meows (user)
+        # eats + 3 * eats (brunch, user0, user1) + eats (user)
         # sleeps + 4 * sleeps (brunch, user0, user1, user)
-        self.assertEqual((1 + 1) + (1 + 3) + (1 + 4), NewsFeed.objects.count())
+        self.assertEqual((1 + 3 + 1) + (1 + 3 + 1) + (1 + 4), NewsFeed.objects.count())
         cached_list = NewsFeedService.get_cached_newsfeeds(self.pluto.id)
         self.assertEqual(len(cached_list), 3)
         cached_list = NewsFeedService.get_cached_newsfeeds(self.brunch.id)
-        self.assertEqual(len(cached_list), 3)
\ No newline at end of file
+        self.assertEqual(len(cached_list), 3)
+
+    def test_hybrid_fanout(self):
+        request = Request(APIRequestFactory().get('/api/newsfeeds/'))
+        for i in range(2):
+            self.create_friendship(self.create_user('user{}'.format(i)), self.pluto)
+        self.create_friendship(self.brunch, self.pluto)
+        fanned_out_tweet = self.create_tweet(self.pluto, 'fanned out')
+        self._fanout(fanned_out_tweet)
+        self.assertEqual(NewsFeed.objects.filter(tweet=fanned_out_tweet).count(), 1 + 3)
+
+        # no user is pulled, the followings are not looked up
+        with mock.patch.object(FriendshipService, 'get_following_user_id_set') as get_following_user_id_set:
+            self.assertEqual(NewsFeedService.get_pulled_users(self.brunch.id), {})
+        get_following_user_id_set.assert_not_called()
+
+        # pluto has reached the threshold, the followers pull the new tweets
+        GateKeeper.set_kv('switch_newsfeeds_to_hybrid_fanout', 'percent', 100)
+        pulled_tweet = self.create_tweet(self.pluto, 'pulled')
+        # the followers are counted by their ids, not by another query
+        with mock.patch.object(FriendshipService, 'get_follower_count') as get_follower_count:
+            msg = self._fanout(pulled_tweet)
+        get_follower_count.assert_not_called()
+        self.assertEqual(
+            msg,
+            'Tweets of user {} are pulled by followers, no newsfeed is fanned out.'.format(
+                self.pluto.id,
+            ),
+        )
+        self.assertEqual(NewsFeed.objects.filter(tweet=pulled_tweet).count(), 1)
+        self.assertEqual(
+            list(NewsFeedService.get_pulled_users(self.brunch.id)),
+            [self.pluto.id],
+        )
+        self.assertEqual(NewsFeedService.get_pulled_users(self.pluto.id), {})
+        # only the followings are looked up among the pulled users
+        star = self.create_user('star')
+        RedisClient.get_connection().zadd(PULL_FANOUT_USERS_KEY, {star.id: 0})
+        NewsFeedService.invalidate_pulled_followings([self.brunch.id])
+        self.assertEqual(
+            list(NewsFeedService.get_pulled_users(self.brunch.id)),
+            [self.pluto.id],
+        )
+        # then cached until the reader follows or unfollows
+        with mock.patch.object(FriendshipService, 'get_following_user_id_set') as get_following_user_id_set:
+            NewsFeedService.get_pulled_users(self.brunch.id)
+        get_following_user_id_set.assert_not_called()
+        self.create_friendship(self.brunch, star)
+        self.assertEqual(
+            sorted(NewsFeedService.get_pulled_users(self.brunch.id)),
+            [self.pluto.id, star.id],
+        )
+        Friendship.objects.filter(following_user=self.brunch, followed_user=star).delete()
+        self.assertEqual(
+            list(NewsFeedService.get_pulled_users(self.brunch.id)),
+            [self.pluto.id],
+        )
+
+        # merged at read time, the fanned out tweet is not pulled again
+        newsfeeds = NewsFeedService.paginate_pushed_newsfeeds(
+            self.brunch.id,
+            EndlessPagination(),
+            request,
+        )
+        self.assertEqual(
+            [newsfeed.tweet_id for newsfeed in newsfeeds],
+            [pulled_tweet.id, fanned_out_tweet.id],
+        )
+        self.assertEqual(newsfeeds[0].id, -pulled_tweet.id)
+
+        # stays pulled after the switch is turned off
+        GateKeeper.set_kv('switch_newsfeeds_to_hybrid_fanout', 'percent', 0)
+        tweet = self.create_tweet(self.pluto, 'still pulled')
+        self._fanout(tweet)
+        self.assertEqual(NewsFeed.objects.filter(tweet=tweet).count(), 1)
+        newsfeeds = NewsFeedService.paginate_pushed_newsfeeds(
+            self.brunch.id,
+            EndlessPagination(),
+            request,
+        )
+        self.assertEqual(len(newsfeeds), 3)
+        # the fanned out newsfeeds are cached without the pulled tweets
+        self.assertEqual(len(NewsFeedService.get_cached_newsfeeds(self.brunch.id)), 1)
+
+        # users below the threshold are still fanned out
+        GateKeeper.set_kv('switch_newsfeeds_to_hybrid_fanout', 'percent', 100)
+        self.create_friendship(self.pluto, self.brunch)
+        tweet = self.create_tweet(self.brunch, 'fanned out')
+        self._fanout(tweet)
+        self.assertEqual(NewsFeed.objects.filter(tweet=tweet).count(), 1 + 1)
+
+    def test_fanout_batch_task(self):
+        kitty = self.create_user('kitty')
+        self.create_newsfeed(self.brunch, self.create_tweet(self.pluto))
+        NewsFeedService.get_cached_newsfeeds(self.brunch.id)
+        timeline_key = USER_NEWSFEEDS_TIMELINE_PATTERN.format(user_id=self.brunch.id)
+        RedisHelper.load_ids_from_timeline(
+            timeline_key,
+            NewsFeed.objects.filter(user_id=self.brunch.id).order_by('-created_at'),
+        )
+
+        # no cache is filled, only the cached lists are pushed to
+        tweet = self.create_tweet(self.pluto)
+        with self.assertNumQueries(2):
+            fanout_newsfeeds_batch_task(tweet.id, [self.brunch.id, kitty.id])
+        conn = RedisClient.get_connection()
+        self.assertEqual(conn.exists(USER_NEWSFEEDS_PATTERN.format(user_id=kitty.id)), 0)
+        self.assertEqual(conn.exists(USER_NEWSFEEDS_TIMELINE_PATTERN.format(user_id=kitty.id)), 0)
+
+        newsfeed = NewsFeed.objects.get(user=self.brunch, tweet=tweet)
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.brunch.id)
+        self.assertEqual(len(newsfeeds), 2)
+        self.assertEqual(newsfeeds[0].id, newsfeed.id)
+        self.assertEqual(newsfeeds[0].created_at, newsfeed.created_at)
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(kitty.id)
+        self.assertEqual([newsfeed.tweet_id for newsfeed in newsfeeds], [tweet.id])
+        # only the list is written, the timeline which is not read is dropped
+        self.assertEqual(conn.exists(timeline_key), 0)
+
+        # and the other way round when the timeline is switched on
+        GateKeeper.set_kv('switch_timeline_to_sorted_set', 'percent', 100)
+        queryset = NewsFeed.objects.filter(user_id=self.brunch.id).order_by('-created_at')
+        RedisHelper.load_ids_from_timeline(timeline_key, queryset)
+        tweet = self.create_tweet(self.pluto)
+        fanout_newsfeeds_batch_task(tweet.id, [self.brunch.id])
+        newsfeed = NewsFeed.objects.get(user=self.brunch, tweet=tweet)
+        ids, timeline_size = RedisHelper.load_ids_from_timeline(timeline_key, queryset)
+        self.assertEqual(ids[0], newsfeed.id)
+        self.assertEqual(timeline_size, 3)
+        self.assertEqual(conn.exists(USER_NEWSFEEDS_PATTERN.format(user_id=self.brunch.id)), 0)
+
+        # the timeline is being filled by another request, read from database
+        conn.delete(timeline_key)
+        conn.set(CACHE_FILL_LOCK_PATTERN.format(key=timeline_key), 'another filler')
+        with self.assertNumQueries(0):
+            self.assertIsNone(RedisHelper.load_ids_from_timeline(timeline_key, queryset))
+
+    def test_fanout_tasks_are_idempotent(self):
+        kitty = self.create_user('kitty')
+        self.create_friendship(self.brunch, self.pluto)
+        self.create_friendship(kitty, self.pluto)
+        tweet = self.create_tweet(self.pluto)
+        NewsFeedService.get_cached_newsfeeds(self.brunch.id)
+
+        # a duplicate delivery of a finished batch is skipped
+        fanout_newsfeeds_batch_task(tweet.id, [self.brunch.id, kitty.id])
+        with self.assertNumQueries(0):
+            msg = fanout_newsfeeds_batch_task(tweet.id, [self.brunch.id, kitty.id])
+        self.assertEqual(msg, 'The newsfeeds have already been created.')
+        self.assertEqual(NewsFeed.objects.filter(tweet=tweet).count(), 2)
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.brunch.id)
+        self.assertEqual([newsfeed.tweet_id for newsfeed in newsfeeds], [tweet.id])
+
+        # a retry after the batch failed halfway inserts the missing rows,
+        # the cached lists it might have pushed to are dropped
+        conn = RedisClient.get_connection()
+        tweet = self.create_tweet(self.pluto)
+        marker_key = FANOUT_BATCH_PATTERN.format(
+            tweet_id=tweet.id,
+            batch_key='{}-{}'.format(self.brunch.id, kitty.id),
+        )
+        conn.set(marker_key, 'inserted')
+        self.create_newsfeed(self.brunch, tweet)
+        self.assertEqual(conn.exists(USER_NEWSFEEDS_PATTERN.format(user_id=self.brunch.id)), 1)
+        fanout_newsfeeds_batch_task(tweet.id, [self.brunch.id, kitty.id])
+        self.assertEqual(NewsFeed.objects.filter(tweet=tweet).count(), 2)
+        self.assertEqual(conn.exists(USER_NEWSFEEDS_PATTERN.format(user_id=self.brunch.id)), 0)
+        self.assertEqual(conn.get(marker_key), b'done')
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.brunch.id)
+        self.assertEqual(len(newsfeeds), 2)
+
+        # the whole fanout can be retried as well
+        self._fanout(tweet)
+        self._fanout(tweet)
+        self.assertEqual(NewsFeed.objects.filter(tweet=tweet).count(), 1 + 2)
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.pluto.id)
+        self.assertEqual([newsfeed.tweet_id for newsfeed in newsfeeds], [tweet.id])
+
+    def test_activity_aware_fanout(self):
+        kitty = self.create_user('kitty')
+        self.create_friendship(self.brunch, self.pluto)
+        self.create_friendship(kitty, self.pluto)
+        GateKeeper.set_kv('switch_newsfeeds_to_activity_aware_fanout', 'percent', 100)
+        self.assertEqual(UserService.mark_active(self.brunch.id), None)
+
+        # kitty is not tracked yet, which is not dormant
+        tweet = self.create_tweet(self.pluto)
+        self._fanout(tweet)
+        self.assertEqual(NewsFeed.objects.filter(tweet=tweet).count(), 1 + 2)
+        NewsFeedService.mark_user_active(kitty.id)
+
+        # everyone turns dormant right after being active
+        with override_settings(DORMANT_USER_THRESHOLD=0):
+            new_tweet = self.create_tweet(self.pluto)
+            self._fanout(new_tweet)
+            self.assertEqual(NewsFeed.objects.filter(tweet=new_tweet).count(), 1)
+
+            # only the tweets since the last active time are pulled
+            NewsFeed.objects.filter(user=kitty, tweet=tweet).delete()
+            NewsFeedService.mark_user_active(kitty.id)
+        newsfeed = NewsFeed.objects.get(user=kitty, tweet=new_tweet)
+        self.assertEqual(newsfeed.created_at, new_tweet.created_at)
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(kitty.id)
+        self.assertEqual([newsfeed.tweet_id for newsfeed in newsfeeds], [new_tweet.id])
+        conn = RedisClient.get_connection()
+        self.assertEqual(conn.exists(NEWSFEEDS_REBUILD_SCHEDULED_PATTERN.format(user_id=kitty.id)), 0)
+
+        # a rebuild is scheduled at most once at a time
+        conn.set(NEWSFEEDS_REBUILD_SCHEDULED_PATTERN.format(user_id=self.brunch.id), 1)
+        with override_settings(DORMANT_USER_THRESHOLD=0):
+            NewsFeedService.mark_user_active(self.brunch.id)
+        self.assertEqual(NewsFeed.objects.filter(user=self.brunch, tweet=new_tweet).exists(), False)
+
+        # nothing is left out when the switch is off
+        GateKeeper.set_kv('switch_newsfeeds_to_activity_aware_fanout', 'percent', 0)
+        with override_settings(DORMANT_USER_THRESHOLD=0):
+            tweet = self.create_tweet(self.pluto)
+            self._fanout(tweet)
+        self.assertEqual(NewsFeed.objects.filter(tweet=tweet).count(), 1 + 2)
+
+    def test_apply_friendship_changes(self):
+        kitty = self.create_user('kitty')
+        pluto_tweets = [self.create_tweet(self.pluto) for i in range(4)]
+        kitty_tweet = self.create_tweet(kitty)
+        fan = self.create_user('fan')
+        fan_newsfeed = self.create_newsfeed(fan, kitty_tweet)
+        NewsFeedService.get_cached_newsfeeds(self.brunch.id)
+
+        # a task has been scheduled, the changes wait for it
+        conn = RedisClient.get_connection()
+        conn.set(FRIENDSHIP_CHANGES_SCHEDULED_KEY, 1)
+        self.create_friendship(self.brunch, self.pluto)
+        self.create_friendship(self.brunch, kitty)
+        self.create_friendship(fan, self.pluto)
+        friendship = self.create_friendship(kitty, self.pluto)
+        friendship.delete()
+        self.assertEqual(NewsFeed.objects.count(), 1)
+
+        # the latest tweets of the followed users are merged in one batch
+        msg = apply_friendship_changes_task()
+        self.assertEqual(msg, '4 friendship changes have been applied.')
+        self.assertEqual(conn.exists(USER_NEWSFEEDS_PATTERN.format(user_id=self.brunch.id)), 0)
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.brunch.id)
+        self.assertEqual(
+            [newsfeed.tweet_id for newsfeed in newsfeeds],
+            [kitty_tweet.id] + [tweet.id for tweet in pluto_tweets[:0:-1]],
+        )
+        self.assertEqual(newsfeeds[0].created_at, kitty_tweet.created_at)
+        self.assertEqual(NewsFeed.objects.filter(user=kitty).count(), 0)
+        # the other newsfeeds are not dated back
+        self.assertEqual(NewsFeed.objects.filter(user=fan).count(), 1 + 3)
+        fan_newsfeed_created_at = fan_newsfeed.created_at
+        fan_newsfeed.refresh_from_db()
+        self.assertEqual(fan_newsfeed.created_at, fan_newsfeed_created_at)
+
+        # nothing left to apply
+        with self.assertNumQueries(0):
+            msg = apply_friendship_changes_task()
+        self.assertEqual(msg, '0 friendship changes have been applied.')
+
+        # the mark is cleared by the task, the tweets are removed on unfollow
+        # right away by the eagerly run task
+        Friendship.objects.filter(following_user=self.brunch, followed_user=self.pluto).delete()
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.brunch.id)
+        self.assertEqual([newsfeed.tweet_id for newsfeed in newsfeeds], [kitty_tweet.id])
+
+        # the task tries again later while another one is applying
+        lock_key = CACHE_FILL_LOCK_PATTERN.format(key=FLUSHING_FRIENDSHIP_CHANGES_KEY)
+        conn.set(lock_key, 'another task')
+        with mock.patch.object(apply_friendship_changes_task, 'apply_async') as apply_async:
+            self.create_friendship(self.brunch, self.pluto)
+            self.assertEqual(apply_async.call_count, 1)
+            msg = apply_friendship_changes_task()
+        self.assertEqual(msg, '0 friendship changes have been applied.')
+        self.assertEqual(apply_async.call_count, 2)
+        apply_async.assert_called_with(countdown=FRIENDSHIP_CHANGES_DELAY)
+        self.assertEqual(conn.exists(FRIENDSHIP_CHANGES_SCHEDULED_KEY), 1)
+        self.assertEqual(NewsFeed.objects.filter(user=self.brunch).count(), 1)
+        conn.delete(lock_key)
+        msg = apply_friendship_changes_task()
+        self.assertEqual(msg, '1 friendship changes have been applied.')
+        self.assertEqual(conn.exists(FRIENDSHIP_CHANGES_SCHEDULED_KEY), 0)
+        self.assertEqual(NewsFeed.objects.filter(user=self.brunch).count(), 1 + 3)
@@ -7,6 +7,7 @@ from likes.models import Like
 from rest_framework.test import APIClient
 from django.contrib.contenttypes.models import ContentType
 from django.core.cache import caches
+from utils.local_cache import LocalCache
 from utils.redis_client import RedisClient
 from friendships.models import Friendship
 from django_hbase.models import HBaseModel
@@ -34,6 +35,7 @@ class TestCase(DjangoTestCase):
     def clear_cache(self):
         RedisClient.clear()
         caches['testing'].clear()
+        LocalCache.clear()
 
     @property
     def anonymous_client(self):
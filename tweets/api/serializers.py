@@ -2,20 +2,42 @@ from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from tweets.models import Tweet
 from tweets.services import TweetService
-from accounts.api.serializers import UserSerializerForTweet
+from accounts.api.serializers import render_user_with_profile
+from accounts.services import UserService
 from comments.api.serializers import CommentSerializer
 from likes.services import LikeService
 from likes.api.serializers import LikeSerializer
-from tweets.constants import TWEET_PHOTOS_UPLOAD_LIMIT
+from comments.services import CommentService
+from django.urls import reverse
+from tweets.constants import (
+    TWEET_DETAIL_COMMENTS_LIMIT,
+    TWEET_DETAIL_LIKES_LIMIT,
+    TWEET_FRAGMENT_FIELDS,
+    TWEET_PHOTOS_UPLOAD_LIMIT,
+)
+from urllib.parse import urlencode
 from utils.redis_helper import RedisHelper
+from utils.list_serializers import (
+    FragmentField,
+    PrefetchListSerializer,
+    load_fragments,
+    prime_cached_objects,
+    render_datetime,
+)
+from django.contrib.auth.models import User
 
 
 class TweetSerializer(serializers.ModelSerializer):
-    user = UserSerializerForTweet(source='cached_user')
+    # the viewer independent fields are rendered once into the fragments,
+    # which are cached per tweet and per user, see prefetch_page()
+    id = FragmentField()
+    user = FragmentField()
+    created_at = FragmentField()
+    content = FragmentField()
     comments_count = serializers.SerializerMethodField()
     likes_count = serializers.SerializerMethodField()
     has_liked = serializers.SerializerMethodField()
-    photo_urls = serializers.SerializerMethodField()
+    photo_urls = FragmentField()
 
     class Meta:
         model = Tweet
@@ -29,21 +51,64 @@ class TweetSerializer(serializers.ModelSerializer):
             'has_liked',
             'photo_urls',
         )
+        list_serializer_class = PrefetchListSerializer
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # everything loaded for the page being rendered, replaced as a whole
+        # by prefetch_page(), so that nothing is carried over to the next page
+        self.page = {}
+
+    def prefetch_page(self, tweets):
+        # the viewer independent fragments come from cache, users and photo urls
+        # are only loaded for the tweets whose fragments are missed
+        user_fragments = load_fragments(
+            tweets,
+            'user_id',
+            TweetService.get_user_fragments,
+            TweetService.set_user_fragments,
+            _render_user_fragments,
+        )
+        fragments = load_fragments(
+            tweets,
+            'id',
+            TweetService.get_tweet_fragments,
+            TweetService.set_tweet_fragments,
+            _render_fragments,
+        )
+        self.page = {
+            'fragments': {
+                tweet.id: dict(fragments[tweet.id], user=user_fragments[tweet.user_id])
+                for tweet in tweets
+            },
+            # the viewer dependent fields and the live counters
+            'counts': RedisHelper.get_counts(tweets, ['comments_count', 'likes_count']),
+            'liked_ids': LikeService.has_liked_many(self.context['request'].user, tweets),
+        }
+
+    def get_page(self, obj):
+        # a tweet rendered on its own makes a page by itself
+        if obj.id not in self.page.get('fragments', {}):
+            self.prefetch_page([obj])
+        return self.page
+
+    def get_fragment(self, obj):
+        return self.get_page(obj)['fragments'][obj.id]
+
+    def _get_count(self, obj, attr):
+        counts = self.get_page(obj)['counts']
+        if (obj.id, attr) in counts:
+            return counts[(obj.id, attr)]
+        return RedisHelper.get_count(obj, attr)
 
     def get_comments_count(self, obj):
-        return RedisHelper.get_count(obj, 'comments_count')
+        return self._get_count(obj, 'comments_count')
 
     def get_likes_count(self, obj):
-        return RedisHelper.get_count(obj, 'likes_count')
+        return self._get_count(obj, 'likes_count')
 
     def get_has_liked(self, obj):
-        return LikeService.has_liked(self.context['request'].user, obj)
-
-    def get_photo_urls(self, obj):
-        photo_urls = []
-        for photo in obj.tweetphoto_set.all().order_by('order'):
-            photo_urls.append(photo.file.url)
-        return photo_urls
+        return obj.id in self.get_page(obj)['liked_ids']
 
 # class TweetSerializerWithComments(TweetSerializer):
 #     # To get comments of a certain tweet, there are multiple ways,
@@ -67,8 +132,12 @@ class TweetSerializer(serializers.ModelSerializer):
 
 
 class TweetSerializerForDetail(TweetSerializer):
-    comments = CommentSerializer(source='comment_set', many=True)
-    likes = LikeSerializer(source='like_set', many=True)
+    # only a bounded preview of likes and comments is returned,
+    # likes_next and comments_next point to the apis for the rest
+    likes = serializers.SerializerMethodField()
+    likes_next = serializers.SerializerMethodField()
+    comments = serializers.SerializerMethodField()
+    comments_next = serializers.SerializerMethodField()
 
     class Meta:
         model = Tweet
@@ -78,13 +147,56 @@ class TweetSerializerForDetail(TweetSerializer):
             'created_at',
             'content',
             'likes',
+            'likes_next',
             'comments',
+            'comments_next',
             'likes_count',
             'comments_count',
             'has_liked',
             'photo_urls',
         )
 
+    def _get_likes_preview(self, obj):
+        if not hasattr(obj, '_likes_preview'):
+            obj._likes_preview = LikeService.get_latest_tweet_likes(
+                obj.id,
+                TWEET_DETAIL_LIKES_LIMIT,
+            )
+        return obj._likes_preview
+
+    def _get_comments_preview(self, obj):
+        if not hasattr(obj, '_comments_preview'):
+            obj._comments_preview = CommentService.get_latest_comments(
+                obj.id,
+                TWEET_DETAIL_COMMENTS_LIMIT,
+            )
+        return obj._comments_preview
+
+    def get_likes(self, obj):
+        likes, _ = self._get_likes_preview(obj)
+        return LikeSerializer(likes, context=self.context, many=True).data
+
+    def get_likes_next(self, obj):
+        likes, has_more = self._get_likes_preview(obj)
+        if not has_more:
+            return None
+        return '{}?{}'.format(reverse('tweets-likes', args=[obj.id]), urlencode({
+            'created_at__lt': likes[-1].created_at.isoformat(),
+        }))
+
+    def get_comments(self, obj):
+        comments, _ = self._get_comments_preview(obj)
+        return CommentSerializer(comments, context=self.context, many=True).data
+
+    def get_comments_next(self, obj):
+        comments, has_more = self._get_comments_preview(obj)
+        if not has_more:
+            return None
+        return '{}?{}'.format(reverse('comments-list'), urlencode({
+            'tweet_id': obj.id,
+            'created_at__lt': comments[-1].created_at.isoformat(),
+        }))
+
 
 class TweetSerializerForCreate(serializers.ModelSerializer):
     content = serializers.CharField(min_length=1, max_length=140)
@@ -116,3 +228,66 @@ class TweetSerializerForCreate(serializers.ModelSerializer):
                 validated_data['files'],
             )
         return tweet
+
+
+def _render_fragments(tweets):
+    # the single renderer of the fragments, used by TweetSerializer and
+    # render_tweets(), so that their cache entries are always the same
+    photo_urls = TweetService.get_photo_urls_of_tweets([tweet.id for tweet in tweets])
+    return {
+        tweet.id: {
+            'id': tweet.id,
+            'created_at': render_datetime(tweet.created_at),
+            'content': tweet.content,
+            'photo_urls': photo_urls[tweet.id],
+        }
+        for tweet in tweets
+    }
+
+
+def _render_user_fragments(tweets):
+    users = prime_cached_objects(tweets, User, 'user_id', '_cached_user')
+    UserService.prime_profiles(users)
+    user_fragments = {}
+    for tweet in tweets:
+        user = tweet.cached_user
+        user_fragments[tweet.user_id] = None if user is None else render_user_with_profile(user)
+    return user_fragments
+
+
+def render_tweets(tweets, request):
+    # the same output as TweetSerializer(tweets, many=True).data, built by
+    # plain dicts without going through the DRF fields. The fragment cache
+    # is shared with TweetSerializer, since both render the same fragments
+    tweets = list(tweets)
+    user_fragments = load_fragments(
+        tweets,
+        'user_id',
+        TweetService.get_user_fragments,
+        TweetService.set_user_fragments,
+        _render_user_fragments,
+    )
+    fragments = load_fragments(
+        tweets,
+        'id',
+        TweetService.get_tweet_fragments,
+        TweetService.set_tweet_fragments,
+        _render_fragments,
+    )
+
+    counts = RedisHelper.get_counts(tweets, ['comments_count', 'likes_count'])
+    liked_ids = LikeService.has_liked_many(request.user, tweets)
+    data = []
+    for tweet in tweets:
+        fragment = fragments[tweet.id]
+        data.append({
+            'id': fragment['id'],
+            'user': user_fragments[tweet.user_id],
+            'created_at': fragment['created_at'],
+            'content': fragment['content'],
+            'comments_count': counts[(tweet.id, 'comments_count')],
+            'likes_count': counts[(tweet.id, 'likes_count')],
+            'has_liked': tweet.id in liked_ids,
+            'photo_urls': fragment['photo_urls'],
+        })
+    return data
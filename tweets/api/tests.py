@@ -3,6 +3,13 @@ from rest_framework.test import APIClient
 from tweets.models import Tweet, TweetPhoto
 from django.core.files.uploadedfile import SimpleUploadedFile
 from utils.paginations import EndlessPagination
+from gatekeeper.models import GateKeeper
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from tweets.constants import TWEET_DETAIL_COMMENTS_LIMIT, TWEET_DETAIL_LIKES_LIMIT
+from tweets.api.serializers import TweetSerializer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
 
 
 TWEET_LIST_API = '/api/tweets/'
@@ -195,4 +202,122 @@ class TweetAPITests(TestCase):
         })
         self.assertEqual(response.data['has_next_page'], False)
         self.assertEqual(len(response.data['results']), 1)
-        self.assertEqual(response.data['results'][0]['id'], new_tweet.id)
\ No newline at end of file
+        self.assertEqual(response.data['results'][0]['id'], new_tweet.id)
+
+    def test_pagination_with_sorted_set_timeline(self):
+        GateKeeper.set_kv('switch_timeline_to_sorted_set', 'percent', 100)
+        self.test_pagination()
+
+    def test_has_liked_of_a_page(self):
+        page_size = EndlessPagination.page_size
+        tweets = [self.create_tweet(self.user1) for i in range(page_size)]
+        for tweet in tweets[::2]:
+            self.create_like(self.user2, tweet)
+        user2_client = APIClient()
+        user2_client.force_authenticate(self.user2)
+
+        with CaptureQueriesContext(connection) as context:
+            response = user2_client.get(TWEET_LIST_API, {'user_id': self.user1.id})
+        like_queries = [
+            query
+            for query in context.captured_queries
+            if 'likes_like' in query['sql']
+        ]
+        self.assertEqual(len(like_queries), 1)
+        self.assertEqual(len(response.data['results']), page_size)
+        for index, tweet_data in enumerate(response.data['results']):
+            # tweets are listed in reversed order
+            self.assertEqual(tweet_data['has_liked'], (page_size - 1 - index) % 2 == 0)
+
+    def test_retrieve_bounded_preview(self):
+        tweet = self.create_tweet(self.user1)
+        comments = [
+            self.create_comment(self.user2, tweet, str(i))
+            for i in range(TWEET_DETAIL_COMMENTS_LIMIT + 1)
+        ]
+        likes = [
+            self.create_like(self.create_user('kitten{}'.format(i)), tweet)
+            for i in range(TWEET_DETAIL_LIKES_LIMIT + 1)
+        ]
+        url = TWEET_RETRIEVE_API.format(tweet.id)
+
+        response = self.anonymous_client.get(url)
+        # the latest comments, the same as the first page of the comments api
+        self.assertEqual(
+            [comment['id'] for comment in response.data['comments']],
+            [comment.id for comment in comments[::-1][:TWEET_DETAIL_COMMENTS_LIMIT]],
+        )
+        # the latest likes
+        self.assertEqual(
+            [like['user']['id'] for like in response.data['likes']],
+            [like.user_id for like in likes[::-1][:TWEET_DETAIL_LIKES_LIMIT]],
+        )
+
+        # the rest are fetched from the paginated apis
+        response_comments = self.anonymous_client.get(response.data['comments_next'])
+        self.assertEqual(response_comments.data['has_next_page'], False)
+        self.assertEqual(
+            [comment['id'] for comment in response_comments.data['results']],
+            [comments[0].id],
+        )
+        response_likes = self.anonymous_client.get(response.data['likes_next'])
+        self.assertEqual(response_likes.data['has_next_page'], False)
+        self.assertEqual(
+            [like['user']['id'] for like in response_likes.data['results']],
+            [likes[0].user_id],
+        )
+
+        # nothing more
+        comments[0].delete()
+        likes[0].delete()
+        response = self.anonymous_client.get(url)
+        self.assertEqual(len(response.data['comments']), TWEET_DETAIL_COMMENTS_LIMIT)
+        self.assertEqual(response.data['comments'][-1]['id'], comments[1].id)
+        self.assertEqual(response.data['comments_next'], None)
+        self.assertEqual(len(response.data['likes']), TWEET_DETAIL_LIKES_LIMIT)
+        self.assertEqual(response.data['likes_next'], None)
+
+    def test_fragment_cache(self):
+        tweet = self.tweets1[-1]
+        self.create_like(self.user2, tweet)
+        user2_client = APIClient()
+        user2_client.force_authenticate(self.user2)
+        response = self.user1_client.get(TWEET_LIST_API, {'user_id': self.user1.id})
+        self.assertEqual(response.data['results'][0]['content'], tweet.content)
+
+        # the fragment is served from cache, the viewer dependent fields
+        # and the counters are still rendered per request
+        Tweet.objects.filter(id=tweet.id).update(content='not rendered yet')
+        response = user2_client.get(TWEET_LIST_API, {'user_id': self.user1.id})
+        self.assertEqual(response.data['results'][0]['content'], tweet.content)
+        self.assertEqual(response.data['results'][0]['has_liked'], True)
+        self.assertEqual(response.data['results'][0]['likes_count'], 1)
+        response = self.user1_client.get(TWEET_LIST_API, {'user_id': self.user1.id})
+        self.assertEqual(response.data['results'][0]['has_liked'], False)
+
+        # invalidated by saving tweet, user and profile
+        tweet.content = 'edited'
+        tweet.save()
+        profile = self.user1.profile
+        profile.nickname = 'kitten'
+        profile.save()
+        response = self.user1_client.get(TWEET_RETRIEVE_API.format(tweet.id))
+        self.assertEqual(response.data['content'], 'edited')
+        response = self.user1_client.get(TWEET_LIST_API, {'user_id': self.user1.id})
+        self.assertEqual(response.data['results'][0]['user']['nickname'], 'kitten')
+        self.user1.username = 'user1renamed'
+        self.user1.save()
+        response = self.user1_client.get(TWEET_RETRIEVE_API.format(tweet.id))
+        self.assertEqual(response.data['user']['username'], 'user1renamed')
+
+        # a reused serializer keeps nothing of the previous page
+        request = Request(APIRequestFactory().get(TWEET_LIST_API))
+        serializer = TweetSerializer(context={'request': request}, many=True)
+        data = serializer.to_representation(self.tweets1[:2])
+        self.assertEqual([item['id'] for item in data], [tweet.id for tweet in self.tweets1[:2]])
+        serializer.to_representation(self.tweets1[2:])
+        self.assertEqual(list(serializer.child.page['fragments']), [self.tweets1[2].id])
+        self.assertEqual(list(serializer.child.page['counts']), [
+            (self.tweets1[2].id, 'comments_count'),
+            (self.tweets1[2].id, 'likes_count'),
+        ])
@@ -1,10 +1,12 @@
 from rest_framework import viewsets, status
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from tweets.api.serializers import (
     TweetSerializer,
     TweetSerializerForCreate,
     TweetSerializerForDetail,
+    render_tweets,
 )
 from tweets.models import Tweet
 from newsfeeds.services import NewsFeedService
@@ -13,6 +15,9 @@ from utils.paginations import EndlessPagination
 from tweets.services import TweetService
 from django.utils.decorators import method_decorator
 from ratelimit.decorators import ratelimit
+from gatekeeper.models import GateKeeper
+from likes.api.serializers import LikeSerializer, render_likes
+from likes.services import LikeService
 
 
 class TweetViewSet(viewsets.GenericViewSet):
@@ -21,7 +26,7 @@ class TweetViewSet(viewsets.GenericViewSet):
     pagination_class = EndlessPagination
 
     def get_permissions(self):
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'likes']:
             return [AllowAny()]
         return [IsAuthenticated()]
 
@@ -29,12 +34,21 @@ class TweetViewSet(viewsets.GenericViewSet):
     @method_decorator(ratelimit(key='user_or_ip', rate='5/s', method='GET', block=True))
     def list(self, request):
         user_id = request.query_params['user_id']
-        cached_tweets = TweetService.get_cached_tweets(user_id=user_id)
-        tweets_page = self.paginator.paginate_cached_list(cached_tweets, request)
+        if GateKeeper.is_switch_on('switch_timeline_to_sorted_set'):
+            tweets_page = TweetService.paginate_cached_tweets_timeline(
+                user_id,
+                self.paginator,
+                request,
+            )
+        else:
+            cached_tweets = TweetService.get_lazy_cached_tweets(user_id=user_id)
+            tweets_page = self.paginator.paginate_cached_list(cached_tweets, request)
         if tweets_page is None:
             queryset = Tweet.objects.filter(user_id=user_id).order_by('-created_at')
             tweets_page = self.paginate_queryset(queryset)
 
+        if GateKeeper.is_switch_on('switch_tweets_to_plain_renderer'):
+            return self.get_paginated_response(render_tweets(tweets_page, request))
         serializer = TweetSerializer(
             tweets_page,
             context={'request': request},
@@ -50,6 +64,26 @@ class TweetViewSet(viewsets.GenericViewSet):
         )
         return Response(serializer.data)
 
+    @action(methods=['GET'], detail=True)
+    @method_decorator(ratelimit(key='user_or_ip', rate='5/s', method='GET', block=True))
+    def likes(self, request, pk):
+        # the rest of the likes which are not in the tweet detail api
+        tweet = self.get_object()
+        cached_likes = LikeService.get_cached_tweet_likes(tweet.id)
+        likes_page = self.paginator.paginate_cached_list(cached_likes, request)
+        if likes_page is None:
+            queryset = tweet.like_set
+            likes_page = self.paginate_queryset(queryset)
+
+        if GateKeeper.is_switch_on('switch_likes_to_plain_renderer'):
+            return self.get_paginated_response(render_likes(likes_page))
+        serializer = LikeSerializer(
+            likes_page,
+            context={'request': request},
+            many=True,
+        )
+        return self.get_paginated_response(serializer.data)
+
     # For sensitive action, rate limiter combination might be applied
     @method_decorator(ratelimit(key='user', rate='1/s', method='POST', block=True))
     @method_decorator(ratelimit(key='user', rate='5/m', method='POST', block=True))
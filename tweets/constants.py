@@ -11,3 +11,19 @@ TWEET_PHOTO_STATUS_CHOICES = (
 )
 
 TWEET_PHOTOS_UPLOAD_LIMIT = 9
+
+# photo urls on S3 are signed and expire in an hour by default,
+# the cached urls must expire before them
+TWEET_PHOTO_URLS_CACHE_TIMEOUT = 30 * 60
+
+# the tweet detail api only returns a preview of likes and comments,
+# the rest are fetched from the paginated likes and comments api
+TWEET_DETAIL_LIKES_LIMIT = 20
+TWEET_DETAIL_COMMENTS_LIMIT = 20
+
+# the viewer independent part of a rendered tweet is cached per tweet,
+# bump the version whenever the rendered shape changes. It carries
+# photo and avatar urls, so it must expire no later than the photo urls
+TWEET_FRAGMENT_VERSION = 1
+TWEET_FRAGMENT_FIELDS = ('id', 'created_at', 'content', 'photo_urls')
+TWEET_FRAGMENT_CACHE_TIMEOUT = TWEET_PHOTO_URLS_CACHE_TIMEOUT
@@ -3,4 +3,22 @@ def push_tweet_to_cache(sender, instance, created, **kwargs):
         return
 
     from tweets.services import TweetService
-    TweetService.push_tweet_to_cache(instance)
\ No newline at end of file
+    TweetService.push_tweet_to_cache(instance)
+
+
+def invalidate_photo_urls(sender, instance, **kwargs):
+    # photo added, status changed or photo deleted
+    if instance.tweet_id is None:
+        return
+
+    from tweets.services import TweetService
+    TweetService.invalidate_photo_urls(instance.tweet_id)
+
+
+def invalidate_tweet_fragment(sender, instance, **kwargs):
+    # a new tweet has never been rendered
+    if kwargs.get('created'):
+        return
+
+    from tweets.services import TweetService
+    TweetService.invalidate_tweet_fragment(instance.id)
@@ -0,0 +1,21 @@
+# Generated by Django 3.1.3 on 2026-10-18 18:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0004_auto_20220428_0434'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CountDeltaFlush',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('flush_id', models.CharField(max_length=32, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
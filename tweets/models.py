@@ -6,7 +6,11 @@ from django.contrib.contenttypes.models import ContentType
 from tweets.constants import TweetPhotoStatus, TWEET_PHOTO_STATUS_CHOICES
 from utils.memcached_helper import MemcachedHelper
 from django.db.models.signals import post_save, pre_delete
-from tweets.listeners import push_tweet_to_cache
+from tweets.listeners import (
+    push_tweet_to_cache,
+    invalidate_photo_urls,
+    invalidate_tweet_fragment,
+)
 from utils.listeners import invalidate_object_cache
 
 
@@ -48,6 +52,9 @@ class Tweet(models.Model):
 
     @property
     def cached_user(self):
+        # may have been primed for a whole page by the list serializer
+        if hasattr(self, '_cached_user'):
+            return self._cached_user
         return MemcachedHelper.get_object_through_cache(User, self.user_id)
 
 
@@ -87,9 +94,24 @@ class TweetPhoto(models.Model):
         return f'{self.tweet_id}: {self.file}'
 
 
+class CountDeltaFlush(models.Model):
+    # a flush of the buffered count deltas which has been applied, it is
+    # recorded in the same transaction as the updates of the flush,
+    # see RedisHelper.flush_count_deltas()
+    flush_id = models.CharField(max_length=32, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f'{self.created_at} {self.flush_id}'
+
+
 post_save.connect(invalidate_object_cache, sender=Tweet)
 pre_delete.connect(invalidate_object_cache, sender=Tweet)
 post_save.connect(push_tweet_to_cache, sender=Tweet)
+post_save.connect(invalidate_tweet_fragment, sender=Tweet)
+pre_delete.connect(invalidate_tweet_fragment, sender=Tweet)
+post_save.connect(invalidate_photo_urls, sender=TweetPhoto)
+pre_delete.connect(invalidate_photo_urls, sender=TweetPhoto)
 
 
 
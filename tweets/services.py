@@ -1,7 +1,24 @@
+from django.conf import settings
+from django.core.cache import caches
+from tweets.constants import (
+    TWEET_FRAGMENT_CACHE_TIMEOUT,
+    TWEET_FRAGMENT_VERSION,
+    TWEET_PHOTO_URLS_CACHE_TIMEOUT,
+)
 from tweets.models import TweetPhoto, Tweet
-from twitter.cache import USER_TWEETS_PATTERN
+from twitter.cache import (
+    TWEET_FRAGMENT_PATTERN,
+    TWEET_PHOTO_URLS_PATTERN,
+    TWEET_USER_FRAGMENT_PATTERN,
+    USER_TWEETS_PATTERN,
+    USER_TWEETS_TIMELINE_PATTERN,
+)
+from gatekeeper.models import GateKeeper
+from utils.redis_client import RedisClient
 from utils.redis_helper import RedisHelper
 
+cache = caches['testing'] if settings.TESTING else caches['default']
+
 
 class TweetService(object):
 
@@ -17,6 +34,107 @@ class TweetService(object):
             )
             photos.append(photo)
         TweetPhoto.objects.bulk_create(photos)
+        # bulk_create() cannot trigger post_save signal
+        cls.invalidate_photo_urls(tweet.id)
+
+    @classmethod
+    def get_photo_urls(cls, tweet):
+        return cls.get_photo_urls_of_tweets([tweet.id])[tweet.id]
+
+    @classmethod
+    def get_photo_urls_of_tweets(cls, tweet_ids):
+        # returns {tweet_id: photo_urls}, tweets without photo are cached
+        # with an empty list as well, all the missed tweets are loaded by
+        # one query on the (tweet, order) index
+        key_to_tweet_id = {
+            TWEET_PHOTO_URLS_PATTERN.format(tweet_id=tweet_id): tweet_id
+            for tweet_id in tweet_ids
+        }
+        tweet_id_to_urls = {
+            key_to_tweet_id[key]: photo_urls
+            for key, photo_urls in cache.get_many(list(key_to_tweet_id.keys())).items()
+        }
+        missed_ids = [
+            tweet_id
+            for tweet_id in key_to_tweet_id.values()
+            if tweet_id not in tweet_id_to_urls
+        ]
+        if not missed_ids:
+            return tweet_id_to_urls
+
+        missed_urls = {tweet_id: [] for tweet_id in missed_ids}
+        photos = TweetPhoto.objects.filter(tweet_id__in=missed_ids).order_by('tweet_id', 'order')
+        for photo in photos:
+            missed_urls[photo.tweet_id].append(photo.file.url)
+        cache.set_many(
+            {
+                TWEET_PHOTO_URLS_PATTERN.format(tweet_id=tweet_id): photo_urls
+                for tweet_id, photo_urls in missed_urls.items()
+            },
+            timeout=TWEET_PHOTO_URLS_CACHE_TIMEOUT,
+        )
+        tweet_id_to_urls.update(missed_urls)
+        return tweet_id_to_urls
+
+    @classmethod
+    def invalidate_photo_urls(cls, tweet_id):
+        key = TWEET_PHOTO_URLS_PATTERN.format(tweet_id=tweet_id)
+        cache.delete(key)
+        # photo urls are part of the tweet fragment
+        cls.invalidate_tweet_fragment(tweet_id)
+
+    @classmethod
+    def get_tweet_fragments(cls, tweet_ids):
+        # returns {tweet_id: fragment} of the cached ones
+        key_to_id = {
+            TWEET_FRAGMENT_PATTERN.format(version=TWEET_FRAGMENT_VERSION, tweet_id=tweet_id): tweet_id
+            for tweet_id in tweet_ids
+        }
+        return {
+            key_to_id[key]: fragment
+            for key, fragment in cache.get_many(list(key_to_id.keys())).items()
+        }
+
+    @classmethod
+    def set_tweet_fragments(cls, tweet_id_to_fragment):
+        cache.set_many(
+            {
+                TWEET_FRAGMENT_PATTERN.format(version=TWEET_FRAGMENT_VERSION, tweet_id=tweet_id): fragment
+                for tweet_id, fragment in tweet_id_to_fragment.items()
+            },
+            timeout=TWEET_FRAGMENT_CACHE_TIMEOUT,
+        )
+
+    @classmethod
+    def invalidate_tweet_fragment(cls, tweet_id):
+        cache.delete(TWEET_FRAGMENT_PATTERN.format(version=TWEET_FRAGMENT_VERSION, tweet_id=tweet_id))
+
+    @classmethod
+    def get_user_fragments(cls, user_ids):
+        # the user block is cached per user instead of per tweet,
+        # so that a user or profile change only invalidates one entry
+        key_to_id = {
+            TWEET_USER_FRAGMENT_PATTERN.format(version=TWEET_FRAGMENT_VERSION, user_id=user_id): user_id
+            for user_id in user_ids
+        }
+        return {
+            key_to_id[key]: fragment
+            for key, fragment in cache.get_many(list(key_to_id.keys())).items()
+        }
+
+    @classmethod
+    def set_user_fragments(cls, user_id_to_fragment):
+        cache.set_many(
+            {
+                TWEET_USER_FRAGMENT_PATTERN.format(version=TWEET_FRAGMENT_VERSION, user_id=user_id): fragment
+                for user_id, fragment in user_id_to_fragment.items()
+            },
+            timeout=TWEET_FRAGMENT_CACHE_TIMEOUT,
+        )
+
+    @classmethod
+    def invalidate_user_fragment(cls, user_id):
+        cache.delete(TWEET_USER_FRAGMENT_PATTERN.format(version=TWEET_FRAGMENT_VERSION, user_id=user_id))
 
     @classmethod
     def get_cached_tweets(cls, user_id):
@@ -24,9 +142,31 @@ class TweetService(object):
         key = USER_TWEETS_PATTERN.format(user_id=user_id)
         return RedisHelper.download_objects_from_cache(key, queryset)
 
+    @classmethod
+    def get_lazy_cached_tweets(cls, user_id):
+        # only the entries which are actually paginated over get deserialized
+        queryset = Tweet.objects.filter(user_id=user_id).order_by('-created_at')
+        key = USER_TWEETS_PATTERN.format(user_id=user_id)
+        return RedisHelper.load_lazy_cached_list(key, queryset)
+
     @classmethod
     def push_tweet_to_cache(cls, tweet):
+        # the list is always written, the pulled newsfeeds read it whatever
+        # the switch says. The timeline is only written when it is read,
+        # otherwise it is dropped, so that it would not be read stale
+        # once the switch is turned on
         queryset = Tweet.objects.filter(user_id=tweet.user_id).order_by('-created_at')
         key = USER_TWEETS_PATTERN.format(user_id=tweet.user_id)
         RedisHelper.push_object(key, tweet, queryset)
+        key = USER_TWEETS_TIMELINE_PATTERN.format(user_id=tweet.user_id)
+        if GateKeeper.is_switch_on('switch_timeline_to_sorted_set'):
+            RedisHelper.push_object_to_timeline(key, tweet)
+        else:
+            RedisClient.get_connection().delete(key)
+
+    @classmethod
+    def paginate_cached_tweets_timeline(cls, user_id, paginator, request):
+        queryset = Tweet.objects.filter(user_id=user_id).order_by('-created_at')
+        key = USER_TWEETS_TIMELINE_PATTERN.format(user_id=user_id)
+        return paginator.paginate_cached_timeline(key, queryset, request)
 
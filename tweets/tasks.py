@@ -0,0 +1,10 @@
+from celery import shared_task
+from utils.redis_helper import RedisHelper
+from utils.time_constants import ONE_HOUR
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def flush_count_deltas_task():
+    # scheduled by celery beat, see CELERY_BEAT_SCHEDULE
+    rows = RedisHelper.flush_count_deltas()
+    return '{} rows have been updated.'.format(rows)
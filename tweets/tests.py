@@ -7,6 +7,7 @@ from utils.redis_client import RedisClient
 from utils.redis_serializers import DjangoModelSerializer
 from tweets.services import TweetService
 from twitter.cache import USER_TWEETS_PATTERN
+from django.core.files.uploadedfile import SimpleUploadedFile
 
 
 # Create your tests here.
@@ -95,4 +96,47 @@ class TweetServiceTests(TestCase):
         self.assertEqual(conn.exists(key), True)
 
         tweets = TweetService.get_cached_tweets(self.pluto.id)
-        self.assertEqual([t.id for t in tweets], [tweet2.id, tweet1.id])
\ No newline at end of file
+        self.assertEqual([t.id for t in tweets], [tweet2.id, tweet1.id])
+
+    def test_stale_cached_tweets_are_rebuilt(self):
+        tweet = self.create_tweet(self.pluto, 'tweet')
+        RedisClient.clear()
+
+        # a list left behind by the old json serializer
+        conn = RedisClient.get_connection()
+        key = USER_TWEETS_PATTERN.format(user_id=self.pluto.id)
+        conn.rpush(key, DjangoModelSerializer.serialize(tweet))
+
+        tweets = TweetService.get_cached_tweets(self.pluto.id)
+        self.assertEqual([t.id for t in tweets], [tweet.id])
+        tweets = TweetService.get_cached_tweets(self.pluto.id)
+        self.assertEqual([t.id for t in tweets], [tweet.id])
+        self.assertEqual(conn.llen(key), 1)
+
+    def test_get_photo_urls_of_tweets(self):
+        tweet = self.create_tweet(self.pluto, 'with photos')
+        no_photo_tweet = self.create_tweet(self.pluto, 'no photo')
+        TweetService.create_photos_from_files(tweet, [
+            SimpleUploadedFile('selfie{}.jpg'.format(i), b'fake image', content_type='image/jpeg')
+            for i in range(2)
+        ])
+
+        # misses are loaded by one query
+        with self.assertNumQueries(1):
+            tweet_id_to_urls = TweetService.get_photo_urls_of_tweets([tweet.id, no_photo_tweet.id])
+        self.assertEqual(len(tweet_id_to_urls[tweet.id]), 2)
+        self.assertEqual('selfie0' in tweet_id_to_urls[tweet.id][0], True)
+        self.assertEqual(tweet_id_to_urls[no_photo_tweet.id], [])
+
+        # cached, including the empty one
+        with self.assertNumQueries(0):
+            TweetService.get_photo_urls_of_tweets([tweet.id, no_photo_tweet.id])
+
+        # invalidated when photos change
+        photo = TweetPhoto.objects.filter(tweet=tweet).order_by('order').first()
+        photo.delete()
+        self.assertEqual(len(TweetService.get_photo_urls(tweet)), 1)
+        TweetService.create_photos_from_files(no_photo_tweet, [
+            SimpleUploadedFile('selfie.jpg', b'fake image', content_type='image/jpeg'),
+        ])
+        self.assertEqual(len(TweetService.get_photo_urls(no_photo_tweet)), 1)
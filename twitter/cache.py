@@ -1,7 +1,30 @@
 # memcached
 FOLLOWINGS_PATTERN = 'followings:{user_id}'
 USER_PROFILE_PATTERN = 'userprofile:{user_id}'
+TWEET_PHOTO_URLS_PATTERN = 'tweet_photo_urls:{tweet_id}'
+TWEET_FRAGMENT_PATTERN = 'tweet_fragment:v{version}:{tweet_id}'
+TWEET_USER_FRAGMENT_PATTERN = 'tweet_user_fragment:v{version}:{user_id}'
+PULLED_FOLLOWINGS_PATTERN = 'pulled_followings:{user_id}'
+USER_ACTIVE_MARKED_PATTERN = 'user_active_marked:{user_id}'
+
+# in-process cache
+LOCAL_CACHE_INVALIDATION_CHANNEL = 'local_cache:invalidation'
 
 # redis
 USER_TWEETS_PATTERN = 'user_tweets:{user_id}'
 USER_NEWSFEEDS_PATTERN = 'newsfeeds:{user_id}'
+USER_TWEETS_TIMELINE_PATTERN = 'user_tweets_timeline:{user_id}'
+USER_NEWSFEEDS_TIMELINE_PATTERN = 'newsfeeds_timeline:{user_id}'
+TWEET_LIKES_PATTERN = 'tweet_likes:{tweet_id}'
+TWEET_COMMENTS_PATTERN = 'tweet_comments:{tweet_id}'
+CACHE_FILL_LOCK_PATTERN = 'lock:{key}'
+COUNT_DELTAS_KEY = 'count_deltas'
+FLUSHING_COUNT_DELTAS_KEY = 'count_deltas:flushing'
+FLUSH_ID_PATTERN = 'flush_id:{key}'
+PULL_FANOUT_USERS_KEY = 'pull_fanout_users'
+USER_LAST_ACTIVE_KEY = 'user_last_active'
+NEWSFEEDS_REBUILD_SCHEDULED_PATTERN = 'newsfeeds_rebuild:scheduled:{user_id}'
+FANOUT_BATCH_PATTERN = 'fanout_batch:{tweet_id}:{batch_key}'
+FRIENDSHIP_CHANGES_KEY = 'friendship_changes'
+FLUSHING_FRIENDSHIP_CHANGES_KEY = 'friendship_changes:flushing'
+FRIENDSHIP_CHANGES_SCHEDULED_KEY = 'friendship_changes:scheduled'
@@ -56,11 +56,17 @@ INSTALLED_APPS = [
     'comments',
     'likes',
     'inbox',
+    # shared helpers, listed for their management commands
+    'utils',
 ]
 
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
+    'DEFAULT_RENDERER_CLASSES': [
+        'utils.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
     ],
@@ -76,6 +82,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'utils.middleware.IdentityMapMiddleware',
+    'newsfeeds.middleware.LastActiveMiddleware',
 ]
 
 ROOT_URLCONF = 'twitter.urls'
@@ -179,6 +187,10 @@ CACHES = {
         'KEY_PREFIX': 'rl',
     }
 }
+# in-process LRU in front of memcached, 0 to disable it,
+# cached objects live LOCAL_CACHE_TIMEOUT seconds at most
+LOCAL_CACHE_MAX_SIZE = 10000
+LOCAL_CACHE_TIMEOUT = 60
 
 # Redis
 REDIS_HOST = '127.0.0.1'
@@ -186,6 +198,19 @@ REDIS_PORT = 6379
 REDIS_DB = 0 if TESTING else 1
 REDIS_KEY_EXPIRE_TIME = 7 * 86400
 REDIS_LIST_LENGTH_LIMIT = 1000 if not TESTING else 20
+# cached lists are fetched lazily by chunks of this size
+REDIS_LIST_CHUNK_SIZE = 32 if not TESTING else 4
+# an entry located by its primary key is only looked for among the first
+# N entries of a cached list, the list is rebuilt if it is further down
+REDIS_LIST_SCAN_WINDOW = 64 if not TESTING else 8
+# how many cached lists are probed in one pipeline
+REDIS_PIPELINE_BATCH_SIZE = 100 if not TESTING else 2
+# single-flight cache fill, in seconds
+REDIS_FILL_LOCK_EXPIRE_TIME = 10
+REDIS_FILL_WAIT_TIME = 0.5
+REDIS_FILL_POLL_INTERVAL = 0.02
+# write-behind counters are flushed into database every N seconds
+REDIS_COUNT_FLUSH_INTERVAL = 10
 
 # Celery configuration options
 CELERY_BROKER_URL = 'redis://127.0.0.1:6379/2' if not TESTING else 'redis://127.0.0.1:6379/0'
@@ -195,6 +220,25 @@ CELERY_QUEUES = (
     Queue('default', routing_key='default'),
     Queue('newsfeeds', routing_key='newsfeeds'),
 )
+CELERY_BEAT_SCHEDULE = {
+    'flush-count-deltas': {
+        'task': 'tweets.tasks.flush_count_deltas_task',
+        'schedule': REDIS_COUNT_FLUSH_INTERVAL,
+    },
+}
+
+# Newsfeeds
+# when switch_newsfeeds_to_hybrid_fanout is on, the tweets of users who have
+# at least this many followers are not fanned out, the followers pull them
+# into their newsfeeds at read time
+HYBRID_FANOUT_FOLLOWER_THRESHOLD = 10000 if not TESTING else 3
+# users who have not been active for this many seconds are dormant, when
+# switch_newsfeeds_to_activity_aware_fanout is on, nothing is fanned out to
+# them, their newsfeeds are rebuilt when they come back
+DORMANT_USER_THRESHOLD = 14 * 24 * 60 * 60
+# the last active time of a user is written at most once per this many
+# seconds, never less often than DORMANT_USER_THRESHOLD
+LAST_ACTIVE_UPDATE_INTERVAL = 5 * 60
 
 # Rate Limiter
 RATELIMIT_USE_CACHE = 'ratelimit'
@@ -0,0 +1,62 @@
+from asgiref.local import Local
+
+
+class IdentityMap:
+    """
+    Keeps the objects hydrated within one request, keyed by their cache keys,
+    so that an author, a profile or a tweet referred by many rows of a page
+    is loaded once per request, and all the rows share the same instance.
+    It is opened and closed by utils.middleware.IdentityMapMiddleware,
+    outside a request it is inactive and every call falls through.
+    """
+    _local = Local()
+
+    @classmethod
+    def begin(cls):
+        cls._local.objects = {}
+        cls._local.dedupes = 0
+
+    @classmethod
+    def end(cls):
+        # returns how many loads have been saved in this request
+        dedupes = cls.get_dedupes()
+        cls._local.objects = None
+        cls._local.dedupes = 0
+        return dedupes
+
+    @classmethod
+    def _get_objects(cls):
+        return getattr(cls._local, 'objects', None)
+
+    @classmethod
+    def get_dedupes(cls):
+        return getattr(cls._local, 'dedupes', 0)
+
+    @classmethod
+    def get(cls, key):
+        return cls.get_many([key]).get(key)
+
+    @classmethod
+    def get_many(cls, keys):
+        objects = cls._get_objects()
+        if not objects:
+            return {}
+        found = {key: objects[key] for key in keys if key in objects}
+        cls._local.dedupes += len(found)
+        return found
+
+    @classmethod
+    def set(cls, key, obj):
+        cls.set_many({key: obj})
+
+    @classmethod
+    def set_many(cls, key_to_obj):
+        objects = cls._get_objects()
+        if objects is not None:
+            objects.update(key_to_obj)
+
+    @classmethod
+    def delete(cls, key):
+        objects = cls._get_objects()
+        if objects is not None:
+            objects.pop(key, None)
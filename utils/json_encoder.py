@@ -5,6 +5,7 @@ from django.utils.timezone import is_aware
 
 import datetime
 import decimal
+import json
 import uuid
 
 
@@ -37,4 +38,38 @@ class JSONEncoder(DjangoJSONEncoder):
         elif isinstance(o, (decimal.Decimal, uuid.UUID, Promise)):
             return str(o)
         else:
-            return super().default(o)
\ No newline at end of file
+            return super().default(o)
+
+
+# orjson is optional, dumps() falls back to the stdlib json module without it
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson formats datetimes on its own, they are passed through to
+# JSONEncoder.default() so that both ways produce the same text
+ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS if orjson else 0
+
+_encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def dumps(obj):
+    """
+    Encodes obj into compact utf-8 JSON bytes, the same bytes as
+    JSONEncoder would produce, through orjson when it is installed.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=_encoder.default, option=ORJSON_OPTIONS)
+        except TypeError:
+            # e.g. integers beyond 64 bits, leave them to the stdlib json,
+            # which raises the same error as before for unsupported types
+            pass
+    return _encoder.encode(obj).encode('utf-8')
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,85 @@
+from utils.redis_client import RedisClient
+from utils.redis_serializers import CompactModelSerializer, SchemaMismatchError
+
+
+class StaleCachedListError(Exception):
+    pass
+
+
+class LazyCachedList:
+    """
+    A read-only list-like view of a cached redis list.
+    Entries are fetched by LRANGE in chunks only when they are accessed,
+    and deserialized one by one on demand, so that paginating over it
+    (which binary searches on created_at) only materializes the probed
+    entries and the entries of the requested page.
+    The indexes are only valid as long as the list is not pushed, trimmed
+    or expired meanwhile, StaleCachedListError is raised once it is found
+    changed or an entry is in an older schema, the caller should read the
+    page from database instead.
+    """
+
+    def __init__(self, key, model_class, length, first_chunk, chunk_size):
+        self.key = key
+        self.model_class = model_class
+        self.length = length
+        self.chunk_size = chunk_size
+        self._serialized = dict(enumerate(first_chunk))
+        self._objects = {}
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for index in range(self.length):
+            yield self[index]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            indexes = range(start, stop, step)
+            if indexes:
+                self._load(min(indexes), max(indexes) + 1)
+            return [self._materialize(i) for i in indexes]
+
+        if index < 0:
+            index += self.length
+        if index < 0 or index >= self.length:
+            raise IndexError('LazyCachedList index out of range')
+        if index not in self._serialized:
+            chunk_start = index - index % self.chunk_size
+            self._load(chunk_start, min(chunk_start + self.chunk_size, self.length))
+        return self._materialize(index)
+
+    @property
+    def materialized_count(self):
+        return len(self._objects)
+
+    def _load(self, start, stop):
+        # only fetch the missing range, [start, stop)
+        missing = [i for i in range(start, stop) if i not in self._serialized]
+        if not missing:
+            return
+        conn = RedisClient.get_connection()
+        pipe = conn.pipeline()
+        pipe.llen(self.key)
+        pipe.lindex(self.key, 0)
+        pipe.lrange(self.key, missing[0], missing[-1])
+        length, head, serialized_list = pipe.execute()
+        # a push shifts the indexes even when LTRIM keeps the length,
+        # so the head is compared as well
+        if length != self.length or head != self._serialized.get(0) \
+                or len(serialized_list) != missing[-1] - missing[0] + 1:
+            raise StaleCachedListError(self.key)
+        for offset, serialized_data in enumerate(serialized_list):
+            self._serialized.setdefault(missing[0] + offset, serialized_data)
+
+    def _materialize(self, index):
+        obj = self._objects.get(index)
+        if obj is None:
+            try:
+                obj = CompactModelSerializer.deserialize(self.model_class, self._serialized[index])
+            except SchemaMismatchError:
+                raise StaleCachedListError(self.key)
+            self._objects[index] = obj
+        return obj
@@ -0,0 +1,81 @@
+from django.db import models
+from rest_framework import serializers
+from utils.memcached_helper import MemcachedHelper
+
+
+class PrefetchListSerializer(serializers.ListSerializer):
+    """
+    When a serializer is used with many=True, DRF wraps it with a ListSerializer
+    which renders the rows one by one. This ListSerializer gives the child
+    serializer a chance to load whatever a whole page needs in bulk
+    (by defining prefetch_page(instances)) before any row is rendered.
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        instances = list(iterable)
+        if hasattr(self.child, 'prefetch_page'):
+            self.child.prefetch_page(instances)
+        return [self.child.to_representation(item) for item in instances]
+
+
+def prime_cached_objects(instances, model_class, id_attr, cached_attr):
+    # load the related objects of a page through memcached in one batch,
+    # and hang each of them on its instance, so that the cached_xxx properties
+    # would not go to memcached row by row
+    object_ids = [getattr(instance, id_attr) for instance in instances]
+    objects = MemcachedHelper.get_objects_through_cache(model_class, object_ids)
+    id_to_object = {obj.id: obj for obj in objects}
+    for instance in instances:
+        object_id = getattr(instance, id_attr)
+        if object_id in id_to_object:
+            setattr(instance, cached_attr, id_to_object[object_id])
+    return objects
+
+
+def load_fragments(instances, id_attr, get_fragments, set_fragments, render_fragments):
+    # the fragment cache of a page, shared by the serializers and the plain
+    # function renderers. The cached fragments are read in one batch, the
+    # missed ones are rendered together by render_fragments(instances),
+    # which returns {id: fragment}, and cached in one batch.
+    # Returns {id: fragment} of all the instances
+    fragments = get_fragments({getattr(instance, id_attr) for instance in instances})
+    missed_instances = [
+        instance
+        for instance in instances
+        if getattr(instance, id_attr) not in fragments
+    ]
+    if not missed_instances:
+        return fragments
+    new_fragments = render_fragments(missed_instances)
+    set_fragments(new_fragments)
+    fragments.update(new_fragments)
+    return fragments
+
+
+class FragmentField(serializers.Field):
+    """
+    A read only field rendered once into the cached fragment of the instance,
+    the parent serializer looks the fragment up by get_fragment(instance),
+    which returns {field_name: data}. The other fields of the parent are
+    rendered by DRF as usual.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        return self.parent.get_fragment(instance)[self.field_name]
+
+
+# the plain function renderers of the hot read paths render datetimes
+# with a standalone field, exactly as the serializers do
+datetime_field = serializers.DateTimeField()
+
+
+def render_datetime(value):
+    if value is None:
+        return None
+    return datetime_field.to_representation(value)
@@ -0,0 +1,147 @@
+from collections import OrderedDict
+from django.conf import settings
+from twitter.cache import LOCAL_CACHE_INVALIDATION_CHANNEL
+from utils.redis_client import RedisClient
+
+import os
+import pickle
+import threading
+import time
+
+
+class LocalCache:
+    """
+    A bounded LRU with a TTL living in the memory of each process, it sits in
+    front of memcached for the objects read on nearly every serialized row.
+    Objects are kept pickled, so that an object returned to one request could
+    never be mutated by another one (e.g. by setting _cached_user_profile).
+    Invalidations are broadcast to all processes through redis pub/sub.
+    Disabled when LOCAL_CACHE_MAX_SIZE is 0.
+    """
+    _entries = OrderedDict()
+    _lock = threading.Lock()
+    _subscriber = None
+    # the threads are not copied by fork(), the pid tells whether
+    # the subscriber was started by this process
+    _subscriber_pid = None
+
+    hits = 0
+    misses = 0
+    evictions = 0
+
+    @classmethod
+    def is_enabled(cls):
+        return settings.LOCAL_CACHE_MAX_SIZE > 0
+
+    @classmethod
+    def get(cls, key):
+        return cls.get_many([key]).get(key)
+
+    @classmethod
+    def get_many(cls, keys):
+        if not cls.is_enabled():
+            return {}
+        cls._ensure_subscribed()
+
+        found = {}
+        now = time.monotonic()
+        with cls._lock:
+            for key in keys:
+                entry = cls._entries.get(key)
+                if entry is not None and entry[0] <= now:
+                    del cls._entries[key]
+                    entry = None
+                if entry is None:
+                    cls.misses += 1
+                    continue
+                cls._entries.move_to_end(key)
+                cls.hits += 1
+                found[key] = entry[1]
+        return {key: pickle.loads(data) for key, data in found.items()}
+
+    @classmethod
+    def set(cls, key, obj):
+        cls.set_many({key: obj})
+
+    @classmethod
+    def set_many(cls, key_to_obj):
+        if not cls.is_enabled() or not key_to_obj:
+            return
+        cls._ensure_subscribed()
+
+        expire_at = time.monotonic() + settings.LOCAL_CACHE_TIMEOUT
+        entries = [(key, pickle.dumps(obj)) for key, obj in key_to_obj.items()]
+        with cls._lock:
+            for key, data in entries:
+                cls._entries[key] = (expire_at, data)
+                cls._entries.move_to_end(key)
+            while len(cls._entries) > settings.LOCAL_CACHE_MAX_SIZE:
+                cls._entries.popitem(last=False)
+                cls.evictions += 1
+
+    @classmethod
+    def delete(cls, key):
+        with cls._lock:
+            cls._entries.pop(key, None)
+
+    @classmethod
+    def invalidate(cls, key):
+        # drop it in this process at once, and tell the other processes
+        cls.delete(key)
+        if cls.is_enabled():
+            conn = RedisClient.get_connection()
+            conn.publish(LOCAL_CACHE_INVALIDATION_CHANNEL, key)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._entries.clear()
+            cls.hits = 0
+            cls.misses = 0
+            cls.evictions = 0
+
+    @classmethod
+    def stats(cls):
+        return {
+            'size': len(cls._entries),
+            'hits': cls.hits,
+            'misses': cls.misses,
+            'evictions': cls.evictions,
+        }
+
+    @classmethod
+    def _ensure_subscribed(cls):
+        # subscribe lazily, so that each forked worker gets its own subscriber,
+        # SUBSCRIBE is sent before anything is cached, no invalidation is missed
+        pid = os.getpid()
+        with cls._lock:
+            if cls._subscriber is not None and cls._subscriber_pid == pid:
+                return
+            if cls._subscriber is not None:
+                # forked, the entries copied from the parent were not
+                # watched since then
+                cls._entries.clear()
+            conn = RedisClient.get_connection()
+            pubsub = conn.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(LOCAL_CACHE_INVALIDATION_CHANNEL)
+            cls._subscriber = threading.Thread(
+                target=cls._listen,
+                args=(pubsub,),
+                daemon=True,
+            )
+            cls._subscriber_pid = pid
+            cls._subscriber.start()
+
+    @classmethod
+    def _listen(cls, pubsub):
+        try:
+            for message in pubsub.listen():
+                cls.delete(message['data'].decode('utf-8'))
+        finally:
+            # invalidations might be missed from now on, drop everything,
+            # the next set() would subscribe again
+            with cls._lock:
+                if cls._subscriber is threading.current_thread():
+                    cls._entries.clear()
+                    cls._subscriber = None
+                    cls._subscriber_pid = None
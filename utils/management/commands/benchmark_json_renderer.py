@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand
+from rest_framework import renderers
+from utils.json_encoder import orjson
+from utils.list_serializers import render_datetime
+from utils.paginations import EndlessPagination
+from utils.renderers import JSONRenderer
+from utils.time_helpers import utc_now
+
+import timeit
+
+
+class Command(BaseCommand):
+    help = 'Compare the JSONRenderer of DRF with utils.renderers.JSONRenderer ' \
+           'on newsfeed pages shaped like the api responses, no database or redis needed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        created_at = render_datetime(utc_now())
+        user = {
+            'id': 1,
+            'username': 'pluto',
+            'nickname': 'pluto',
+            'avatar_url': None,
+        }
+        page = {
+            'has_next_page': True,
+            'results': [
+                {
+                    'id': i + 1,
+                    'created_at': created_at,
+                    'tweet': {
+                        'id': i + 1,
+                        'user': user,
+                        'created_at': created_at,
+                        'content': 'tweet content 喵 {}'.format(i) * 4,
+                        'comments_count': i,
+                        'likes_count': i,
+                        'has_liked': False,
+                        'photo_urls': [],
+                    },
+                }
+                for i in range(EndlessPagination.page_size)
+            ],
+        }
+
+        drf_renderer = renderers.JSONRenderer()
+        fast_renderer = JSONRenderer()
+        if drf_renderer.render(page) != fast_renderer.render(page):
+            self.stderr.write('The outputs of the two renderers are different.')
+            return
+
+        pages = options['pages']
+        drf_time = min(timeit.repeat(
+            lambda: drf_renderer.render(page),
+            number=pages,
+            repeat=options['repeat'],
+        ))
+        fast_time = min(timeit.repeat(
+            lambda: fast_renderer.render(page),
+            number=pages,
+            repeat=options['repeat'],
+        ))
+        self.stdout.write('{} pages of {} newsfeeds, {} bytes each, orjson {}'.format(
+            pages,
+            EndlessPagination.page_size,
+            len(drf_renderer.render(page)),
+            'installed' if orjson is not None else 'not installed',
+        ))
+        self.stdout.write('drf: {:.0f} pages/s, utils: {:.0f} pages/s ({:.1f}x)'.format(
+            pages / drf_time,
+            pages / fast_time,
+            drf_time / fast_time,
+        ))
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+from newsfeeds.models import NewsFeed
+from tweets.models import Tweet
+from utils.redis_serializers import CompactModelSerializer, DjangoModelSerializer
+from utils.time_helpers import utc_now
+
+import timeit
+
+
+class Command(BaseCommand):
+    help = 'Compare DjangoModelSerializer with CompactModelSerializer ' \
+           'on a REDIS_LIST_LENGTH_LIMIT sized list, no database or redis needed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        size = options['size']
+        now = utc_now()
+        samples = {
+            Tweet: [
+                Tweet(
+                    id=i + 1,
+                    user_id=i % 50 + 1,
+                    content='tweet content {}'.format(i) * 4,
+                    created_at=now,
+                    likes_count=i,
+                    comments_count=i,
+                )
+                for i in range(size)
+            ],
+            NewsFeed: [
+                NewsFeed(id=i + 1, user_id=1, tweet_id=i + 1, created_at=now)
+                for i in range(size)
+            ],
+        }
+
+        for model_class, objects in samples.items():
+            json_list = [DjangoModelSerializer.serialize(obj) for obj in objects]
+            compact_list = [CompactModelSerializer.serialize(obj) for obj in objects]
+            self._report(model_class, 'serialize', options['repeat'], (
+                lambda: [DjangoModelSerializer.serialize(obj) for obj in objects],
+                lambda: [CompactModelSerializer.serialize(obj) for obj in objects],
+            ))
+            self._report(model_class, 'deserialize', options['repeat'], (
+                lambda: [DjangoModelSerializer.deserialize(data) for data in json_list],
+                lambda: [
+                    CompactModelSerializer.deserialize(model_class, data)
+                    for data in compact_list
+                ],
+            ))
+            self.stdout.write('{} payload bytes: json {} compact {}'.format(
+                model_class.__name__,
+                sum(len(data) for data in json_list),
+                sum(len(data) for data in compact_list),
+            ))
+
+    def _report(self, model_class, action, repeat, funcs):
+        json_time = min(timeit.repeat(funcs[0], number=1, repeat=repeat))
+        compact_time = min(timeit.repeat(funcs[1], number=1, repeat=repeat))
+        self.stdout.write('{} {}: json {:.2f}ms compact {:.2f}ms ({:.1f}x)'.format(
+            model_class.__name__,
+            action,
+            json_time * 1000,
+            compact_time * 1000,
+            json_time / compact_time,
+        ))
@@ -1,5 +1,7 @@
 from django.conf import settings
 from django.core.cache import caches
+from utils.identity_map import IdentityMap
+from utils.local_cache import LocalCache
 
 cache = caches['testing'] if settings.TESTING else caches['default']
 
@@ -14,16 +16,83 @@ class MemcachedHelper:
     def get_object_through_cache(cls, model_class, object_id):
         key = cls.get_key(model_class, object_id)
 
+        obj = IdentityMap.get(key)
+        if obj is not None:
+            return obj
+
+        obj = LocalCache.get(key)
+        if obj is not None:
+            IdentityMap.set(key, obj)
+            return obj
+
         obj = cache.get(key)
         if obj is not None:
+            LocalCache.set(key, obj)
+            IdentityMap.set(key, obj)
             return obj
 
         obj = model_class.objects.get(id=object_id)
         cache.set(key, obj)
+        LocalCache.set(key, obj)
+        IdentityMap.set(key, obj)
 
         return obj
 
+    @classmethod
+    def get_objects_through_cache(cls, model_class, object_ids):
+        # one get_many round trip for the whole batch, then all the missed
+        # objects are loaded by a single id__in query and written back
+        # by one set_many, instead of one get (+ one query) per object
+        unique_ids = list(dict.fromkeys(object_ids))
+        key_to_id = {cls.get_key(model_class, object_id): object_id for object_id in unique_ids}
+        # the objects already hydrated in this request are not loaded again
+        mapped_objects = IdentityMap.get_many(key_to_id.keys())
+        locally_cached_objects = LocalCache.get_many([
+            key
+            for key in key_to_id
+            if key not in mapped_objects
+        ])
+        cached_objects = cache.get_many([
+            key
+            for key in key_to_id
+            if key not in mapped_objects and key not in locally_cached_objects
+        ])
+        LocalCache.set_many(cached_objects)
+        cached_objects.update(locally_cached_objects)
+        IdentityMap.set_many(cached_objects)
+        cached_objects.update(mapped_objects)
+
+        id_to_object = {
+            key_to_id[key]: obj
+            for key, obj in cached_objects.items()
+        }
+        missed_ids = [
+            object_id
+            for object_id in unique_ids
+            if object_id not in id_to_object
+        ]
+        if missed_ids:
+            missed_objects = list(model_class.objects.filter(id__in=missed_ids))
+            key_to_missed_object = {
+                cls.get_key(model_class, obj.id): obj
+                for obj in missed_objects
+            }
+            cache.set_many(key_to_missed_object)
+            LocalCache.set_many(key_to_missed_object)
+            IdentityMap.set_many(key_to_missed_object)
+            for obj in missed_objects:
+                id_to_object[obj.id] = obj
+
+        # keep the input order, ids that do not exist in database are skipped
+        return [
+            id_to_object[object_id]
+            for object_id in object_ids
+            if object_id in id_to_object
+        ]
+
     @classmethod
     def invalidate_cached_object(cls, model_class, object_id):
         key = cls.get_key(model_class, object_id)
-        cache.delete(key)
\ No newline at end of file
+        cache.delete(key)
+        LocalCache.invalidate(key)
+        IdentityMap.delete(key)
@@ -0,0 +1,28 @@
+from django.conf import settings
+from utils.identity_map import IdentityMap
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class IdentityMapMiddleware:
+    """
+    Opens a fresh IdentityMap for each request, and reports how many
+    object loads it has deduplicated.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        IdentityMap.begin()
+        try:
+            response = self.get_response(request)
+        finally:
+            dedupes = IdentityMap.end()
+
+        logger.debug('%s %s: %d object loads deduplicated', request.method, request.path, dedupes)
+        if settings.DEBUG:
+            response['X-Identity-Map-Dedupes'] = str(dedupes)
+        return response
@@ -2,6 +2,12 @@ from rest_framework.pagination import BasePagination
 from rest_framework.response import Response
 from dateutil import parser
 from django.conf import settings
+from utils.lazy_cached_list import StaleCachedListError
+from utils.memcached_helper import MemcachedHelper
+from utils.redis_helper import RedisHelper
+
+import heapq
+import itertools
 
 
 class EndlessPagination(BasePagination):
@@ -15,29 +21,109 @@ class EndlessPagination(BasePagination):
         pass
 
     def paginate_ordered_list(self, reverse_ordered_list, request):
+        # reverse_ordered_list is in created_at descending order, the boundary
+        # is located by binary search, so that a lazy list only needs to
+        # materialize the probed objects and the objects of this page
         if 'created_at__gt' in request.query_params:
             created_at__gt = parser.isoparse(request.query_params['created_at__gt'])
-            objects = []
-            for obj in reverse_ordered_list:
-                if obj.created_at > created_at__gt:
-                    objects.append(obj)
-                else:
-                    break
+            index = self._bisect(
+                reverse_ordered_list,
+                lambda obj: obj.created_at <= created_at__gt,
+            )
             self.has_next_page = False
-            return objects
+            return reverse_ordered_list[:index]
 
         index = 0
         if 'created_at__lt' in request.query_params:
             created_at__lt = parser.isoparse(request.query_params['created_at__lt'])
-            for index, obj in enumerate(reverse_ordered_list):
-                if obj.created_at < created_at__lt:
-                    break
-            else:
-                reverse_ordered_list = []
+            index = self._bisect(
+                reverse_ordered_list,
+                lambda obj: obj.created_at < created_at__lt,
+            )
 
         self.has_next_page = len(reverse_ordered_list) > index + self.page_size
         return reverse_ordered_list[index: index + self.page_size]
 
+    def _bisect(self, reverse_ordered_list, reached):
+        # returns the index of the first object which reached the condition,
+        # len(reverse_ordered_list) if none did
+        low, high = 0, len(reverse_ordered_list)
+        while low < high:
+            middle = (low + high) // 2
+            if reached(reverse_ordered_list[middle]):
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def paginate_merged_lists(self, sources, request):
+        # k-way merge of the sources, each one is a (cached_list, queryset) as
+        # passed to paginate_cached_list() and paginate_queryset(), only the
+        # objects which go into the page (and one more per source) are read.
+        # A source without cached_list is read from database only, and so
+        # is a cached list which is found changed while being merged
+        while True:
+            try:
+                return self._merge_sources(sources, request)
+            except StaleCachedListError as error:
+                stale_key = error.args[0]
+                sources = [
+                    (None, queryset)
+                    if cached_list is not None and cached_list.key == stale_key
+                    else (cached_list, queryset)
+                    for cached_list, queryset in sources
+                ]
+
+    def _merge_sources(self, sources, request):
+        if 'created_at__gt' in request.query_params:
+            created_at__gt = parser.isoparse(request.query_params['created_at__gt'])
+            newer_lists = [
+                cached_list[:self._bisect(cached_list, lambda obj: obj.created_at <= created_at__gt)]
+                if cached_list is not None
+                else queryset.filter(created_at__gt=created_at__gt).order_by('-created_at')
+                for cached_list, queryset in sources
+            ]
+            self.has_next_page = False
+            return list(heapq.merge(*newer_lists, key=lambda obj: obj.created_at, reverse=True))
+
+        created_at__lt = None
+        if 'created_at__lt' in request.query_params:
+            created_at__lt = parser.isoparse(request.query_params['created_at__lt'])
+        streams = [
+            self._iter_ordered_source(cached_list, queryset, created_at__lt)
+            for cached_list, queryset in sources
+        ]
+        merged = heapq.merge(*streams, key=lambda obj: obj.created_at, reverse=True)
+        objects = list(itertools.islice(merged, self.page_size + 1))
+        self.has_next_page = len(objects) > self.page_size
+        return objects[:self.page_size]
+
+    def _iter_ordered_source(self, cached_list, queryset, created_at__lt):
+        # yields at most page_size + 1 objects older than created_at__lt,
+        # the ones beyond a truncated cached list are read from database
+        if cached_list is None:
+            if created_at__lt is not None:
+                queryset = queryset.filter(created_at__lt=created_at__lt)
+            yield from queryset.order_by('-created_at')[:self.page_size + 1]
+            return
+
+        index = 0
+        if created_at__lt is not None:
+            index = self._bisect(cached_list, lambda obj: obj.created_at < created_at__lt)
+        count = self.page_size + 1
+        stop = min(index + count, len(cached_list))
+        for i in range(index, stop):
+            yield cached_list[i]
+
+        count -= stop - index
+        if count <= 0 or len(cached_list) < settings.REDIS_LIST_LENGTH_LIMIT:
+            return
+        if stop > index:
+            created_at__lt = cached_list[stop - 1].created_at
+        if created_at__lt is not None:
+            queryset = queryset.filter(created_at__lt=created_at__lt)
+        yield from queryset.order_by('-created_at')[:count]
+
     def paginate_queryset(self, queryset, request, view=None):
         if 'created_at__gt' in request.query_params:
             # created_at__gt is for loading the newest information/data
@@ -59,7 +145,11 @@ class EndlessPagination(BasePagination):
         return queryset[:self.page_size]
 
     def paginate_cached_list(self, cached_list, request):
-        paginated_list = self.paginate_ordered_list(cached_list, request)
+        try:
+            paginated_list = self.paginate_ordered_list(cached_list, request)
+        except StaleCachedListError:
+            # the list was changed while being paginated over
+            return None
 
         # if in pull-to-refresh mode, then all the newest data are in paginated_list,
         # return paginated_list directly
@@ -74,6 +164,43 @@ class EndlessPagination(BasePagination):
         # if not all above cases, need go to database to query
         return None
 
+    def paginate_cached_timeline(self, timeline_key, queryset, request):
+        # the timeline only holds ids, a page is located by score range
+        # and hydrated through memcached, so the cost of reading a page
+        # does not depend on how deep the page is
+        model_class = queryset.model
+        if 'created_at__gt' in request.query_params:
+            created_at__gt = parser.isoparse(request.query_params['created_at__gt'])
+            loaded = RedisHelper.load_ids_from_timeline(
+                timeline_key,
+                queryset,
+                created_at__gt=created_at__gt,
+            )
+            # the timeline is being filled by another request
+            if loaded is None:
+                return None
+            ids, _ = loaded
+            self.has_next_page = False
+            return MemcachedHelper.get_objects_through_cache(model_class, ids)
+
+        created_at__lt = None
+        if 'created_at__lt' in request.query_params:
+            created_at__lt = parser.isoparse(request.query_params['created_at__lt'])
+        loaded = RedisHelper.load_ids_from_timeline(
+            timeline_key,
+            queryset,
+            created_at__lt=created_at__lt,
+            count=self.page_size + 1,
+        )
+        if loaded is None:
+            return None
+        ids, timeline_size = loaded
+        self.has_next_page = len(ids) > self.page_size
+        # the timeline has been truncated, the remaining data are in database
+        if not self.has_next_page and timeline_size >= settings.REDIS_LIST_LENGTH_LIMIT:
+            return None
+        return MemcachedHelper.get_objects_through_cache(model_class, ids[:self.page_size])
+
     def get_paginated_response(self, data):
         return Response({
             'has_next_page': self.has_next_page,
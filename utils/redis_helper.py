@@ -1,6 +1,93 @@
+from django.apps import apps
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+from datetime import timedelta
+from twitter.cache import (
+    CACHE_FILL_LOCK_PATTERN,
+    COUNT_DELTAS_KEY,
+    FLUSH_ID_PATTERN,
+    FLUSHING_COUNT_DELTAS_KEY,
+)
+from utils.lazy_cached_list import LazyCachedList
 from utils.redis_client import RedisClient
-from utils.redis_serializers import DjangoModelSerializer
+from utils.redis_serializers import CompactModelSerializer, SchemaMismatchError
+from utils.time_constants import ONE_DAY, ONE_HOUR
+from utils.time_helpers import datetime_to_microseconds
+
+import time
+import uuid
+
+# only the filler who holds the lock can release it
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# only push to a timeline which has already been cached,
+# and keep the latest REDIS_LIST_LENGTH_LIMIT members
+PUSH_TO_TIMELINE_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then
+    redis.call('zadd', KEYS[1], ARGV[1], ARGV[2])
+    redis.call('zremrangebyrank', KEYS[1], 0, -(tonumber(ARGV[3]) + 1))
+    return 1
+end
+return 0
+"""
+
+# buffer the delta to be flushed into database later, and apply it on
+# the cached count if there is one, returns nil if the count is not cached
+BUFFER_COUNT_DELTA_SCRIPT = """
+redis.call('hincrby', KEYS[2], ARGV[1], ARGV[2])
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call('incrby', KEYS[1], ARGV[2])
+end
+return false
+"""
+
+
+# locates the entry which starts with ARGV[1] among the first ARGV[3] entries,
+# LREM it if ARGV[2] is empty, otherwise LSET it to ARGV[2],
+# returns 0 if the entry is not found
+UPDATE_LIST_ENTRY_SCRIPT = """
+local entries = redis.call('lrange', KEYS[1], 0, tonumber(ARGV[3]) - 1)
+for index, entry in ipairs(entries) do
+    if string.sub(entry, 1, string.len(ARGV[1])) == ARGV[1] then
+        if ARGV[2] == '' then
+            redis.call('lrem', KEYS[1], 1, entry)
+        else
+            redis.call('lset', KEYS[1], index - 1, ARGV[2])
+        end
+        return 1
+    end
+end
+return 0
+"""
+
+
+# pushes ARGV[2] to a cached list and keeps the latest ARGV[3] entries,
+# unless the list is missing or one of its first ARGV[4] entries starts
+# with ARGV[1]
+PUSH_IF_ABSENT_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 0 then
+    return 0
+end
+for _, entry in ipairs(redis.call('lrange', KEYS[1], 0, tonumber(ARGV[4]) - 1)) do
+    if string.sub(entry, 1, string.len(ARGV[1])) == ARGV[1] then
+        return 0
+    end
+end
+redis.call('lpush', KEYS[1], ARGV[2])
+redis.call('ltrim', KEYS[1], 0, tonumber(ARGV[3]) - 1)
+return 1
+"""
+
+
+class FlushInProgressError(Exception):
+    pass
 
 
 class RedisHelper:
@@ -14,43 +101,350 @@ class RedisHelper:
         # cache REDIS_LIST_LENGTH_LIMIT data records at most,
         # exceeds this size, to require data from database directly
         for obj in objects:
-            serialized_data = DjangoModelSerializer.serialize(obj)
+            serialized_data = CompactModelSerializer.serialize(obj)
             serialized_list.append(serialized_data)
 
+        # DEL, RPUSH and EXPIRE go in one MULTI/EXEC round trip,
+        # the list is replaced as a whole instead of being appended to,
+        # and it would never be left in redis without expire time
+        pipe = conn.pipeline()
+        pipe.delete(key)
         if serialized_list:
-            conn.rpush(key, *serialized_list)
-            conn.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+            pipe.rpush(key, *serialized_list)
+            pipe.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+        pipe.execute()
+
+    @classmethod
+    def _deserialize_list(cls, model_class, serialized_list):
+        try:
+            return [
+                CompactModelSerializer.deserialize(model_class, serialized_data)
+                for serialized_data in serialized_list
+            ]
+        except SchemaMismatchError:
+            # cached by an older codec or model schema, need to be rebuilt
+            return None
+
+    @classmethod
+    def _fill_cache_exclusively(cls, key, queryset, upload=None, reload=None):
+        # single-flight: among all the requests which find the cache missing,
+        # only the one who gets the lock runs the queryset and fills the cache,
+        # returns None if the lock is held by another filler
+        if upload is None:
+            upload = cls._upload_objects_to_cache
+        conn = RedisClient.get_connection()
+        lock_key = CACHE_FILL_LOCK_PATTERN.format(key=key)
+        token = uuid.uuid4().hex
+        acquired = conn.set(
+            lock_key,
+            token,
+            nx=True,
+            ex=settings.REDIS_FILL_LOCK_EXPIRE_TIME,
+        )
+        if not acquired:
+            return None
+
+        try:
+            # the previous filler might have released the lock right after
+            # the caller found the cache missing, reload() tells if the cache
+            # has been filled meanwhile, so that it is not filled twice
+            objects = reload() if reload is not None else None
+            if objects is None:
+                objects = list(queryset)
+                upload(key, objects)
+        finally:
+            release_lock = conn.register_script(RELEASE_LOCK_SCRIPT)
+            release_lock(keys=[lock_key], args=[token])
+        return objects
+
+    @classmethod
+    def _wait_for_cache_filled(cls, key):
+        # poll the list until the filler finishes, give up when the filler
+        # released the lock without filling anything or waited too long
+        conn = RedisClient.get_connection()
+        lock_key = CACHE_FILL_LOCK_PATTERN.format(key=key)
+        deadline = time.monotonic() + settings.REDIS_FILL_WAIT_TIME
+        while time.monotonic() < deadline:
+            time.sleep(settings.REDIS_FILL_POLL_INTERVAL)
+            pipe = conn.pipeline(transaction=False)
+            pipe.lrange(key, 0, -1)
+            pipe.exists(lock_key)
+            serialized_list, is_filling = pipe.execute()
+            if serialized_list or not is_filling:
+                return serialized_list
+        return []
 
     @classmethod
     def download_objects_from_cache(cls, key, queryset):
         queryset = queryset[:settings.REDIS_LIST_LENGTH_LIMIT]
         conn = RedisClient.get_connection()
 
-        if conn.exists(key):
-            serialized_list = conn.lrange(key, 0, -1)
-            objects = []
-            for serialized_data in serialized_list:
-                deserialized_obj = DjangoModelSerializer.deserialize(serialized_data)
-                objects.append(deserialized_obj)
+        # redis never keeps an empty list, so an empty LRANGE result means
+        # the key does not exist, there is no need to check EXISTS beforehand,
+        # which also avoids the key expiring between EXISTS and LRANGE
+        serialized_list = conn.lrange(key, 0, -1)
+        if serialized_list:
+            objects = cls._deserialize_list(queryset.model, serialized_list)
+            if objects is not None:
+                return objects
+
+        return cls._fill_or_wait_for_cache(key, queryset)
+
+    @classmethod
+    def _fill_or_wait_for_cache(cls, key, queryset):
+        conn = RedisClient.get_connection()
+        objects = cls._fill_cache_exclusively(
+            key,
+            queryset,
+            reload=lambda: cls._deserialize_list(queryset.model, conn.lrange(key, 0, -1)) or None,
+        )
+        if objects is not None:
             return objects
 
-        cls._upload_objects_to_cache(key, queryset)
+        # another request is filling the cache, wait for it briefly,
+        # or go to database directly without touching the cache
+        serialized_list = cls._wait_for_cache_filled(key)
+        if serialized_list:
+            objects = cls._deserialize_list(queryset.model, serialized_list)
+            if objects is not None:
+                return objects
 
         # To keep data structure consistence, turn queryset into list,
         # cause data in redis are on list type
         return list(queryset)
 
+    @classmethod
+    def load_lazy_cached_list(cls, key, queryset):
+        # instead of LRANGE and deserializing the whole list, only the length,
+        # the first chunk and the last entry are fetched in one round trip,
+        # the rest would be fetched by LazyCachedList on demand
+        queryset = queryset[:settings.REDIS_LIST_LENGTH_LIMIT]
+        conn = RedisClient.get_connection()
+
+        pipe = conn.pipeline()
+        pipe.llen(key)
+        pipe.lrange(key, 0, settings.REDIS_LIST_CHUNK_SIZE - 1)
+        pipe.lindex(key, -1)
+        length, first_chunk, last_entry = pipe.execute()
+        cached_list = cls._build_lazy_cached_list(key, queryset.model, length, first_chunk, last_entry)
+        if cached_list is not None:
+            return cached_list
+        return cls._fill_or_wait_for_cache(key, queryset)
+
+    @classmethod
+    def load_lazy_cached_lists(cls, keys, model_class):
+        # the bulk load_lazy_cached_list(), the lists are probed by batches
+        # of REDIS_PIPELINE_BATCH_SIZE keys in one round trip each. Only the
+        # cached ones are returned as {key: LazyCachedList}, the missing ones
+        # are left to the caller, which could read them together from database
+        conn = RedisClient.get_connection()
+        keys = list(keys)
+        cached_lists = {}
+        for start in range(0, len(keys), settings.REDIS_PIPELINE_BATCH_SIZE):
+            batch_keys = keys[start: start + settings.REDIS_PIPELINE_BATCH_SIZE]
+            pipe = conn.pipeline()
+            for key in batch_keys:
+                pipe.llen(key)
+                pipe.lrange(key, 0, settings.REDIS_LIST_CHUNK_SIZE - 1)
+                pipe.lindex(key, -1)
+            results = pipe.execute()
+            for index, key in enumerate(batch_keys):
+                length, first_chunk, last_entry = results[index * 3: index * 3 + 3]
+                cached_list = cls._build_lazy_cached_list(
+                    key,
+                    model_class,
+                    length,
+                    first_chunk,
+                    last_entry,
+                )
+                if cached_list is not None:
+                    cached_lists[key] = cached_list
+        return cached_lists
+
+    @classmethod
+    def _build_lazy_cached_list(cls, key, model_class, length, first_chunk, last_entry):
+        # new entries are pushed to the head, if both ends are in the
+        # current schema, the whole list is. Returns None if the list is
+        # missing or in an older schema
+        if length and CompactModelSerializer.is_current_schema(model_class, first_chunk[0]) \
+                and CompactModelSerializer.is_current_schema(model_class, last_entry):
+            return LazyCachedList(
+                key,
+                model_class,
+                length,
+                first_chunk,
+                settings.REDIS_LIST_CHUNK_SIZE,
+            )
+        return None
+
     @classmethod
     def push_object(cls, key, obj, queryset):
+        conn = RedisClient.get_connection()
+        serialized_data = CompactModelSerializer.serialize(obj)
+
+        # LPUSHX only pushes when the list exists, together with LTRIM
+        # they are executed atomically in one round trip
+        pipe = conn.pipeline()
+        pipe.lpushx(key, serialized_data)
+        pipe.ltrim(key, 0, settings.REDIS_LIST_LENGTH_LIMIT - 1)
+        pushed_length, _ = pipe.execute()
+        if pushed_length:
+            return
+
         queryset = queryset[:settings.REDIS_LIST_LENGTH_LIMIT]
+        if cls._fill_cache_exclusively(key, queryset) is not None:
+            return
+
+        # another filler holds the lock, its queryset might have run before
+        # obj was saved. obj is pushed once the list is filled, unless the
+        # list has it already, at its head, behind the objects pushed since
+        cls._wait_for_cache_filled(key)
+        push_if_absent = conn.register_script(PUSH_IF_ABSENT_SCRIPT)
+        push_if_absent(
+            keys=[key],
+            args=[
+                CompactModelSerializer.get_pk_prefix(obj.__class__, obj.pk),
+                serialized_data,
+                settings.REDIS_LIST_LENGTH_LIMIT,
+                settings.REDIS_LIST_SCAN_WINDOW,
+            ],
+        )
+
+    @classmethod
+    def remove_object(cls, key, obj):
+        # only the entry of obj is removed, instead of dropping the whole list
+        cls._update_list_entry(key, obj, b'')
+
+    @classmethod
+    def replace_object(cls, key, obj):
+        # the entry of obj is overwritten in place, obj should keep its
+        # created_at, so that the order of the list is kept
+        cls._update_list_entry(key, obj, CompactModelSerializer.serialize(obj))
+
+    @classmethod
+    def _update_list_entry(cls, key, obj, serialized_data):
+        # the entry is located by the primary key in the same script, so that
+        # a concurrent push cannot shift it. Only the head of the list is
+        # scanned, where most of the edited and deleted objects are, to bound
+        # the time the script blocks redis. The list is dropped, to be rebuilt
+        # by its next read, if the entry cannot be located, e.g. it is further
+        # down, cached in an older schema, or the list is missing
         conn = RedisClient.get_connection()
-        if not conn.exists(key):
-            cls._upload_objects_to_cache(key, queryset)
+        update_list_entry = conn.register_script(UPDATE_LIST_ENTRY_SCRIPT)
+        prefix = CompactModelSerializer.get_pk_prefix(obj.__class__, obj.pk)
+        args = [prefix, serialized_data, settings.REDIS_LIST_SCAN_WINDOW]
+        if not update_list_entry(keys=[key], args=args):
+            conn.delete(key)
+
+    @classmethod
+    def push_objects(cls, key_to_obj):
+        # the bulk push_object() for fanout, all the LPUSHX and LTRIM go in
+        # one pipeline. The lists which are not cached are skipped rather than
+        # filled, they would be rebuilt from database by their next read
+        if not key_to_obj:
             return
+        conn = RedisClient.get_connection()
+        pipe = conn.pipeline(transaction=False)
+        for key, obj in key_to_obj.items():
+            pipe.lpushx(key, CompactModelSerializer.serialize(obj))
+            pipe.ltrim(key, 0, settings.REDIS_LIST_LENGTH_LIMIT - 1)
+        pipe.execute()
 
-        serialized_data = DjangoModelSerializer.serialize(obj)
-        conn.lpush(key, serialized_data)
-        conn.ltrim(key, 0, settings.REDIS_LIST_LENGTH_LIMIT - 1)
+    @classmethod
+    def _upload_objects_to_timeline(cls, key, objects):
+        conn = RedisClient.get_connection()
+        # a timeline only keeps ids, scored by created_at in microseconds
+        mapping = {
+            obj.id: datetime_to_microseconds(obj.created_at)
+            for obj in objects
+        }
+        pipe = conn.pipeline()
+        pipe.delete(key)
+        if mapping:
+            pipe.zadd(key, mapping)
+            pipe.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+        pipe.execute()
+
+    @classmethod
+    def load_ids_from_timeline(
+        cls,
+        key,
+        queryset,
+        created_at__lt=None,
+        created_at__gt=None,
+        count=None,
+    ):
+        # returns the ids in created_at descending order within the range,
+        # together with the size of the cached timeline, or None if another
+        # request is filling the timeline, the caller reads from database
+        queryset = queryset[:settings.REDIS_LIST_LENGTH_LIMIT]
+        conn = RedisClient.get_connection()
+
+        max_score = '+inf'
+        if created_at__lt is not None:
+            max_score = '({}'.format(datetime_to_microseconds(created_at__lt))
+        min_score = '-inf'
+        if created_at__gt is not None:
+            min_score = '({}'.format(datetime_to_microseconds(created_at__gt))
+
+        pipe = conn.pipeline(transaction=False)
+        if count is None:
+            pipe.zrevrangebyscore(key, max_score, min_score)
+        else:
+            pipe.zrevrangebyscore(key, max_score, min_score, start=0, num=count)
+        pipe.zcard(key)
+        ids, timeline_size = pipe.execute()
+        if timeline_size:
+            return [int(object_id) for object_id in ids], timeline_size
+
+        objects = cls._fill_cache_exclusively(key, queryset, cls._upload_objects_to_timeline)
+        if objects is None:
+            return None
+        ids = [
+            obj.id
+            for obj in objects
+            if (created_at__lt is None or obj.created_at < created_at__lt)
+            and (created_at__gt is None or obj.created_at > created_at__gt)
+        ]
+        if count is not None:
+            ids = ids[:count]
+        return ids, len(objects)
+
+    @classmethod
+    def push_object_to_timeline(cls, key, obj):
+        # a missing timeline is not built here, it would be built lazily
+        # by the next read, which includes this object as well
+        conn = RedisClient.get_connection()
+        push = conn.register_script(PUSH_TO_TIMELINE_SCRIPT)
+        push(
+            keys=[key],
+            args=[
+                datetime_to_microseconds(obj.created_at),
+                obj.id,
+                settings.REDIS_LIST_LENGTH_LIMIT,
+            ],
+        )
+
+    @classmethod
+    def push_objects_to_timelines(cls, key_to_obj):
+        # the bulk push_object_to_timeline(), one script call per timeline,
+        # all in one pipeline
+        if not key_to_obj:
+            return
+        conn = RedisClient.get_connection()
+        push = conn.register_script(PUSH_TO_TIMELINE_SCRIPT)
+        pipe = conn.pipeline(transaction=False)
+        for key, obj in key_to_obj.items():
+            push(
+                keys=[key],
+                args=[
+                    datetime_to_microseconds(obj.created_at),
+                    obj.id,
+                    settings.REDIS_LIST_LENGTH_LIMIT,
+                ],
+                client=pipe,
+            )
+        pipe.execute()
 
     @classmethod
     def get_count_key(cls, obj, attr):
@@ -87,7 +481,206 @@ class RedisHelper:
         count = conn.get(key)
         if count is not None:
             return int(count)
-        obj.refresh_from_db()
-        count = getattr(obj, attr)
-        conn.set(key, count)
+        count = cls._load_counts([(obj, attr)]).get((obj.id, attr), 0)
+        conn.set(key, count, ex=settings.REDIS_KEY_EXPIRE_TIME)
+        return count
+
+    @classmethod
+    def get_counts(cls, objs, attrs):
+        # counts of a whole page in one MGET, returns {(obj.id, attr): count},
+        # all the missed counts are loaded by one query and cached by one pipeline
+        if not objs:
+            return {}
+        conn = RedisClient.get_connection()
+        pairs = [(obj, attr) for obj in objs for attr in attrs]
+        values = conn.mget([cls.get_count_key(obj, attr) for obj, attr in pairs])
+
+        counts = {}
+        missed_pairs = []
+        for (obj, attr), value in zip(pairs, values):
+            if value is None:
+                missed_pairs.append((obj, attr))
+            else:
+                counts[(obj.id, attr)] = int(value)
+        if not missed_pairs:
+            return counts
+
+        loaded_counts = cls._load_counts(missed_pairs)
+        pipe = conn.pipeline(transaction=False)
+        for obj, attr in missed_pairs:
+            count = loaded_counts.get((obj.id, attr))
+            if count is None:
+                continue
+            counts[(obj.id, attr)] = count
+            pipe.set(cls.get_count_key(obj, attr), count, ex=settings.REDIS_KEY_EXPIRE_TIME)
+        pipe.execute()
+        return counts
+
+    @classmethod
+    def get_count_delta_field(cls, obj, attr):
+        return '{}:{}:{}'.format(obj._meta.label, attr, obj.id)
+
+    @classmethod
+    def _load_counts(cls, pairs):
+        # pairs are (obj, attr) of objects of one model, returns {(obj.id, attr):
+        # count} of the rows in database, with the deltas which are not in
+        # database yet counted in. The flush commits its updates before it
+        # drops the flushing hash, so the deltas being flushed are read first,
+        # and dropped if the rows read after them already have them applied
+        conn = RedisClient.get_connection()
+        fields = [cls.get_count_delta_field(obj, attr) for obj, attr in pairs]
+        pipe = conn.pipeline()
+        pipe.hmget(COUNT_DELTAS_KEY, fields)
+        pipe.hmget(FLUSHING_COUNT_DELTAS_KEY, fields)
+        pipe.get(FLUSH_ID_PATTERN.format(key=FLUSHING_COUNT_DELTAS_KEY))
+        buffered, flushing, flush_id = pipe.execute()
+
+        model_class = pairs[0][0].__class__
+        attrs = {attr for _, attr in pairs}
+        rows = model_class.objects.filter(
+            id__in={obj.id for obj, _ in pairs},
+        ).values('id', *attrs)
+        if flush_id is not None and any(flushing):
+            # the rows and the flush record are read in one transaction,
+            # from the same snapshot
+            with transaction.atomic():
+                id_to_row = {row['id']: row for row in rows}
+                count_delta_flush_class = cls._get_count_delta_flush_class()
+                if count_delta_flush_class.objects.filter(flush_id=flush_id.decode('utf-8')).exists():
+                    flushing = [None] * len(fields)
+        else:
+            id_to_row = {row['id']: row for row in rows}
+
+        counts = {}
+        for (obj, attr), buffered_delta, flushing_delta in zip(pairs, buffered, flushing):
+            row = id_to_row.get(obj.id)
+            if row is None:
+                continue
+            counts[(obj.id, attr)] = (row[attr] or 0) + int(buffered_delta or 0) + int(flushing_delta or 0)
+        return counts
+
+    @classmethod
+    def buffer_count_delta(cls, obj, attr, delta):
+        # write-behind: instead of UPDATE the row of obj for every like or
+        # comment, deltas are accumulated in a redis hash, and flushed into
+        # database in batches by flush_count_deltas_task
+        conn = RedisClient.get_connection()
+        key = cls.get_count_key(obj, attr)
+        buffer_count_delta = conn.register_script(BUFFER_COUNT_DELTA_SCRIPT)
+        count = buffer_count_delta(
+            keys=[key, COUNT_DELTAS_KEY],
+            args=[cls.get_count_delta_field(obj, attr), delta],
+        )
+        if count is not None:
+            return count
+
+        count = cls._load_counts([(obj, attr)]).get((obj.id, attr), 0)
+        # do not overwrite the count cached by a concurrent request
+        conn.set(key, count, ex=settings.REDIS_KEY_EXPIRE_TIME, nx=True)
         return count
+
+    @classmethod
+    def flush_count_deltas(cls):
+        # the lock lasts as long as flush_count_deltas_task could run
+        try:
+            rows = cls.flush_hash(
+                COUNT_DELTAS_KEY,
+                FLUSHING_COUNT_DELTAS_KEY,
+                cls._apply_count_deltas,
+                lock_expire_time=ONE_HOUR,
+            )
+        except FlushInProgressError:
+            return 0
+        return rows or 0
+
+    @classmethod
+    def flush_hash(cls, key, flushing_key, apply, lock_expire_time=None):
+        # drains the hash buffered at key by apply(fields, flush_id), one flush
+        # at a time, returns what apply() returns, None if there is nothing to
+        # flush, raises FlushInProgressError if another flush holds the lock.
+        # The lock should outlive the flush, or a second flusher could
+        # apply the same fields again
+        if lock_expire_time is None:
+            lock_expire_time = settings.REDIS_FILL_LOCK_EXPIRE_TIME
+        conn = RedisClient.get_connection()
+        lock_key = CACHE_FILL_LOCK_PATTERN.format(key=flushing_key)
+        flush_id_key = FLUSH_ID_PATTERN.format(key=flushing_key)
+        token = uuid.uuid4().hex
+        acquired = conn.set(
+            lock_key,
+            token,
+            nx=True,
+            ex=lock_expire_time,
+        )
+        if not acquired:
+            raise FlushInProgressError(flushing_key)
+
+        try:
+            # a flushing hash left by a failed flush is retried first,
+            # otherwise the buffer is renamed, so that new fields go to
+            # a new buffer while this one is being flushed
+            if not conn.exists(flushing_key):
+                if not conn.exists(key):
+                    return None
+                conn.rename(key, flushing_key)
+            # the flush id stays the same over the retries of a failed flush,
+            # apply() could tell by it if the fields have been applied, in
+            # case the flush failed after it committed
+            conn.set(flush_id_key, uuid.uuid4().hex, nx=True)
+            pipe = conn.pipeline()
+            pipe.hgetall(flushing_key)
+            pipe.get(flush_id_key)
+            fields, flush_id = pipe.execute()
+            result = apply(fields, flush_id.decode('utf-8'))
+            conn.delete(flushing_key, flush_id_key)
+        finally:
+            release_lock = conn.register_script(RELEASE_LOCK_SCRIPT)
+            release_lock(keys=[lock_key], args=[token])
+        return result
+
+    @classmethod
+    def _get_count_delta_flush_class(cls):
+        # the applied flushes are recorded by the tweets app,
+        # which runs flush_count_deltas_task
+        return apps.get_model('tweets.CountDeltaFlush')
+
+    @classmethod
+    def _apply_count_deltas(cls, deltas, flush_id):
+        # group the deltas by model and attr, each group is one UPDATE:
+        # UPDATE ... SET attr = attr + CASE id WHEN ... END WHERE id IN (...)
+        groups = {}
+        for field, delta in deltas.items():
+            delta = int(delta)
+            if delta == 0:
+                continue
+            label, attr, object_id = field.decode('utf-8').split(':')
+            groups.setdefault((label, attr), {})[int(object_id)] = delta
+
+        if not groups:
+            return 0
+
+        count_delta_flush_class = cls._get_count_delta_flush_class()
+        rows = 0
+        with transaction.atomic():
+            # the flush is recorded in the same transaction as its updates,
+            # a flush which failed after it committed is not applied twice
+            _, created = count_delta_flush_class.objects.get_or_create(flush_id=flush_id)
+            if not created:
+                return 0
+            # the records are only needed as long as a failed flush could be retried
+            count_delta_flush_class.objects.filter(
+                created_at__lt=timezone.now() - timedelta(seconds=ONE_DAY),
+            ).delete()
+            for (label, attr), id_to_delta in groups.items():
+                model_class = apps.get_model(label)
+                rows += model_class.objects.filter(id__in=id_to_delta.keys()).update(**{
+                    attr: F(attr) + Case(
+                        *[
+                            When(id=object_id, then=Value(delta))
+                            for object_id, delta in id_to_delta.items()
+                        ],
+                        default=Value(0),
+                        output_field=IntegerField(),
+                    ),
+                })
+        return rows
@@ -1,5 +1,10 @@
 from django.core import serializers
-from utils.json_encoder import JSONEncoder
+from utils.json_encoder import dumps, loads
+from utils.time_helpers import EPOCH, ONE_MICROSECOND
+from datetime import date, datetime, timedelta
+
+import struct
+import zlib
 
 
 class DjangoModelSerializer:
@@ -9,11 +14,165 @@ class DjangoModelSerializer:
         # Django serializers can only be fed by data in structure of
         # QuerySet or List, that's why it needs put the instance in [],
         # in this way an instance turns into a list
-        return serializers.serialize('json', [instance], cls=JSONEncoder)
+        # the python serializer gives the same objects as the json one does,
+        # they are dumped by utils.json_encoder which is much faster
+        return dumps(serializers.serialize('python', [instance])).decode('utf-8')
 
     @classmethod
     def deserialize(cls, serialized_data):
         # notice that serializer.deserialize() can only return
         # DeserializedObject, to obtain the original model,
         # it needs a further step .object
-        return list(serializers.deserialize('json', serialized_data))[0].object
+        return list(serializers.deserialize('python', loads(serialized_data)))[0].object
+
+
+class SchemaMismatchError(Exception):
+    pass
+
+
+NAIVE_EPOCH = datetime(1970, 1, 1)
+
+# one type tag byte ahead of each field value
+TAG_NONE = 0
+TAG_TRUE = 1
+TAG_FALSE = 2
+TAG_INT = 3
+TAG_FLOAT = 4
+TAG_STR = 5
+TAG_DATETIME = 6
+TAG_NAIVE_DATETIME = 7
+TAG_DATE = 8
+
+HEADER = struct.Struct('>BI')
+INT64 = struct.Struct('>q')
+INT32 = struct.Struct('>i')
+UINT32 = struct.Struct('>I')
+FLOAT64 = struct.Struct('>d')
+
+
+class CompactModelSerializer:
+    """
+    Packs the concrete field values of an instance, in the order of
+    model._meta.concrete_fields, into a tagged binary tuple.
+    Every payload starts with a header made of a version byte and the crc32
+    fingerprint of the field names, any payload written by an older codec
+    or an older model schema is refused by raising SchemaMismatchError,
+    so that the caller can drop the stale cache and rebuild it.
+    """
+    VERSION = 1
+    _schemas = {}
+
+    @classmethod
+    def get_schema(cls, model_class):
+        schema = cls._schemas.get(model_class)
+        if schema is not None:
+            return schema
+
+        attnames = tuple(field.attname for field in model_class._meta.concrete_fields)
+        fingerprint = zlib.crc32(','.join(attnames).encode('utf-8'))
+        schema = (attnames, HEADER.pack(cls.VERSION, fingerprint))
+        cls._schemas[model_class] = schema
+        return schema
+
+    @classmethod
+    def is_current_schema(cls, model_class, serialized_data):
+        _, header = cls.get_schema(model_class)
+        return serialized_data[:HEADER.size] == header
+
+    @classmethod
+    def get_pk_prefix(cls, model_class, pk):
+        # the leading bytes of the payload of the instance of pk, by which
+        # its entry could be located, the primary key is the first field
+        attnames, header = cls.get_schema(model_class)
+        if attnames[0] != model_class._meta.pk.attname:
+            raise TypeError('The primary key of {} is not its first field.'.format(
+                model_class.__name__,
+            ))
+        chunks = [header]
+        cls._pack_value(pk, chunks)
+        return b''.join(chunks)
+
+    @classmethod
+    def _pack_value(cls, value, chunks):
+        if value is None:
+            chunks.append(bytes((TAG_NONE,)))
+        elif value is True:
+            chunks.append(bytes((TAG_TRUE,)))
+        elif value is False:
+            chunks.append(bytes((TAG_FALSE,)))
+        elif isinstance(value, int):
+            chunks.append(bytes((TAG_INT,)) + INT64.pack(value))
+        elif isinstance(value, float):
+            chunks.append(bytes((TAG_FLOAT,)) + FLOAT64.pack(value))
+        elif isinstance(value, str):
+            encoded = value.encode('utf-8')
+            chunks.append(bytes((TAG_STR,)) + UINT32.pack(len(encoded)) + encoded)
+        elif isinstance(value, datetime):
+            if value.tzinfo is None:
+                micros = (value - NAIVE_EPOCH) // ONE_MICROSECOND
+                chunks.append(bytes((TAG_NAIVE_DATETIME,)) + INT64.pack(micros))
+            else:
+                micros = (value - EPOCH) // ONE_MICROSECOND
+                chunks.append(bytes((TAG_DATETIME,)) + INT64.pack(micros))
+        elif isinstance(value, date):
+            chunks.append(bytes((TAG_DATE,)) + INT32.pack(value.toordinal()))
+        else:
+            raise TypeError('{} is not supported by CompactModelSerializer.'.format(
+                type(value).__name__,
+            ))
+
+    @classmethod
+    def serialize(cls, instance):
+        attnames, header = cls.get_schema(instance.__class__)
+        chunks = [header]
+        for attname in attnames:
+            cls._pack_value(getattr(instance, attname), chunks)
+        return b''.join(chunks)
+
+    @classmethod
+    def deserialize(cls, model_class, serialized_data):
+        attnames, header = cls.get_schema(model_class)
+        if serialized_data[:HEADER.size] != header:
+            raise SchemaMismatchError(
+                'Cached {} does not match the current schema.'.format(model_class.__name__)
+            )
+
+        values = []
+        offset = HEADER.size
+        for _ in attnames:
+            tag = serialized_data[offset]
+            offset += 1
+            if tag == TAG_INT:
+                values.append(INT64.unpack_from(serialized_data, offset)[0])
+                offset += INT64.size
+            elif tag == TAG_DATETIME:
+                micros = INT64.unpack_from(serialized_data, offset)[0]
+                values.append(EPOCH + timedelta(microseconds=micros))
+                offset += INT64.size
+            elif tag == TAG_STR:
+                length = UINT32.unpack_from(serialized_data, offset)[0]
+                offset += UINT32.size
+                values.append(serialized_data[offset: offset + length].decode('utf-8'))
+                offset += length
+            elif tag == TAG_NONE:
+                values.append(None)
+            elif tag == TAG_TRUE:
+                values.append(True)
+            elif tag == TAG_FALSE:
+                values.append(False)
+            elif tag == TAG_FLOAT:
+                values.append(FLOAT64.unpack_from(serialized_data, offset)[0])
+                offset += FLOAT64.size
+            elif tag == TAG_NAIVE_DATETIME:
+                micros = INT64.unpack_from(serialized_data, offset)[0]
+                values.append(NAIVE_EPOCH + timedelta(microseconds=micros))
+                offset += INT64.size
+            elif tag == TAG_DATE:
+                values.append(date.fromordinal(INT32.unpack_from(serialized_data, offset)[0]))
+                offset += INT32.size
+            else:
+                raise SchemaMismatchError('Unknown type tag {}.'.format(tag))
+
+        # from_db() builds the instance the same way a database row does,
+        # positional values in concrete_fields order is its fastest path
+        return model_class.from_db(None, attnames, values)
@@ -0,0 +1,42 @@
+from rest_framework import renderers
+from utils.json_encoder import ORJSON_OPTIONS, orjson
+
+LINE_SEPARATOR = '\u2028'.encode('utf-8')
+PARAGRAPH_SEPARATOR = '\u2029'.encode('utf-8')
+
+
+def reject_non_native(obj):
+    # called by orjson for what it cannot encode on its own,
+    # e.g. Decimal, lazy strings, or datetimes (passed through)
+    raise TypeError('Type is not JSON serializable: {}'.format(type(obj).__name__))
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """
+    Renders the compact responses through orjson when it is installed.
+    The serialized responses are made of dicts, lists and scalars, any
+    other type makes orjson raise, and the response is left to DRF, the
+    same as the indented ones (e.g. asked by the browsable api). Floats
+    are formatted by orjson the same way as DRF, except NaN and Infinity,
+    which are written as null where DRF raises (STRICT_JSON).
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if orjson is None or indent is not None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            content = orjson.dumps(data, default=reject_non_native, option=ORJSON_OPTIONS)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # escaped the same way as DRF does, to keep the output
+        # a strict javascript subset
+        return content.replace(
+            LINE_SEPARATOR, b'\\u2028',
+        ).replace(
+            PARAGRAPH_SEPARATOR, b'\\u2029',
+        )
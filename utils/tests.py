@@ -1,5 +1,47 @@
 from testing.testcases import TestCase
+from django.core.cache import caches
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from tweets.services import TweetService
+from twitter.cache import USER_TWEETS_PATTERN
 from utils.redis_client import RedisClient
+from utils.memcached_helper import MemcachedHelper
+from utils.identity_map import IdentityMap
+from utils.lazy_cached_list import StaleCachedListError
+from utils.list_serializers import load_fragments
+from utils.local_cache import LocalCache
+from utils.paginations import EndlessPagination
+from accounts.services import UserService
+from twitter.cache import CACHE_FILL_LOCK_PATTERN, LOCAL_CACHE_INVALIDATION_CHANNEL
+from utils.redis_helper import RedisHelper
+from django.conf import settings
+from utils.redis_serializers import (
+    CompactModelSerializer,
+    DjangoModelSerializer,
+    SchemaMismatchError,
+)
+from django.contrib.auth.models import User
+from tweets.models import Tweet
+from newsfeeds.models import NewsFeed
+from rest_framework import renderers
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework.utils.serializer_helpers import ReturnDict
+from utils import json_encoder
+from utils.json_encoder import JSONEncoder
+from utils.renderers import JSONRenderer
+from utils.time_helpers import utc_now
+from django.utils.translation import gettext_lazy
+from unittest import mock, skipUnless
+
+import datetime
+import decimal
+import json
+import pytz
+import threading
+import time
+import uuid
 
 
 class UtilsTestS(TestCase):
@@ -17,3 +59,483 @@ class UtilsTestS(TestCase):
         RedisClient.clear()
         cached_list = conn.lrange('redis_key', 0, -1)
         self.assertEqual(cached_list, [])
+
+    def test_get_objects_through_cache(self):
+        pluto = self.create_user('pluto')
+        brunch = self.create_user('brunch')
+
+        # cache miss, keep the input order, duplicated and unknown ids
+        user_ids = [brunch.id, pluto.id, brunch.id, -1]
+        users = MemcachedHelper.get_objects_through_cache(User, user_ids)
+        self.assertEqual([user.id for user in users], [brunch.id, pluto.id, brunch.id])
+
+        # cache hit, no query would be executed
+        with self.assertNumQueries(0):
+            users = MemcachedHelper.get_objects_through_cache(User, [pluto.id, brunch.id])
+        self.assertEqual([user.username for user in users], ['pluto', 'brunch'])
+
+        # invalidated object is reloaded from database
+        pluto.username = 'plutokitty'
+        pluto.save()
+        users = MemcachedHelper.get_objects_through_cache(User, [pluto.id, brunch.id])
+        self.assertEqual([user.username for user in users], ['plutokitty', 'brunch'])
+
+    def test_load_fragments(self):
+        pluto = self.create_user('pluto')
+        tweets = [self.create_tweet(pluto, str(i)) for i in range(3)]
+        cached = {tweets[0].id: 'cached'}
+        render_fragments = mock.Mock(side_effect=lambda missed: {
+            tweet.id: tweet.content
+            for tweet in missed
+        })
+
+        # only the missed ones are rendered and cached, in one batch each
+        fragments = load_fragments(
+            tweets,
+            'id',
+            lambda ids: {tweet_id: cached[tweet_id] for tweet_id in ids if tweet_id in cached},
+            cached.update,
+            render_fragments,
+        )
+        self.assertEqual(fragments, {tweets[0].id: 'cached', tweets[1].id: '1', tweets[2].id: '2'})
+        render_fragments.assert_called_once_with(tweets[1:])
+        self.assertEqual(cached, fragments)
+
+        # nothing is rendered when all of them are cached
+        render_fragments.reset_mock()
+        load_fragments(tweets, 'id', lambda ids: dict(cached), cached.update, render_fragments)
+        render_fragments.assert_not_called()
+
+    def _assert_same_fields(self, instance, restored):
+        self.assertEqual(instance.__class__, restored.__class__)
+        for field in instance._meta.concrete_fields:
+            self.assertEqual(
+                getattr(instance, field.attname),
+                getattr(restored, field.attname),
+            )
+
+    def test_compact_model_serializer(self):
+        pluto = self.create_user('pluto')
+        tweet = self.create_tweet(pluto, 'Meow 喵 🐱')
+        tweet = Tweet.objects.get(id=tweet.id)
+        data = CompactModelSerializer.serialize(tweet)
+        restored = CompactModelSerializer.deserialize(Tweet, data)
+        self._assert_same_fields(tweet, restored)
+        self.assertEqual(restored.created_at.microsecond, tweet.created_at.microsecond)
+
+        newsfeed = NewsFeed.objects.get(id=self.create_newsfeed(pluto, tweet).id)
+        data = CompactModelSerializer.serialize(newsfeed)
+        restored = CompactModelSerializer.deserialize(NewsFeed, data)
+        self._assert_same_fields(newsfeed, restored)
+
+        # null foreign keys are kept
+        newsfeed.tweet_id = None
+        data = CompactModelSerializer.serialize(newsfeed)
+        self.assertEqual(CompactModelSerializer.deserialize(NewsFeed, data).tweet_id, None)
+
+        # payload of another model or of the old json serializer is refused
+        with self.assertRaises(SchemaMismatchError):
+            CompactModelSerializer.deserialize(NewsFeed, CompactModelSerializer.serialize(tweet))
+        with self.assertRaises(SchemaMismatchError):
+            CompactModelSerializer.deserialize(
+                Tweet,
+                DjangoModelSerializer.serialize(tweet).encode('utf-8'),
+            )
+
+    def test_push_object(self):
+        pluto = self.create_user('pluto')
+        limit = settings.REDIS_LIST_LENGTH_LIMIT
+        tweets = [self.create_tweet(pluto, str(i)) for i in range(limit)]
+        queryset = Tweet.objects.filter(user=pluto).order_by('-created_at')
+        RedisClient.clear()
+        conn = RedisClient.get_connection()
+
+        # the list does not exist, it is built from queryset
+        RedisHelper.push_object('tweets', tweets[-1], queryset)
+        self.assertEqual(conn.llen('tweets'), limit)
+        self.assertNotEqual(conn.ttl('tweets'), -1)
+
+        # the list exists, the object is pushed and the list is trimmed
+        tweet = self.create_tweet(pluto, 'new')
+        RedisHelper.push_object('tweets', tweet, queryset)
+        self.assertEqual(conn.llen('tweets'), limit)
+        cached_tweets = RedisHelper.download_objects_from_cache('tweets', queryset)
+        self.assertEqual(cached_tweets[0].id, tweet.id)
+        self.assertEqual(cached_tweets[-1].id, tweets[1].id)
+
+        # the list is being filled by another request whose queryset
+        # has not seen the object, it is pushed after the fill
+        lock_key = CACHE_FILL_LOCK_PATTERN.format(key='tweets')
+
+        def fill_by_another_request(objects):
+            time.sleep(settings.REDIS_FILL_POLL_INTERVAL * 2)
+            RedisHelper._upload_objects_to_cache('tweets', objects)
+            conn.delete(lock_key)
+
+        def push_while_filling(obj, filled_objects):
+            conn.delete('tweets')
+            conn.set(lock_key, 'another filler')
+            filler = threading.Thread(target=fill_by_another_request, args=(filled_objects,))
+            filler.start()
+            RedisHelper.push_object('tweets', obj, queryset)
+            filler.join()
+
+        stale_tweets = list(queryset.all())
+        tweet = self.create_tweet(pluto, 'newer')
+        push_while_filling(tweet, stale_tweets)
+        cached_tweets = RedisHelper.download_objects_from_cache('tweets', queryset)
+        self.assertEqual(cached_tweets[0].id, tweet.id)
+        self.assertEqual(len(cached_tweets), limit)
+
+        # but not twice if the filler has seen it
+        push_while_filling(tweet, list(queryset.all()))
+        cached_tweets = RedisHelper.download_objects_from_cache('tweets', queryset)
+        self.assertEqual([tweet.id for tweet in cached_tweets], [tweet.id for tweet in queryset.all()])
+
+    def test_remove_and_replace_object(self):
+        pluto = self.create_user('pluto')
+        tweets = [self.create_tweet(pluto, str(i)) for i in range(3)]
+        queryset = Tweet.objects.filter(user=pluto).order_by('-created_at')
+        RedisClient.clear()
+        conn = RedisClient.get_connection()
+        RedisHelper.download_objects_from_cache('tweets', queryset)
+
+        # only the entry is replaced or removed, the list is kept
+        tweets[1].content = 'edited'
+        RedisHelper.replace_object('tweets', tweets[1])
+        RedisHelper.remove_object('tweets', tweets[0])
+        cached_tweets = RedisHelper.download_objects_from_cache('tweets', queryset)
+        self.assertEqual([tweet.id for tweet in cached_tweets], [tweets[2].id, tweets[1].id])
+        self.assertEqual(cached_tweets[1].content, 'edited')
+
+        # the list is dropped if the entry cannot be located
+        conn.lset('tweets', 0, DjangoModelSerializer.serialize(tweets[2]))
+        RedisHelper.remove_object('tweets', tweets[2])
+        self.assertFalse(conn.exists('tweets'))
+
+        # only the head of the list is scanned
+        RedisHelper.download_objects_from_cache('tweets', queryset)
+        with override_settings(REDIS_LIST_SCAN_WINDOW=1):
+            RedisHelper.replace_object('tweets', tweets[2])
+            self.assertTrue(conn.exists('tweets'))
+            RedisHelper.replace_object('tweets', tweets[1])
+            self.assertFalse(conn.exists('tweets'))
+
+    def test_lazy_cached_list(self):
+        pluto = self.create_user('pluto')
+        limit = settings.REDIS_LIST_LENGTH_LIMIT
+        for i in range(limit):
+            self.create_tweet(pluto, str(i))
+        queryset = Tweet.objects.filter(user=pluto).order_by('-created_at')
+        tweets = list(queryset.all())
+        RedisClient.clear()
+
+        # cold cache, the list is built from queryset
+        cached_tweets = RedisHelper.load_lazy_cached_list('tweets', queryset)
+        self.assertEqual([tweet.id for tweet in cached_tweets], [tweet.id for tweet in tweets])
+
+        # warm cache, only the probed and the sliced entries are deserialized
+        cached_tweets = RedisHelper.load_lazy_cached_list('tweets', queryset)
+        self.assertEqual(len(cached_tweets), limit)
+        self.assertEqual(cached_tweets.materialized_count, 0)
+        self.assertEqual(cached_tweets[-1].id, tweets[-1].id)
+        page = cached_tweets[5:8]
+        self.assertEqual([tweet.id for tweet in page], [tweet.id for tweet in tweets[5:8]])
+        self.assertEqual(cached_tweets.materialized_count, 4)
+
+        # stale entries are rebuilt
+        conn = RedisClient.get_connection()
+        conn.lset('tweets', -1, DjangoModelSerializer.serialize(tweets[-1]))
+        cached_tweets = RedisHelper.load_lazy_cached_list('tweets', queryset)
+        self.assertEqual(cached_tweets[-1].id, tweets[-1].id)
+        cached_tweets = RedisHelper.load_lazy_cached_list('tweets', queryset)
+        self.assertEqual(cached_tweets.materialized_count, 0)
+
+        # an entry in an older schema is only found when it is materialized,
+        # the page is read from database instead
+        conn.lset('tweets', 10, DjangoModelSerializer.serialize(tweets[10]))
+        cached_tweets = RedisHelper.load_lazy_cached_list('tweets', queryset)
+        with self.assertRaises(StaleCachedListError):
+            cached_tweets[10]
+        request = Request(APIRequestFactory().get('/', {
+            'created_at__lt': tweets[9].created_at.isoformat(),
+        }))
+        self.assertIsNone(EndlessPagination().paginate_cached_list(cached_tweets, request))
+        conn.lset('tweets', 10, CompactModelSerializer.serialize(tweets[10]))
+
+        # a push shifts the entries which are not loaded yet,
+        # even if the length is kept by LTRIM
+        cached_tweets = RedisHelper.load_lazy_cached_list('tweets', queryset)
+        RedisHelper.push_object('tweets', self.create_tweet(pluto, 'new'), queryset)
+        self.assertEqual(conn.llen('tweets'), limit)
+        with self.assertRaises(StaleCachedListError):
+            cached_tweets[10]
+        self.assertIsNone(EndlessPagination().paginate_cached_list(cached_tweets, request))
+        cached_tweets = RedisHelper.load_lazy_cached_list('tweets', queryset)
+        cached_tweets[0]
+        RedisHelper.push_object('tweets', self.create_tweet(pluto, 'newer'), queryset)
+        page = EndlessPagination().paginate_merged_lists([(cached_tweets, queryset)], request)
+        self.assertEqual([tweet.id for tweet in page], [tweet.id for tweet in tweets[10:]])
+
+        # so does a list expired meanwhile
+        cached_tweets = RedisHelper.load_lazy_cached_list('tweets', queryset)
+        conn.delete('tweets')
+        with self.assertRaises(StaleCachedListError):
+            cached_tweets[10]
+        # the loaded entries are still served
+        self.assertEqual(cached_tweets[0].id, queryset[0].id)
+
+    def test_get_counts(self):
+        pluto = self.create_user('pluto')
+        tweets = [self.create_tweet(pluto, str(i)) for i in range(3)]
+        Tweet.objects.filter(id=tweets[0].id).update(likes_count=2, comments_count=1)
+        RedisHelper.get_count(tweets[1], 'likes_count')
+        conn = RedisClient.get_connection()
+        self.assertNotEqual(conn.ttl(RedisHelper.get_count_key(tweets[1], 'likes_count')), -1)
+
+        # the misses are loaded by one query
+        attrs = ['likes_count', 'comments_count']
+        with self.assertNumQueries(1):
+            counts = RedisHelper.get_counts(tweets, attrs)
+        self.assertEqual(counts[(tweets[0].id, 'likes_count')], 2)
+        self.assertEqual(counts[(tweets[0].id, 'comments_count')], 1)
+        self.assertEqual(counts[(tweets[2].id, 'likes_count')], 0)
+        self.assertNotEqual(conn.ttl(RedisHelper.get_count_key(tweets[0], 'likes_count')), -1)
+
+        # all hit
+        RedisHelper.incr_count(tweets[2], 'comments_count')
+        with self.assertNumQueries(0):
+            counts = RedisHelper.get_counts(tweets, attrs)
+        self.assertEqual(counts[(tweets[2].id, 'comments_count')], 1)
+        self.assertEqual(len(counts), 6)
+
+    @override_settings(LOCAL_CACHE_MAX_SIZE=2)
+    def test_local_cache(self):
+        pluto = self.create_user('pluto')
+        brunch = self.create_user('brunch')
+
+        # read through, then served by the local cache without memcached
+        MemcachedHelper.get_object_through_cache(User, pluto.id)
+        caches['testing'].clear()
+        with self.assertNumQueries(0):
+            user = MemcachedHelper.get_object_through_cache(User, pluto.id)
+        self.assertEqual(user.username, 'pluto')
+        # every read gets its own copy
+        user._cached_user_profile = None
+        user = MemcachedHelper.get_object_through_cache(User, pluto.id)
+        self.assertEqual(hasattr(user, '_cached_user_profile'), False)
+
+        # least recently used entry is evicted
+        MemcachedHelper.get_objects_through_cache(User, [brunch.id])
+        UserService.get_profile_through_cache(pluto.id)
+        self.assertEqual(LocalCache.stats()['evictions'], 1)
+        self.assertEqual(LocalCache.get(MemcachedHelper.get_key(User, pluto.id)), None)
+
+        # invalidated by save in this process
+        profile = UserService.get_profile_through_cache(pluto.id)
+        profile.nickname = 'plutokitty'
+        profile.save()
+        profile = UserService.get_profile_through_cache(pluto.id)
+        self.assertEqual(profile.nickname, 'plutokitty')
+
+        # invalidated by a message from another process
+        key = MemcachedHelper.get_key(User, brunch.id)
+        RedisClient.get_connection().publish(LOCAL_CACHE_INVALIDATION_CHANNEL, key)
+        for _ in range(50):
+            if key not in LocalCache._entries:
+                break
+            time.sleep(0.01)
+        self.assertNotIn(key, LocalCache._entries)
+        stats = LocalCache.stats()
+        self.assertEqual(stats['hits'] > 0 and stats['misses'] > 0, True)
+
+        # a forked process drops the copied entries and subscribes again
+        MemcachedHelper.get_object_through_cache(User, brunch.id)
+        subscriber = LocalCache._subscriber
+        with mock.patch('utils.local_cache.os.getpid', return_value=-1):
+            self.assertEqual(LocalCache.get(key), None)
+            self.assertNotEqual(LocalCache._subscriber, subscriber)
+            self.assertEqual(LocalCache._subscriber_pid, -1)
+            MemcachedHelper.get_object_through_cache(User, brunch.id)
+            RedisClient.get_connection().publish(LOCAL_CACHE_INVALIDATION_CHANNEL, key)
+            for _ in range(50):
+                if key not in LocalCache._entries:
+                    break
+                time.sleep(0.01)
+            self.assertNotIn(key, LocalCache._entries)
+
+    def test_json_dumps(self):
+        now = utc_now()
+        payload = {
+            'aware': now,
+            'naive': datetime.datetime(2021, 3, 1, 8, 30, 5, 123456),
+            'shanghai': now.astimezone(pytz.timezone('Asia/Shanghai')),
+            'date': now.date(),
+            'time': datetime.time(8, 30, 5, 123456),
+            'timedelta': datetime.timedelta(days=1, seconds=5),
+            'decimal': decimal.Decimal('3.14'),
+            'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+            'lazy': gettext_lazy('Meow'),
+            'content': 'Meow 喵 🐱 "quoted" \\ \n',
+            1: [None, True, False, 0, -1, 1.5, 2 ** 63 - 1],
+            'nested': [{'id': 1, 'created_at': now}],
+        }
+        expected = json.dumps(
+            payload,
+            cls=JSONEncoder,
+            ensure_ascii=False,
+            separators=(',', ':'),
+        ).encode('utf-8')
+
+        # orjson (when installed) and the fallback give the same bytes as JSONEncoder
+        self.assertEqual(json_encoder.dumps(payload), expected)
+        with mock.patch.object(json_encoder, 'orjson', None):
+            self.assertEqual(json_encoder.dumps(payload), expected)
+            self.assertEqual(json_encoder.loads(expected), json.loads(expected))
+        self.assertEqual(json_encoder.loads(expected), json.loads(expected))
+        # integers beyond 64 bits are left to the stdlib json
+        self.assertEqual(json_encoder.dumps({'big': 2 ** 70}), b'{"big":1180591620717411303424}')
+        with self.assertRaises(TypeError):
+            json_encoder.dumps({'user': object()})
+
+        # the redis json codec still restores the instance
+        pluto = self.create_user('pluto')
+        tweet = Tweet.objects.get(id=self.create_tweet(pluto, 'Meow 喵').id)
+        restored = DjangoModelSerializer.deserialize(DjangoModelSerializer.serialize(tweet))
+        self._assert_same_fields(tweet, restored)
+
+    @skipUnless(json_encoder.orjson, 'orjson is not installed')
+    def test_json_dumps_through_orjson(self):
+        payload = {
+            'created_at': utc_now(),
+            'content': 'Meow 喵',
+            1: [None, True, 1.5, 2 ** 63 - 1],
+        }
+        with mock.patch.object(json_encoder._encoder, 'encode') as stdlib_encode:
+            data = json_encoder.dumps(payload)
+        stdlib_encode.assert_not_called()
+        self.assertEqual(data, json.dumps(
+            payload,
+            cls=JSONEncoder,
+            ensure_ascii=False,
+            separators=(',', ':'),
+        ).encode('utf-8'))
+
+    def test_json_renderer(self):
+        data = ReturnDict({
+            'results': [
+                {'id': i, 'content': 'line\u2028paragraph\u2029喵', 'created_at': '2021-03-01T08:30:05.123456Z'}
+                for i in range(20)
+            ],
+            'has_next_page': False,
+        }, serializer=None)
+        self.assertEqual(JSONRenderer().render(data), renderers.JSONRenderer().render(data))
+        self.assertEqual(JSONRenderer().render(None), b'')
+        # floats come out the same, the other types are left to DRF
+        data['results'][0]['score'] = 0.1 + 0.2
+        data['results'][1]['score'] = 1e16
+        self.assertEqual(JSONRenderer().render(data), renderers.JSONRenderer().render(data))
+        data['results'][0]['score'] = decimal.Decimal('0.3')
+        data['results'][1]['lazy'] = gettext_lazy('Meow')
+        data['results'][2]['created_at'] = utc_now()
+        data['results'][3]['big'] = 2 ** 70
+        self.assertEqual(JSONRenderer().render(data), renderers.JSONRenderer().render(data))
+        with mock.patch('utils.renderers.orjson', None):
+            self.assertEqual(JSONRenderer().render(data), renderers.JSONRenderer().render(data))
+        # indented output is left to DRF
+        self.assertEqual(
+            JSONRenderer().render(data, 'application/json; indent=4'),
+            renderers.JSONRenderer().render(data, 'application/json; indent=4'),
+        )
+
+        # responses of the api are rendered by it
+        pluto = self.create_user('pluto')
+        self.create_tweet(pluto, 'Meow\u2028喵')
+        response = APIClient().get('/api/tweets/', {'user_id': pluto.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, renderers.JSONRenderer().render(response.data))
+
+    def test_identity_map(self):
+        pluto = self.create_user('pluto')
+        brunch = self.create_user('brunch')
+
+        IdentityMap.begin()
+        users = MemcachedHelper.get_objects_through_cache(User, [pluto.id, brunch.id])
+        profiles = UserService.get_profiles_through_cache([pluto.id])
+        # loaded once per request, even without memcached, the same instances are shared
+        caches['testing'].clear()
+        LocalCache.clear()
+        with self.assertNumQueries(0):
+            user = MemcachedHelper.get_object_through_cache(User, pluto.id)
+            same_users = MemcachedHelper.get_objects_through_cache(User, [brunch.id, pluto.id])
+            same_profiles = UserService.get_profiles_through_cache([pluto.id])
+        self.assertIs(user, users[0])
+        self.assertIs(same_users[0], users[1])
+        self.assertIs(same_profiles[pluto.id], profiles[pluto.id])
+        self.assertEqual(IdentityMap.get_dedupes(), 4)
+
+        # invalidated objects are loaded again
+        pluto.username = 'plutokitty'
+        pluto.save()
+        user = MemcachedHelper.get_object_through_cache(User, pluto.id)
+        self.assertEqual(user.username, 'plutokitty')
+        self.assertEqual(IdentityMap.end(), 4)
+
+        # inactive outside a request
+        MemcachedHelper.get_object_through_cache(User, pluto.id)
+        caches['testing'].clear()
+        LocalCache.clear()
+        with self.assertNumQueries(1):
+            MemcachedHelper.get_object_through_cache(User, pluto.id)
+        self.assertEqual(IdentityMap.get_dedupes(), 0)
+
+        # each request gets its own map, the dedupe count is reported
+        tweet = self.create_tweet(pluto)
+        for i in range(3):
+            self.create_comment(pluto, tweet, str(i))
+        with self.assertLogs('utils.middleware', level='DEBUG') as logs:
+            response = APIClient().get('/api/tweets/{}/'.format(tweet.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(logs.output[0], r'GET /api/tweets/\d+/: [1-9]\d* object loads deduplicated')
+        self.assertEqual(IdentityMap.get_dedupes(), 0)
+
+
+class SingleFlightCacheFillTests(TransactionTestCase):
+    # reader threads have their own database connections,
+    # the data must be committed to be seen by them
+
+    def setUp(self):
+        RedisClient.clear()
+        caches['testing'].clear()
+        LocalCache.clear()
+
+    def test_parallel_cold_readers(self):
+        pluto = User.objects.create_user('pluto')
+        tweets = [Tweet.objects.create(user=pluto, content=str(i)) for i in range(5)]
+        tweet_ids = [tweet.id for tweet in tweets[::-1]]
+        RedisClient.clear()
+
+        readers = 8
+        barrier = threading.Barrier(readers)
+        results = []
+        query_counts = []
+
+        def read():
+            barrier.wait()
+            with CaptureQueriesContext(connection) as context:
+                cached_tweets = TweetService.get_cached_tweets(pluto.id)
+            results.append([tweet.id for tweet in cached_tweets])
+            query_counts.append(len(context.captured_queries))
+            connection.close()
+
+        threads = [threading.Thread(target=read) for _ in range(readers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sum(query_counts), 1)
+        self.assertEqual(results, [tweet_ids] * readers)
+        conn = RedisClient.get_connection()
+        key = USER_TWEETS_PATTERN.format(user_id=pluto.id)
+        self.assertEqual(conn.llen(key), len(tweet_ids))
@@ -1,2 +1,3 @@
 # in seconds
 ONE_HOUR = 60 * 60
+ONE_DAY = 24 * ONE_HOUR
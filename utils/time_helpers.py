@@ -1,6 +1,15 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
 
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
 
 def utc_now():
-    return datetime.now().replace(tzinfo=pytz.utc)
\ No newline at end of file
+    return datetime.now().replace(tzinfo=pytz.utc)
+
+
+def datetime_to_microseconds(dt):
+    # an integer number of microseconds since epoch, which is still
+    # exactly representable as a redis sorted set score (double)
+    return (dt - EPOCH) // ONE_MICROSECOND